@@ -3,7 +3,8 @@ from django.contrib import admin
 # Register your models here.
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import GUser, TopicCircle, Post, Comment, Report
+from django.utils import timezone
+from .models import GUser, TopicCircle, Post, Comment, Report, Job
 
 @admin.register(GUser)
 class GUserAdmin(UserAdmin):
@@ -26,6 +27,7 @@ class TopicCircleAdmin(admin.ModelAdmin):
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ('user', 'circle', 'created_at', 'is_pinned', 'likes', 'dislikes')
+    list_select_related = ('user', 'circle')
     list_filter = ('circle', 'is_pinned')
     actions = ['pin_posts', 'delete_posts']
 
@@ -40,12 +42,24 @@ class PostAdmin(admin.ModelAdmin):
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('user', 'post', 'created_at')
+    list_select_related = ('user', 'post__user', 'post__circle')  # Post.__str__ reads both
 
 @admin.register(Report)
 class ReportAdmin(admin.ModelAdmin):
     list_display = ('user', 'post', 'created_at', 'is_resolved')
+    list_select_related = ('user', 'post__user', 'post__circle')
     actions = ['resolve_reports']
 
     def resolve_reports(self, request, queryset):
         queryset.update(is_resolved=True)
-    resolve_reports.short_description = "Mark selected reports as resolved"
\ No newline at end of file
+    resolve_reports.short_description = "Mark selected reports as resolved"
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'priority', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'task')
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        queryset.filter(status=Job.FAILED).update(status=Job.QUEUED, attempts=0, run_at=timezone.now())
+    retry_jobs.short_description = "Retry selected failed jobs"
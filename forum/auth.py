@@ -0,0 +1,97 @@
+"""
+Per-process cache of logged-in users.
+
+``CachedModelBackend.get_user`` is what ``AuthenticationMiddleware`` calls on
+every request to turn the session's user id into ``request.user``. The
+stock backend runs a query each time; this one keeps recently seen users in a
+small LRU for ``USER_CACHE['TTL']`` seconds. Entries are checked against the
+``user:<id>`` version stamp (forum/versions.py), which forum/signals.py bumps
+whenever a GUser is saved or deleted, so a nickname, password or ``is_admin``
+change shows up on the next request in every process once the stamp does.
+That needs a cache every worker shares (``stamps_shared()``): with the
+per-process LocMemCache and several workers the other workers would never see
+the bump and would keep a demoted admin or an old password's session hash for
+up to ``TTL``, so there the cache is skipped and every request asks the
+database, as the stock backend does.
+
+Callers get a deep copy: views such as ``profile`` mutate ``request.user``
+in place, and that must not leak into other requests.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+from .versions import get_version, stamps_shared
+
+DEFAULTS = {
+    'TTL': 60,
+    'MAX_ENTRIES': 1000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'USER_CACHE', {})}
+
+
+class UserCache:
+    def __init__(self, ttl=60, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # pk -> (user, version, expires)
+        self.lock = threading.Lock()
+
+    def get(self, pk, version):
+        with self.lock:
+            entry = self.entries.get(pk)
+            if entry is None:
+                return None
+            user, cached_version, expires = entry
+            if cached_version != version or expires < time.monotonic():
+                del self.entries[pk]
+                return None
+            self.entries.move_to_end(pk)
+        return copy.deepcopy(user)
+
+    def set(self, user, version):
+        user = copy.deepcopy(user)
+        with self.lock:
+            self.entries[user.pk] = (user, version, time.monotonic() + self.ttl)
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, pk):
+        with self.lock:
+            self.entries.pop(pk, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+config = get_config()
+user_cache = UserCache(config['TTL'], config['MAX_ENTRIES'])
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        try:
+            pk = int(user_id)
+        except (TypeError, ValueError):
+            return super().get_user(user_id)
+        if not stamps_shared():
+            return super().get_user(pk)
+        version = get_version(f'user:{pk}')
+        user = user_cache.get(pk, version)
+        if user is None:
+            user = super().get_user(pk)
+            if user is not None:
+                user_cache.set(user, version)
+        return user
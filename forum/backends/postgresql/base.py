@@ -0,0 +1,103 @@
+"""
+PostgreSQL backend that times connection setup and can pool connections.
+
+Set ``DATABASES[alias]['POOL'] = {'MAX_SIZE': 4}`` (see forum/dbpool.py for
+the other keys) to keep connections open in a per-process pool; Django's
+close() then hands the connection back instead of closing it, so use it with
+``CONN_MAX_AGE = 0``. Without ``POOL`` this is the stock backend plus the
+``forum_db_connect_seconds`` metric.
+"""
+import os
+import threading
+import time
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from forum.dbpool import ConnectionPool
+from forum.profiling import record_connect
+
+
+def check(conn):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except Exception:
+        return False
+
+
+def reset(conn):
+    """
+    Clear whatever the last user left behind; False if the connection is broken.
+
+    Rolling back ends an open transaction, and ``DISCARD ALL`` drops session
+    state a rollback keeps: SET parameters, temporary tables (forum/transfer.py
+    makes one), prepared statements, advisory locks and LISTENs. Django's
+    ``init_connection_state`` sets the time zone and role again on checkout.
+    """
+    if conn.closed:
+        return False
+    try:
+        conn.rollback()
+        # DISCARD ALL can't run inside a transaction block
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('DISCARD ALL')
+        finally:
+            conn.autocommit = autocommit
+    except Exception:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pools = {}  # (alias, pid) -> ConnectionPool
+    pools_lock = threading.Lock()
+
+    def pool(self):
+        config = self.settings_dict.get('POOL')
+        if not config:
+            return None
+        # a forked worker must not share its parent's sockets
+        key = self.alias, os.getpid()
+        with self.pools_lock:
+            if key not in self.pools:
+                self.pools[key] = ConnectionPool(
+                    self.connect_new,
+                    max_size=config.get('MAX_SIZE', 4),
+                    timeout=config.get('TIMEOUT', 10),
+                    max_idle=config.get('MAX_IDLE', 300),
+                    check_after=config.get('CHECK_AFTER', 30),
+                    check=check,
+                    reset=reset,
+                )
+            return self.pools[key]
+
+    def connect_new(self):
+        return super().get_new_connection(self.get_connection_params())
+
+    def get_new_connection(self, conn_params):
+        started = time.perf_counter()
+        pool = self.pool()
+        if pool is None:
+            conn = super().get_new_connection(conn_params)
+            record_connect(self.alias, time.perf_counter() - started, 'new')
+            return conn
+        conn, waited, reused = pool.acquire()
+        if reused:
+            # normally set by the stock get_new_connection, which a pooled connection skips
+            self.isolation_level = IsolationLevel(
+                self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED)
+            )
+        record_connect(self.alias, time.perf_counter() - started, 'pooled' if reused else 'new', waited)
+        return conn
+
+    def _close(self):
+        pool = self.pool()
+        if pool is None or self.connection is None:
+            return super()._close()
+        # reset() cleans the session or, if the connection is broken, drops it
+        pool.release(self.connection)
@@ -0,0 +1,337 @@
+"""
+Synthetic data and view benchmarks.
+
+``seed_forum`` bulk-creates a forum of any size and ``bench_forum`` times the
+main views against it, reporting latency percentiles and query counts as JSON
+so two commits can be compared with ``bench_forum --compare old.json``.
+Everything runs in-process through the Django test client, so it needs no
+network and works on SQLite or a local PostgreSQL.
+
+``run_concurrency`` drives the geocode endpoint against a deliberately slow
+stub upstream, once through the WSGI handler with a fixed number of worker
+threads and once through the ASGI handler on one event loop, to show how many
+slow requests one process can have in flight.
+
+``run_connections`` measures what a connection costs: a query on a brand new
+connection, on a pooled one and on one kept open, so the effect of
+``CONN_MAX_AGE`` or ``DB_POOL_SIZE`` against a given server can be read off
+directly.
+"""
+import asyncio
+import io
+import random
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client, AsyncClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .geocoding import reset_geocoder
+from .models import GUser, TopicCircle, Post, Comment, Report, UserCircleFollow
+
+BENCH_PASSWORD = 'benchpass'
+WORDS = ('campus library exam lecture coffee football society housing bus weather '
+         'project deadline canteen concert gym river rent friends music hiking').split()
+
+
+def batches(total, size):
+    start = 0
+    while start < total:
+        yield start, min(size, total - start)
+        start += size
+
+
+def fake_text(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed_forum(users=100, circles=20, posts=1000, comments_per_post=3, follows_per_user=5,
+               reports=50, batch_size=2000, seed=0, log=None):
+    """Top the database up to the given sizes with bulk inserts. Returns the new totals."""
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+
+    existing = GUser.objects.filter(username__startswith='bench').count()
+    if existing < users:
+        password = make_password(BENCH_PASSWORD)
+        GUser.objects.bulk_create([
+            GUser(username=f'bench{i}', email=f'bench{i}@example.com', password=password)
+            for i in range(existing, users)
+        ], batch_size=batch_size)
+        log(f"users: {users}")
+    user_ids = list(GUser.objects.filter(username__startswith='bench').values_list('id', flat=True))
+
+    existing = TopicCircle.objects.filter(name__startswith='Bench Circle').count()
+    if existing < circles:
+        TopicCircle.objects.bulk_create([
+            TopicCircle(name=f'Bench Circle {i}', description=fake_text(rng, 8))
+            for i in range(existing, circles)
+        ], batch_size=batch_size)
+        log(f"circles: {circles}")
+    circle_ids = list(TopicCircle.objects.filter(name__startswith='Bench Circle').values_list('id', flat=True))
+
+    existing = Post.objects.count()
+    for start, size in batches(max(posts - existing, 0), batch_size):
+        created = Post.objects.bulk_create([
+            Post(user_id=rng.choice(user_ids), circle_id=rng.choice(circle_ids), content=fake_text(rng),
+                 likes=int(rng.paretovariate(1.5)), dislikes=rng.randint(0, 3),
+                 is_recommended=rng.random() < 0.001, is_pinned=rng.random() < 0.001)
+            for _ in range(size)
+        ])
+        # spread creation times over the past year so date sorts and rollups mean something
+        for offset, post in enumerate(created):
+            post.created_at = now - timezone.timedelta(minutes=(existing + start + offset) % 525600)
+        Post.objects.bulk_update(created, ['created_at'])
+        comments = []
+        for post in created:
+            for _ in range(rng.randint(0, comments_per_post * 2)):
+                comments.append(Comment(user_id=rng.choice(user_ids), post=post, content=fake_text(rng, 6),
+                                        likes=rng.randint(0, 10)))
+        Comment.objects.bulk_create(comments, batch_size=batch_size)
+        log(f"posts: {existing + start + size}/{posts}")
+
+    follows = [
+        UserCircleFollow(user_id=user_id, circle_id=circle_id)
+        for user_id in user_ids
+        for circle_id in rng.sample(circle_ids, min(follows_per_user, len(circle_ids)))
+    ]
+    UserCircleFollow.objects.bulk_create(follows, batch_size=batch_size, ignore_conflicts=True)
+
+    existing = Report.objects.count()
+    if existing < reports:
+        post_ids = list(Post.objects.order_by('?').values_list('id', flat=True)[:reports - existing])
+        Report.objects.bulk_create([
+            Report(user_id=rng.choice(user_ids), post_id=post_id, reason=fake_text(rng, 5),
+                   is_resolved=rng.random() < 0.5)
+            for post_id in post_ids
+        ], batch_size=batch_size)
+
+    # bulk_create skips signals, so rebuild everything they normally maintain
+    for command in ('reconcile_counts', 'rebuild_search_index', 'rebuild_stats', 'rebuild_trending'):
+        call_command(command, stdout=io.StringIO())
+    return {
+        'users': GUser.objects.count(),
+        'circles': TopicCircle.objects.count(),
+        'posts': Post.objects.count(),
+        'comments': Comment.objects.count(),
+        'reports': Report.objects.count(),
+    }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings, queries):
+    return {
+        'n': len(timings),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+    }
+
+
+def bench_requests(rng):
+    """(name, method, url) for every benchmarked endpoint, picking fresh targets each call."""
+    circle = TopicCircle.objects.filter(name__startswith='Bench Circle').order_by('-post_count').first()
+    post = Post.objects.order_by('-comment_count').first()
+    comment = Comment.objects.filter(post=post).first()
+    word = rng.choice(WORDS)
+    endpoints = [
+        ('home', 'get', reverse('home')),
+        ('circle_detail', 'get', reverse('circle_detail', args=[circle.id])),
+        ('post_detail', 'get', reverse('post_detail', args=[post.id])),
+        ('all_circles', 'get', reverse('all_circles')),
+        ('search', 'get', reverse('search') + f'?q={word}'),
+        ('profile', 'get', reverse('profile')),
+        ('like_post', 'get', reverse('like_post', args=[post.id])),
+        ('dislike_post', 'get', reverse('dislike_post', args=[post.id])),
+    ]
+    if comment:
+        endpoints += [
+            ('like_comment', 'get', reverse('like_comment', args=[comment.id])),
+            ('dislike_comment', 'get', reverse('dislike_comment', args=[comment.id])),
+        ]
+    return endpoints
+
+
+def run_benchmarks(iterations=50, warmup=5, only=None, seed=0):
+    rng = random.Random(seed)
+    client = Client()
+    user = GUser.objects.filter(username__startswith='bench').order_by('id').first()
+    client.force_login(user)
+    results = {}
+    # one user liking the same post fifty times is exactly what the rate limiter refuses
+    with override_settings(ALLOWED_HOSTS=['*'], RATE_LIMITS={'ENABLED': False}):
+        for name, method, url in bench_requests(rng):
+            if only and name not in only:
+                continue
+            timings, queries = [], []
+            for i in range(warmup + iterations):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url)
+                    elapsed = (time.perf_counter() - started) * 1000
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{name} returned {response.status_code}")
+                if i >= warmup:
+                    timings.append(elapsed)
+                    queries.append(len(captured))
+            results[name] = summarize(timings, queries)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'database': connection.vendor,
+        'timestamp': timezone.now().isoformat(),
+    }
+
+
+def compare(old, new, threshold=0.2):
+    """Rows of (size, endpoint, metric, old, new, regressed) for everything both runs measured."""
+    rows = []
+    for size, endpoints in new['runs'].items():
+        for endpoint, stats in endpoints['results'].items():
+            before = old.get('runs', {}).get(size, {}).get('results', {}).get(endpoint)
+            if not before:
+                continue
+            for metric in ('p50_ms', 'p99_ms', 'queries'):
+                regressed = stats[metric] > before[metric] * (1 + threshold) if metric != 'queries' \
+                    else stats[metric] > before[metric]
+                rows.append((size, endpoint, metric, before[metric], stats[metric], regressed))
+    return rows
+
+
+def geocode_url(i):
+    # distinct coordinates so every request misses the geocoder cache
+    return reverse('geocode') + f'?lat={(i % 1800) / 10 - 89.9:.1f}&lon={i // 1800 % 360 - 179.9:.1f}'
+
+
+def throughput(started, latencies):
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+    }
+
+
+def run_wsgi(concurrency, total, threads):
+    """``total`` requests from ``concurrency`` callers into a WSGI worker with ``threads`` threads."""
+    client = Client()  # one per benchmark is fine, the handler itself is thread-safe
+
+    def one(i):
+        started = time.perf_counter()
+        response = client.get(geocode_url(i))
+        assert response.status_code == 200, response.status_code
+        return (time.perf_counter() - started) * 1000
+
+    # callers beyond the worker's threads queue, as they would in front of gunicorn
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(concurrency, threads)) as pool:
+        latencies = list(pool.map(one, range(total)))
+    return throughput(started, latencies)
+
+
+def run_asgi(concurrency, total):
+    """``total`` requests, ``concurrency`` at a time, into the ASGI handler on one event loop."""
+    async def main():
+        client = AsyncClient()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with limit:
+                started = time.perf_counter()
+                response = await client.get(geocode_url(i))
+                assert response.status_code == 200, response.status_code
+                return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one(i) for i in range(total)))
+        return throughput(started, latencies)
+
+    # as served by uvicorn workers: one long-lived loop, upstream calls awaited on it
+    with override_settings(SERVER_MODE='asgi'):
+        return asyncio.run(main())
+
+
+def run_concurrency(levels=(1, 10, 50, 100), delay=0.2, threads=1, requests_per_level=None):
+    """WSGI vs ASGI throughput at each concurrency level with an upstream that takes ``delay`` seconds."""
+    geocoder = {'BACKEND': 'forum.geocoding.StubBackend', 'OPTIONS': {'delay': delay},
+                'PRECISION': 6, 'DEFERRED': False}
+    results = {}
+    with override_settings(ALLOWED_HOSTS=['*'], GEOCODER=geocoder):
+        for level in levels:
+            total = requests_per_level or level * 4
+            results[str(level)] = {}
+            for mode, run in (('wsgi', lambda: run_wsgi(level, total, threads)), ('asgi', lambda: run_asgi(level, total))):
+                reset_geocoder('GEOCODER')  # start each run with an empty cache
+                results[str(level)][mode] = run()
+    return results
+
+
+def run_connections(alias='default', iterations=100, warmup=5):
+    """Latency of ``SELECT 1`` with a new, pooled or persistent connection to ``alias``."""
+    configured = connections[alias]
+    backend = type(configured)
+
+    def query(wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+
+    def fresh(settings_dict):
+        def run():
+            wrapper = backend(settings_dict, alias)
+            try:
+                query(wrapper)
+            finally:
+                wrapper.close()
+        return run
+
+    persistent = backend(configured.settings_dict, alias)
+    modes = {
+        'new': fresh({**configured.settings_dict, 'POOL': None}),
+        'persistent': lambda: query(persistent),
+    }
+    if configured.settings_dict.get('POOL'):
+        modes['pooled'] = fresh(configured.settings_dict)
+
+    results = {}
+    try:
+        for name, run in modes.items():
+            for _ in range(warmup):
+                run()
+            timings = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = summarize(timings, [1])
+    finally:
+        persistent.close()
+    results['setup_overhead_ms'] = round(results['new']['p50_ms'] - results['persistent']['p50_ms'], 3)
+    return results
+
@@ -0,0 +1,36 @@
+"""System checks for deployment settings the forum's caching depends on."""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+from . import ratelimit
+
+from .versions import stamps_shared
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if stamps_shared():
+        return []
+    return [Warning(
+        "The default cache is per-process but several processes change data (WEB_CONCURRENCY web "
+        "workers, plus TASK_WORKERS unless TASKS['EAGER']), so fragment, page, ETag, user, "
+        "home snapshot and followed-feed caching are switched off.",
+        hint="Set REDIS_URL so every process shares one cache, or run a single web worker with TASKS['EAGER'].",
+        id='forum.W001',
+    )]
+
+
+@register(Tags.caches)
+def check_rate_limit_cache(app_configs, **kwargs):
+    config = ratelimit.get_config()
+    if (not config['ENABLED'] or config['BACKEND'] != 'cache' or settings.WEB_CONCURRENCY <= 1
+            or not isinstance(caches['default'], LocMemCache)):
+        return []
+    return [Warning(
+        "Rate limits are counted in the per-process default cache but WEB_CONCURRENCY runs several "
+        "workers, so each counts on its own and a client gets WEB_CONCURRENCY times the limit.",
+        hint="Set REDIS_URL so every worker shares one cache.",
+        id='forum.W002',
+    )]
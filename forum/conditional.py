@@ -0,0 +1,75 @@
+"""
+ETag / Last-Modified for read-heavy pages.
+
+A page's freshness is the version stamps (forum/versions.py) of the things it
+shows plus the viewer: their id and their own stamp, which moves when they
+follow or unfollow a circle or change their profile. Working that out is one
+cache ``get_many``, so an unchanged page answers 304 before the view runs a
+single query or renders anything.
+
+Without a cache shared by every worker (``stamps_shared()``) a worker that
+didn't see a write would keep answering 304 for a page that changed, so pages
+are served without validators instead. The same goes for the first
+``PIN_SECONDS`` after a change when read replicas are in use: the page may be
+rendered from a replica that hasn't caught up, and a validator would pin
+that render under the new stamp (forum/routers.py).
+"""
+import datetime
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+
+from .routers import may_lag
+from .versions import get_versions, stamps_shared
+
+
+def page_state(request, scopes):
+    """Stamps for ``scopes`` and the viewer, or None if the page can't be conditional."""
+    if request.method not in ('GET', 'HEAD') or not stamps_shared():
+        return None
+    # a queued flash message makes this render different from the last one
+    if len(get_messages(request)):
+        return None
+    key = tuple(scopes)
+    states = request.__dict__.setdefault('_page_states', {})
+    if key not in states:
+        user = request.user
+        if user.is_authenticated:
+            stamps = get_versions(*scopes, f'user:{user.pk}')
+        else:
+            stamps = get_versions(*scopes)
+        states[key] = None if may_lag(stamps) else stamps
+    return states[key]
+
+
+def versioned_page(*scope_patterns):
+    """
+    Serve 304s for a view whose output only depends on the given scopes.
+
+    Patterns are formatted with the view's URL kwargs, e.g.
+    ``@versioned_page('circle:{circle_id}')``.
+    """
+    def scopes(kwargs):
+        return [pattern.format(**kwargs) for pattern in scope_patterns]
+
+    def etag(request, **kwargs):
+        stamps = page_state(request, scopes(kwargs))
+        if stamps is None:
+            return None
+        # the XHR JSON and the HTML page share a URL but aren't the same response
+        parts = [repr(stamp) for stamp in stamps]
+        parts += [str(request.user.pk), request.headers.get('X-Requested-With', '')]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, **kwargs):
+        stamps = page_state(request, scopes(kwargs))
+        if stamps is None:
+            return None
+        return datetime.datetime.fromtimestamp(max(stamps), tz=datetime.timezone.utc)
+
+    def decorator(view_func):
+        return vary_on_headers('X-Requested-With')(condition(etag, last_modified)(view_func))
+
+    return decorator
@@ -0,0 +1,135 @@
+"""
+Like/dislike counters for posts and comments.
+
+Every vote is recorded once per user (PostVote/CommentVote), and the counter
+columns are changed with ``UPDATE ... SET likes = likes + n`` instead of
+read-modify-write, so concurrent workers never lose increments. With
+``VOTE_BUFFER`` set in settings the increments are first summed in memory and
+written in batches, turning a burst of clicks on one post into one UPDATE.
+"""
+import atexit
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from .models import Post, Comment, PostVote, CommentVote
+from .trending import score_update
+from .versions import bump, counter_scopes
+
+LIKE = 1
+DISLIKE = -1
+
+VOTE_MODELS = {
+    Post: (PostVote, 'post'),
+    Comment: (CommentVote, 'comment'),
+}
+
+
+def counter_field(value):
+    return 'likes' if value == LIKE else 'dislikes'
+
+
+def apply_deltas(model, pk, deltas):
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if changes:
+        if model is Post:
+            changes['trending_score'] = score_update(deltas)
+        model.objects.filter(pk=pk).update(**changes)
+
+
+class VoteBuffer:
+    """Sums counter deltas per row and writes them out in one batch."""
+
+    def __init__(self, max_pending=500, max_age=2.0):
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.pending = defaultdict(lambda: defaultdict(int))
+        self.scopes = set()
+        self.timer = None
+
+    def add(self, model, pk, deltas, scopes=()):
+        """Queue ``deltas`` for one row; ``scopes`` are the fragment versions to bump once written."""
+        with self.lock:
+            row = self.pending[(model._meta.label, pk)]
+            for field, delta in deltas.items():
+                row[field] += delta
+            self.scopes.update(scopes)
+            full = len(self.pending) >= self.max_pending
+            if not full and self.timer is None:
+                # nothing else might arrive, make sure these still get written
+                self.timer = threading.Timer(self.max_age, self.flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(lambda: defaultdict(int))
+            scopes, self.scopes = self.scopes, set()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        for (label, pk), deltas in pending.items():
+            apply_deltas(apps.get_model(label), pk, deltas)
+        if scopes:
+            bump(*scopes)
+        return len(pending)
+
+    def flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # each timer is a new thread, whose connections nothing else would ever close
+            connections.close_all()
+
+    def __len__(self):
+        return len(self.pending)
+
+
+def make_buffer():
+    config = getattr(settings, 'VOTE_BUFFER', None)
+    if not config:
+        return None
+    buffer = VoteBuffer(config.get('MAX_PENDING', 500), config.get('MAX_AGE', 2.0))
+    atexit.register(buffer.flush)
+    return buffer
+
+
+vote_buffer = make_buffer()
+
+
+def cast_vote(user, target, value):
+    """
+    Record ``user``'s like (1) or dislike (-1) on a post or comment.
+
+    Voting the same way twice does nothing; switching moves the vote from one
+    counter to the other. Returns True if the counters changed.
+    """
+    vote_model, target_field = VOTE_MODELS[type(target)]
+    with transaction.atomic():
+        vote, created = vote_model.objects.get_or_create(
+            user=user, defaults={'value': value}, **{target_field: target}
+        )
+        if created:
+            deltas = {counter_field(value): 1}
+        elif vote.value == value:
+            return False
+        else:
+            # only the request that actually flips the row moves the counters; a concurrent
+            # switch (a double-clicked dislike) read the same old value and finds nothing to update
+            if not vote_model.objects.filter(pk=vote.pk, value=vote.value).update(value=value):
+                return False
+            deltas = {counter_field(value): 1, counter_field(vote.value): -1}
+
+        if vote_buffer is not None:
+            transaction.on_commit(lambda: vote_buffer.add(type(target), target.pk, deltas, counter_scopes(target)))
+        else:
+            apply_deltas(type(target), target.pk, deltas)
+            bump(*counter_scopes(target))
+    return True
@@ -0,0 +1,87 @@
+"""
+A small in-process database connection pool.
+
+Django (before 5.1) has no pool of its own: with ``CONN_MAX_AGE`` each thread
+keeps one connection, which doesn't suit ASGI or threaded workers where
+threads come and go. ``ConnectionPool`` holds up to ``max_size`` open
+connections per process; callers wait up to ``timeout`` for a free one. Idle
+connections are closed after ``max_idle`` seconds, and one that has sat for
+longer than ``check_after`` is pinged before being handed out.
+
+The pool knows nothing about the driver: ``connect`` makes a connection,
+``check`` says whether an idle one still works and ``reset`` gets a returned
+one back to a clean state (returning False to throw it away).
+forum/backends/postgresql wires it into Django.
+"""
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=4, timeout=10, max_idle=300, check_after=30,
+                 check=lambda conn: True, reset=lambda conn: True):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.check = check
+        self.reset = reset
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle = deque()  # (connection, returned at); newest on the right
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Returns ``(connection, seconds waited for a slot, reused)``."""
+        started = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection free after {self.timeout}s (pool size {self.max_size})")
+        waited = time.perf_counter() - started
+        try:
+            while True:
+                with self.lock:
+                    item = self.idle.pop() if self.idle else None
+                if item is None:
+                    return self.connect(), waited, False
+                conn, returned = item
+                idle_for = time.monotonic() - returned
+                if idle_for > self.max_idle or (idle_for > self.check_after and not self.check(conn)):
+                    close_quietly(conn)
+                    continue
+                return conn, waited, True
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        try:
+            if discard or not self.reset(conn):
+                close_quietly(conn)
+            else:
+                with self.lock:
+                    self.idle.append((conn, time.monotonic()))
+        finally:
+            self.slots.release()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for conn, _ in idle:
+            close_quietly(conn)
+
+    def __len__(self):
+        return len(self.idle)
@@ -0,0 +1,65 @@
+"""
+Home page feed snapshot.
+
+The parts of the home page that are the same for every visitor (top circles,
+popular posts, recommended posts and announcements) are built once and kept in
+the cache. forum/signals.py drops the snapshot whenever one of the models it is
+built from is saved or deleted, so the TTL is only a safety net. The drop only
+reaches other processes through a shared cache, so without one
+(``stamps_shared()``, forum/versions.py) the snapshot is built per request
+instead of cached.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import TopicCircle, Post, Announcement
+from .routers import primary_reads
+from .versions import stamps_shared
+from .trending import top_posts
+
+HOME_SNAPSHOT_KEY = 'forum:home:snapshot'
+HOME_SNAPSHOT_TTL = getattr(settings, 'HOME_FEED_TTL', 300)
+HOME_LIST_SIZE = 5
+
+
+def build_home_snapshot():
+    circles = TopicCircle.objects.filter(is_active=True).order_by('-post_count')[:HOME_LIST_SIZE]
+    popular_posts = top_posts(HOME_LIST_SIZE)
+    recommended_posts = Post.objects.select_related('user').filter(
+        is_recommended=True
+    ).order_by('-created_at')[:HOME_LIST_SIZE]
+    announcements = Announcement.objects.all()
+
+    # lists, not querysets, so the cached value holds rows and not a query
+    return {
+        'circles': list(circles),
+        'popular_posts': popular_posts,
+        'recommended_posts': list(recommended_posts),
+        'announcements': list(announcements),
+    }
+
+
+def get_home_snapshot():
+    if not stamps_shared():
+        return build_home_snapshot()
+    snapshot = cache.get(HOME_SNAPSHOT_KEY)
+    if snapshot is None:
+        # cached for every reader, so not from a replica that may be behind the change that dropped it
+        with primary_reads():
+            snapshot = build_home_snapshot()
+        cache.set(HOME_SNAPSHOT_KEY, snapshot, HOME_SNAPSHOT_TTL)
+    return snapshot
+
+
+def invalidate_home_snapshot():
+    cache.delete(HOME_SNAPSHOT_KEY)
+
+
+def get_followed_circles(user):
+    # per-user part of the home page, never cached with the snapshot
+    if not user.is_authenticated:
+        return []
+    return list(TopicCircle.objects.filter(
+        usercirclefollow__user=user,
+        is_active=True
+    ))
@@ -0,0 +1,261 @@
+"""
+Reverse geocoding for posts, comments and the geocode endpoint.
+
+Lookups go through one Geocoder: coordinates are snapped to a grid (3 decimal
+places is roughly 100m) and the answer is kept in an LRU cache with a TTL, so
+people posting from the same building share one upstream call. In deferred
+mode a cache miss does not block the request: the row is saved with the raw
+coordinates and a ``forum.fill_location`` job (forum/tasks.py) fills in
+``location`` afterwards, retrying if the backend is down.
+
+Backends are configured with ``GEOCODER['BACKEND']`` and only need a
+``reverse(lat, lon)`` method returning a place name or None. Under ASGI,
+backends with an ``areverse`` coroutine are awaited directly by async views;
+otherwise ``reverse`` runs in a thread (see forum/http.py).
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .http import get_session, get_async_client, native_async
+from .profiling import external_call
+from .tasks import enqueue
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'forum.geocoding.NominatimBackend',
+    'OPTIONS': {},
+    'PRECISION': 3,
+    'MAX_ENTRIES': 10000,
+    'TTL': 24 * 60 * 60,
+    'DEFERRED': True,
+}
+
+
+class NominatimBackend:
+    def __init__(self, user_agent='our_circle_app', language='zh-CN', timeout=5):
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+        self.language = language
+
+    def reverse(self, lat, lon):
+        with external_call('nominatim'):
+            location = self.geolocator.reverse((lat, lon), language=self.language)
+        return location.address if location else None
+
+
+class OpenWeatherMapBackend:
+    url = 'https://api.openweathermap.org/geo/1.0/reverse'
+
+    def __init__(self, api_key=None, timeout=5):
+        self.api_key = api_key or settings.OPENWEATHER_API_KEY
+        self.timeout = timeout
+
+    def params(self, lat, lon):
+        return {'lat': lat, 'lon': lon, 'limit': 1, 'appid': self.api_key}
+
+    def place_name(self, data):
+        return data[0].get('name', 'Unknown Location') if data else None
+
+    def reverse(self, lat, lon):
+        with external_call('openweathermap'):
+            response = get_session().get(self.url, params=self.params(lat, lon), timeout=self.timeout)
+            response.raise_for_status()
+        return self.place_name(response.json())
+
+    async def areverse(self, lat, lon):
+        with external_call('openweathermap'):
+            response = await get_async_client().get(self.url, params=self.params(lat, lon), timeout=self.timeout)
+            response.raise_for_status()
+        return self.place_name(response.json())
+
+
+class StubBackend:
+    """Offline backend for tests and local development."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+
+    def reverse(self, lat, lon):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return f"Stub Location ({lat:.3f}, {lon:.3f})"
+
+    async def areverse(self, lat, lon):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return f"Stub Location ({lat:.3f}, {lon:.3f})"
+
+
+class GeoCache:
+    """LRU cache of place names keyed on grid-snapped coordinates."""
+
+    def __init__(self, precision=3, max_entries=10000, ttl=86400):
+        self.precision = precision
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, lat, lon):
+        return round(lat, self.precision), round(lon, self.precision)
+
+    def get(self, lat, lon):
+        key = self.key(lat, lon)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, lat, lon, value):
+        key = self.key(lat, lon)
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def parse_coordinates(lat, lon):
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def coordinates_label(lat, lon):
+    return f"Lat: {lat}, Lon: {lon}"
+
+
+def fit_location(model, name):
+    # full Nominatim addresses can be longer than the column
+    return name[:model._meta.get_field('location').max_length]
+
+
+class Geocoder:
+    def __init__(self, backend, cache, deferred=True):
+        self.backend = backend
+        self.cache = cache
+        self.deferred = deferred
+
+    def reverse(self, lat, lon):
+        """Place name for the coordinates, None if the backend can't tell or fails."""
+        name = self.cache.get(lat, lon)
+        if name is not None:
+            return name
+        try:
+            name = self.backend.reverse(lat, lon)
+        except Exception:
+            # network errors, rate limits, bad responses: don't cache, fall back
+            logger.warning("Reverse geocoding failed for %s,%s", lat, lon, exc_info=True)
+            return None
+        if name:
+            self.cache.set(lat, lon, name)
+        return name
+
+    async def areverse(self, lat, lon):
+        name = self.cache.get(lat, lon)
+        if name is not None:
+            return name
+        try:
+            if hasattr(self.backend, 'areverse') and native_async():
+                name = await self.backend.areverse(lat, lon)
+            else:
+                name = await sync_to_async(self.backend.reverse, thread_sensitive=False)(lat, lon)
+        except Exception:
+            logger.warning("Reverse geocoding failed for %s,%s", lat, lon, exc_info=True)
+            return None
+        if name:
+            self.cache.set(lat, lon, name)
+        return name
+
+    def location_for(self, lat, lon):
+        """
+        Value to store in ``location`` when creating a row.
+
+        Returns ``(location, pending)``; if pending is True queue
+        ``forum.fill_location`` once the row has a primary key.
+        """
+        name = self.cache.get(lat, lon)
+        if name is not None:
+            return name, False
+        if self.deferred:
+            return coordinates_label(lat, lon), True
+        return self.reverse(lat, lon) or coordinates_label(lat, lon), False
+
+    def fill_location(self, model, pk, lat, lon):
+        """Store the place name on a saved row; backend errors propagate so the job is retried."""
+        name = self.cache.get(lat, lon)
+        if name is None:
+            name = self.backend.reverse(lat, lon)
+            if name:
+                self.cache.set(lat, lon, name)
+        if name:
+            instance = model.objects.filter(pk=pk).first()
+            if instance is not None:  # not deleted while queued
+                instance.location = fit_location(model, name)
+                # saved rather than UPDATEd so forum/signals.py bumps the pages still showing the coordinates
+                instance.save(update_fields=['location'])
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            config = {**DEFAULTS, **getattr(settings, 'GEOCODER', {})}
+            backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+            cache = GeoCache(config['PRECISION'], config['MAX_ENTRIES'], config['TTL'])
+            _geocoder = Geocoder(backend, cache, config['DEFERRED'])
+        return _geocoder
+
+
+@receiver(setting_changed)
+def reset_geocoder(setting, **kwargs):
+    global _geocoder
+    if setting == 'GEOCODER':
+        _geocoder = None
+
+
+def create_with_location(model, lat, lon, **fields):
+    """Create a Post/Comment, geocoding ``lat``/``lon`` into its location if given."""
+    coordinates = parse_coordinates(lat, lon) if lat and lon else None
+    pending = False
+    if coordinates:
+        geocoder = get_geocoder()
+        location, pending = geocoder.location_for(*coordinates)
+        fields['location'] = fit_location(model, location)
+    instance = model.objects.create(**fields)
+    if pending:
+        lat, lon = coordinates
+        label = model._meta.label_lower
+        enqueue('forum.fill_location', key=f'geocode:{label}:{instance.pk}',
+                model=label, pk=instance.pk, lat=lat, lon=lon)
+    return instance
@@ -0,0 +1,63 @@
+"""
+Shared HTTP clients for calls to third-party APIs.
+
+One pooled ``requests.Session`` per process keeps TCP/TLS connections to
+OpenWeatherMap and friends alive between requests instead of opening a new
+one for every call. Async views running on the server's own event loop
+(``SERVER_MODE=asgi``) use one ``httpx.AsyncClient`` per loop for the same
+reason, since an async client can't be shared between loops.
+
+Under WSGI, Django runs every async view in a fresh event loop that only lives
+for that request, so a per-loop client would be opened for each request and
+never reused or closed. ``native_async()`` is False there, and callers run the
+sync path with the pooled session in a thread instead.
+"""
+import asyncio
+import threading
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (3, 5)  # connect, read
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            retry = Retry(total=1, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def native_async():
+    """Whether async views run on a long-lived event loop, so async clients and in-flight tasks are shared."""
+    return settings.SERVER_MODE == 'asgi'
+
+
+def get_async_client():
+    """The running loop's client; only use this when ``native_async()`` is True."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(DEFAULT_TIMEOUT[1], connect=DEFAULT_TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=16),
+            transport=httpx.AsyncHTTPTransport(retries=1),
+        )
+        _async_clients[loop] = client
+    return client
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from forum.bench import run_concurrency, environment
+
+
+class Command(BaseCommand):
+    help = "Compare how many slow-upstream requests one process sustains under WSGI and ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--levels', type=int, nargs='+', default=[1, 10, 50, 100],
+                            help="Numbers of concurrent callers to try")
+        parser.add_argument('--delay', type=float, default=0.2, help="Seconds the stub upstream takes per call")
+        parser.add_argument('--threads', type=int, default=1,
+                            help="Threads per WSGI worker (1 is gunicorn's default sync worker)")
+        parser.add_argument('--requests', type=int, help="Requests per level (default 4x the level)")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        results = run_concurrency(options['levels'], options['delay'], options['threads'], options['requests'])
+        for level, modes in results.items():
+            self.stderr.write(f"{level:>5} concurrent: "
+                              f"wsgi {modes['wsgi']['requests_per_second']:>8} req/s, "
+                              f"asgi {modes['asgi']['requests_per_second']:>8} req/s")
+        output = json.dumps({'environment': environment(), 'results': results}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
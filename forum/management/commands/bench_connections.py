@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from forum.bench import run_connections, environment
+
+
+class Command(BaseCommand):
+    help = "Compare the cost of a query on a new, pooled and persistent database connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database alias to connect to")
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        results = run_connections(alias, options['iterations'], options['warmup'])
+        for mode in ('new', 'pooled', 'persistent'):
+            if mode in results:
+                self.stderr.write(f"{mode:>10}: p50 {results[mode]['p50_ms']:>8.3f}ms  p99 {results[mode]['p99_ms']:>8.3f}ms")
+        self.stderr.write(f"Connection setup adds {results['setup_overhead_ms']}ms per request without reuse")
+        settings_dict = connections[alias].settings_dict
+        output = json.dumps({
+            'environment': environment(),
+            'host': settings_dict.get('HOST') or str(settings_dict.get('NAME')),
+            'results': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,65 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from forum.bench import seed_forum, run_benchmarks, environment, compare
+
+
+class Command(BaseCommand):
+    help = "Time the main forum views at one or more data sizes and write the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000],
+                            help="Post counts to benchmark at, e.g. --sizes 1000 100000 1000000")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--only', nargs='+', help="Only benchmark these endpoints")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+        parser.add_argument('--compare', help="Earlier JSON results to compare against")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative latency increase counted as a regression (default 0.2)")
+        parser.add_argument('--in-place', action='store_true',
+                            help="Seed and benchmark the configured database instead of a throwaway test database")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Keep the test database between runs so larger sizes needn't be re-seeded")
+
+    def handle(self, *args, **options):
+        if not options['in_place']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'],
+                                               serialize=False)
+        try:
+            report = {'environment': environment(), 'runs': {}}
+            for size in sorted(options['sizes']):
+                self.stderr.write(f"Seeding {size} posts...")
+                totals = seed_forum(users=max(100, size // 100), circles=max(20, size // 5000), posts=size,
+                                    reports=max(50, size // 200), log=self.stderr.write)
+                cache.clear()
+                self.stderr.write(f"Benchmarking at {size} posts...")
+                report['runs'][str(size)] = {
+                    'data': totals,
+                    'results': run_benchmarks(options['iterations'], options['warmup'], options['only']),
+                }
+        finally:
+            if not options['in_place']:
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                rows = compare(json.load(f), report, options['threshold'])
+            regressions = 0
+            for size, endpoint, metric, before, after, regressed in rows:
+                regressions += regressed
+                self.stderr.write(f"{'REGRESSED' if regressed else 'ok':9} {size:>8} {endpoint:16} {metric:8} "
+                                  f"{before} -> {after}")
+            if regressions:
+                raise CommandError(f"{regressions} regressions against {options['compare']}")
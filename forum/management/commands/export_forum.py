@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from forum.transfer import export_forum, FORMATS, MODELS
+
+
+class Command(BaseCommand):
+    help = "Stream forum users, circles, posts, comments, reports, announcements and follows to one file per model"
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory to write the files to")
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per database round trip")
+        parser.add_argument('--models', nargs='+', choices=[model.__name__ for model in MODELS],
+                            help="Only export these models")
+
+    def handle(self, *args, **options):
+        models = [model for model in MODELS if not options['models'] or model.__name__ in options['models']]
+        totals = export_forum(options['directory'], options['format'], models, options['chunk_size'],
+                              log=self.stderr.write)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {sum(totals.values())} rows to {options['directory']}"
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from forum.transfer import import_forum
+
+
+class Command(BaseCommand):
+    help = "Stream an export_forum directory into the database with batched bulk inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory written by export_forum")
+        parser.add_argument('--remap', action='store_true',
+                            help="Give rows new ids so the data can be merged into a database that isn't empty")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per INSERT and per commit")
+        parser.add_argument('--skip-rebuild', action='store_true',
+                            help="Don't recompute counters, search index, trending scores and statistics")
+
+    def handle(self, *args, **options):
+        # batches commit one by one rather than in one transaction for the whole export
+        totals, skipped = import_forum(options['directory'], options['remap'], options['batch_size'],
+                                       rebuild=not options['skip_rebuild'], log=self.stderr.write)
+        for name, count in skipped.items():
+            self.stderr.write(self.style.WARNING(f"{name}: skipped {count} rows pointing at missing rows"))
+        self.stdout.write(self.style.SUCCESS(f"Imported {sum(totals.values())} rows"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forum.models import Post
+from forum.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for all posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database alias to rebuild")
+
+    def handle(self, *args, **options):
+        using = options['database']
+        backend = get_backend(using)
+        if backend.table is None:
+            self.stdout.write(self.style.WARNING("No search index on this database, nothing to rebuild"))
+            return
+        with transaction.atomic(using=using):
+            total = backend.rebuild(Post.objects.using(using).order_by('id'))
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} posts into {backend.table}"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forum.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly and daily statistics buckets from the source tables"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} statistics buckets"))
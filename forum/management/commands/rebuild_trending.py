@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forum.trending import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute every post's trending score from its like, dislike and comment counts"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rescored {updated} posts"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from forum.models import TopicCircle, Post, Comment
+
+BATCH_SIZE = 500
+
+
+def actual_count(model, fk):
+    rows = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk).annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(rows), 0)
+
+
+class Command(BaseCommand):
+    help = "Recompute TopicCircle.post_count and Post.comment_count from the real rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report rows that are out of sync")
+
+    def handle(self, *args, **options):
+        for model, field, child, fk in (
+            (TopicCircle, 'post_count', Post, 'circle'),
+            (Post, 'comment_count', Comment, 'post'),
+        ):
+            drifted = model.objects.annotate(actual=actual_count(child, fk)).exclude(**{field: F('actual')})
+            ids = list(drifted.values_list('id', flat=True))
+            if not options['dry_run']:
+                for start in range(0, len(ids), BATCH_SIZE):
+                    batch = ids[start:start + BATCH_SIZE]
+                    model.objects.filter(id__in=batch).update(**{field: actual_count(child, fk)})
+            self.stdout.write(f"{model.__name__}.{field}: {len(ids)} rows out of sync"
+                              f"{'' if options['dry_run'] else ', fixed'}")
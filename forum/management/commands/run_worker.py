@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from forum.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (geocoding, reports, circle deletes) until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--max-jobs', type=int, help="Exit after running this many jobs")
+
+    def handle(self, *args, **options):
+        worker = Worker(log=self.stdout.write)
+        ran = worker.work(once=options['once'], max_jobs=options['max_jobs'])
+        self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from forum.bench import seed_forum
+
+
+class Command(BaseCommand):
+    help = "Bulk-create synthetic users, circles, posts, comments, follows and reports for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--circles', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=1000, help="Total number of posts to top the database up to")
+        parser.add_argument('--comments-per-post', type=int, default=3, help="Average comments per new post")
+        parser.add_argument('--follows-per-user', type=int, default=5)
+        parser.add_argument('--reports', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, the same seed gives the same data")
+
+    def handle(self, *args, **options):
+        totals = seed_forum(
+            users=options['users'], circles=options['circles'], posts=options['posts'],
+            comments_per_post=options['comments_per_post'], follows_per_user=options['follows_per_user'],
+            reports=options['reports'], seed=options['seed'], log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f"{count} {name}" for name, count in totals.items())
+        ))
@@ -0,0 +1,176 @@
+import cProfile
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .profiling import get_config, metrics, RequestProfile, current_profile, instrument_templates
+from .routers import get_config as replica_config, request_writes
+
+logger = logging.getLogger('forum.profiling')
+
+
+class ProfilingMiddleware:
+    """
+    Per-request timing for a sample of requests, enabled with ``PROFILING['ENABLED']``.
+
+    Records wall, database, connection setup, template and external HTTP time
+    plus query counts into ``forum.profiling.metrics``, logs query shapes
+    repeated within one request, and with ``SLOW_PROFILES`` keeps cProfile
+    dumps of the slowest requests in ``PROFILE_DIR``.
+    """
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+        self.duplicate_threshold = config['DUPLICATE_THRESHOLD']
+        self.slow_profiles = config['SLOW_PROFILES']
+        self.profile_dir = config['PROFILE_DIR']
+        self.slowest = []  # min-heap of (duration, path) for the kept dumps
+        self.slowest_lock = threading.Lock()
+        if self.slow_profiles:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        instrument_templates()
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            self.count(request, response)
+            return response
+
+        profile = RequestProfile()
+        profiler = cProfile.Profile() if self.slow_profiles else None
+        token = current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile))
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            current_profile.reset(token)
+        duration = time.perf_counter() - profile.started
+
+        view = self.count(request, response)
+        metrics.observe('forum_request_duration_seconds', duration, view=view)
+        metrics.inc('forum_db_duration_seconds_total', profile.db_time, view=view)
+        metrics.inc('forum_db_queries_total', profile.query_count, view=view)
+        metrics.inc('forum_template_duration_seconds_total', profile.template_time, view=view)
+        if profile.query_count:
+            metrics.inc('forum_request_connections_total', view=view,
+                        connection='opened' if profile.connections else 'reused')
+            metrics.inc('forum_request_connect_seconds_total', profile.connect_time, view=view)
+        duplicates = profile.duplicates(self.duplicate_threshold)
+        if duplicates:
+            metrics.inc('forum_duplicate_queries_total', sum(duplicates.values()), view=view)
+            for sql, n in duplicates.items():
+                logger.warning("%s ran the same query %d times: %s", view, n, sql)
+        logger.info("%s %s %.1fms db=%.1fms/%dq connect=%.1fms/%d templates=%.1fms http=%.1fms", request.method,
+                    request.path, duration * 1000, profile.db_time * 1000, profile.query_count,
+                    profile.connect_time * 1000, profile.connections, profile.template_time * 1000,
+                    profile.http_time * 1000)
+        if profiler:
+            self.keep_if_slow(profiler, duration, view)
+        return response
+
+    def count(self, request, response):
+        view = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+        metrics.inc('forum_requests_total', view=view, method=request.method, status=response.status_code)
+        return view
+
+    def keep_if_slow(self, profiler, duration, view):
+        with self.slowest_lock:
+            if len(self.slowest) >= self.slow_profiles and duration <= self.slowest[0][0]:
+                return
+            path = os.path.join(self.profile_dir, f'{duration * 1000:.0f}ms-{view.replace(":", "-")}-{time.time_ns()}.prof')
+            profiler.dump_stats(path)
+            heapq.heappush(self.slowest, (duration, path))
+            if len(self.slowest) > self.slow_profiles:
+                _, evicted = heapq.heappop(self.slowest)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that also runs natively under ASGI.
+
+    The stock middleware is sync only, which makes Django run every request
+    through a thread and back even for async views. Looking up a static file
+    is a dict hit, so it is safe to do on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = self.find_file(request.path_info) if self.autorefresh else self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class ReplicaPinMiddleware:
+    """Pin clients that just wrote to the primary for ``PIN_SECONDS``."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        writes = [False]
+        token = request_writes.set(writes)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_writes.reset(token)
+        return self.pin(request, response, writes[0])
+
+    async def __acall__(self, request):
+        # the list is shared with the threads sync code runs in, so their writes show up here
+        writes = [False]
+        token = request_writes.set(writes)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_writes.reset(token)
+        return self.pin(request, response, writes[0])
+
+    def pin(self, request, response, wrote):
+        config = replica_config()
+        if config['DATABASES'] and (wrote or request.method not in ('GET', 'HEAD', 'OPTIONS')):
+            response.set_cookie(config['PIN_COOKIE'], '1', max_age=config['PIN_SECONDS'], httponly=True,
+                                samesite='Lax')
+        return response
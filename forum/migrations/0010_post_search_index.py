@@ -0,0 +1,50 @@
+from django.db import migrations
+
+# SQL as of this migration; forum/search.py may have moved on since
+
+
+def sqlite_has_fts5(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def install_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS forum_post_search ("
+            "post_id bigint PRIMARY KEY REFERENCES forum_post(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS forum_post_search_document_gin ON forum_post_search USING GIN (document)"
+        )
+        schema_editor.execute(
+            "INSERT INTO forum_post_search(post_id, document) SELECT id, to_tsvector('simple', content) FROM forum_post"
+        )
+    elif vendor == 'sqlite' and sqlite_has_fts5(schema_editor):
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS forum_post_fts "
+            "USING fts5(content, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute("INSERT INTO forum_post_fts(rowid, content) SELECT id, content FROM forum_post")
+
+
+def uninstall_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS forum_post_search")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS forum_post_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0009_alter_usercirclefollow_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_index, uninstall_index),
+    ]
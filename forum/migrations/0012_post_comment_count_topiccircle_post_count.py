@@ -0,0 +1,37 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counts(apps, schema_editor):
+    TopicCircle = apps.get_model('forum', 'TopicCircle')
+    Post = apps.get_model('forum', 'Post')
+    Comment = apps.get_model('forum', 'Comment')
+    db = schema_editor.connection.alias
+    posts = Post.objects.using(db).filter(circle=OuterRef('pk')).order_by().values('circle').annotate(n=Count('id')).values('n')
+    comments = Comment.objects.using(db).filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('id')).values('n')
+    TopicCircle.objects.using(db).update(post_count=Coalesce(Subquery(posts), 0))
+    Post.objects.using(db).update(comment_count=Coalesce(Subquery(comments), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_postvote_commentvote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topiccircle',
+            name='post_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
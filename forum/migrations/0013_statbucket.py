@@ -0,0 +1,59 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:17
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncHour, TruncDay
+
+# the metrics forum/stats.py counted when this migration was written
+METRICS = {
+    'posts': [('forum', 'Post', 'created_at')],
+    'comments': [('forum', 'Comment', 'created_at')],
+    'users': [('forum', 'GUser', 'date_joined')],
+    'reports': [('forum', 'Report', 'created_at')],
+    'votes': [('forum', 'PostVote', 'created_at'), ('forum', 'CommentVote', 'created_at')],
+}
+GRANULARITIES = {'hour': TruncHour, 'day': TruncDay}
+
+
+def fill_buckets(apps, schema_editor):
+    using = schema_editor.connection.alias
+    StatBucket = apps.get_model('forum', 'StatBucket')
+    for metric, sources in METRICS.items():
+        for granularity, trunc in GRANULARITIES.items():
+            totals = {}
+            for app_label, model_name, field in sources:
+                rows = apps.get_model(app_label, model_name).objects.using(using).annotate(
+                    bucket=trunc(field, tzinfo=datetime.timezone.utc)
+                ).order_by().values('bucket').annotate(n=Count('pk')).values_list('bucket', 'n')
+                for bucket, n in rows:
+                    totals[bucket] = totals.get(bucket, 0) + n
+            StatBucket.objects.using(using).bulk_create([
+                StatBucket(metric=metric, granularity=granularity, bucket_start=bucket, count=n)
+                for bucket, n in totals.items()
+            ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0012_post_comment_count_topiccircle_post_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20)),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('metric', 'granularity', 'bucket_start')},
+            },
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+    ]
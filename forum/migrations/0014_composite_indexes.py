@@ -0,0 +1,53 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0013_statbucket'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'likes'], name='comment_post_likes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['circle', 'is_pinned', 'created_at'], name='post_circle_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['circle', 'is_pinned', 'likes'], name='post_circle_likes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['circle', 'is_pinned', 'comment_count'], name='post_circle_comments_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'created_at'], name='post_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('is_recommended', True)), fields=['-created_at'], name='post_recommended_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['-created_at'], name='report_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topiccircle',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-post_count'], name='circle_active_posts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topiccircle',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['name'], name='circle_active_name_idx'),
+        ),
+    ]
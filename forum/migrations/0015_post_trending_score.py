@@ -0,0 +1,55 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:27
+
+import datetime
+import math
+
+from django.db import migrations, models
+
+# forum/trending.py's formula when this migration was written
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+DECAY_SECONDS = 45000
+COMMENT_WEIGHT = 2
+
+
+def hot_score(likes, dislikes, comment_count, created_at):
+    s = likes - dislikes + COMMENT_WEIGHT * comment_count
+    sign = (s > 0) - (s < 0)
+    return sign * math.log10(max(abs(s), 1)) + (created_at - EPOCH).total_seconds() / DECAY_SECONDS
+
+
+def fill_scores(apps, schema_editor):
+    Post = apps.get_model('forum', 'Post')
+    posts = Post.objects.using(schema_editor.connection.alias)
+    batch = []
+    for post in posts.only('likes', 'dislikes', 'comment_count', 'created_at').iterator(chunk_size=1000):
+        post.trending_score = hot_score(post.likes, post.dislikes, post.comment_count, post.created_at)
+        batch.append(post)
+        if len(batch) >= 1000:
+            posts.bulk_update(batch, ['trending_score'])
+            batch = []
+    if batch:
+        posts.bulk_update(batch, ['trending_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0014_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='trending_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-trending_score', '-id'], name='post_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['circle', '-trending_score', '-id'], name='post_circle_trending_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
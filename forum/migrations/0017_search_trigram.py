@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# Swap the word-prefix indexes from 0010 for trigram ones, which match
+# substrings anywhere and don't rely on spaces between words
+
+
+def sqlite_has_fts5(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def sqlite_has_trigram_fts(schema_editor):
+    return schema_editor.connection.Database.sqlite_version_info >= (3, 34) and sqlite_has_fts5(schema_editor)
+
+
+def install_trigram(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS forum_post_search")
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS forum_post_content_trgm ON forum_post USING GIN (UPPER(content) gin_trgm_ops)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS forum_post_fts")
+        # without trigram support search falls back to scanning forum_post
+        if sqlite_has_trigram_fts(schema_editor):
+            schema_editor.execute("CREATE VIRTUAL TABLE forum_post_fts USING fts5(content, tokenize='trigram')")
+            schema_editor.execute("INSERT INTO forum_post_fts(rowid, content) SELECT id, content FROM forum_post")
+
+
+def install_prefix(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS forum_post_content_trgm")
+        schema_editor.execute(
+            "CREATE TABLE forum_post_search ("
+            "post_id bigint PRIMARY KEY REFERENCES forum_post(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute("CREATE INDEX forum_post_search_document_gin ON forum_post_search USING GIN (document)")
+        schema_editor.execute(
+            "INSERT INTO forum_post_search(post_id, document) SELECT id, to_tsvector('simple', content) FROM forum_post"
+        )
+    elif vendor == 'sqlite' and sqlite_has_fts5(schema_editor):
+        schema_editor.execute("DROP TABLE IF EXISTS forum_post_fts")
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE forum_post_fts USING fts5(content, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute("INSERT INTO forum_post_fts(rowid, content) SELECT id, content FROM forum_post")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0016_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_trigram, install_prefix),
+    ]
@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from .trending import hot_score
 
 
 class GUser(AbstractUser):
@@ -18,10 +19,18 @@ class TopicCircle(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(GUser, on_delete=models.SET_NULL, null=True, limit_choices_to={'is_admin': True})  # only admin user can do this
     is_active = models.BooleanField(default=True)
+    post_count = models.IntegerField(default=0)  # kept in sync by forum/signals.py
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # home (top circles) and all_circles only ever list active circles
+            models.Index(fields=['-post_count'], condition=models.Q(is_active=True), name='circle_active_posts_idx'),
+            models.Index(fields=['name'], condition=models.Q(is_active=True), name='circle_active_name_idx'),
+        ]
+
 class Post(models.Model):
     user = models.ForeignKey(GUser, on_delete=models.CASCADE)
     circle = models.ForeignKey(TopicCircle, on_delete=models.CASCADE)
@@ -35,10 +44,36 @@ class Post(models.Model):
     is_pinned = models.BooleanField(default=False)
     is_recommended = models.BooleanField(default=False)
     location = models.CharField(max_length=100, blank=True, null=True)
+    comment_count = models.IntegerField(default=0)  # kept in sync by forum/signals.py
+    trending_score = models.FloatField(default=0)  # see forum/trending.py
 
     def __str__(self):
         return f"Post by {self.user.username if not self.is_anonymous else self.nickname} in {self.circle.name}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.trending_score = hot_score(self.likes, self.dislikes, self.comment_count,
+                                            self.created_at or timezone.now())
+        # the post_count update in forum/signals.py commits or rolls back with the insert
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # circle_detail: pinned first, then the chosen sort
+            models.Index(fields=['circle', 'is_pinned', 'created_at'], name='post_circle_created_idx'),
+            models.Index(fields=['circle', 'is_pinned', 'likes'], name='post_circle_likes_idx'),
+            models.Index(fields=['circle', 'is_pinned', 'comment_count'], name='post_circle_comments_idx'),
+            # profile
+            models.Index(fields=['user', 'created_at'], name='post_user_created_idx'),
+            # home: recommended posts
+            models.Index(fields=['-created_at'], condition=models.Q(is_recommended=True),
+                         name='post_recommended_idx'),
+            # trending top K, overall and per circle
+            models.Index(fields=['-trending_score', '-id'], name='post_trending_idx'),
+            models.Index(fields=['circle', '-trending_score', '-id'], name='post_circle_trending_idx'),
+        ]
+
 class Comment(models.Model):
     user = models.ForeignKey(GUser, on_delete=models.CASCADE)
     post = models.ForeignKey('Post', on_delete=models.CASCADE)
@@ -55,8 +90,42 @@ class Comment(models.Model):
             return f"{self.nickname or 'Anonymous'}: {self.content[:20]}"
         return f"{self.user.username}: {self.content[:20]}"
 
+    def save(self, *args, **kwargs):
+        # same as Post.save, keeps comment_count in the insert's transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # post_detail comment sorts
+            models.Index(fields=['post', 'created_at'], name='comment_post_created_idx'),
+            models.Index(fields=['post', 'likes'], name='comment_post_likes_idx'),
+        ]
+
+class PostVote(models.Model):
+    user = models.ForeignKey(GUser, on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    value = models.SmallIntegerField()  # 1 like, -1 dislike
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'post')
+
+    def __str__(self):
+        return f"{self.user.username} {'likes' if self.value > 0 else 'dislikes'} post {self.post_id}"
+
+class CommentVote(models.Model):
+    user = models.ForeignKey(GUser, on_delete=models.CASCADE)
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
+    value = models.SmallIntegerField()  # 1 like, -1 dislike
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'comment')
+
+    def __str__(self):
+        return f"{self.user.username} {'likes' if self.value > 0 else 'dislikes'} comment {self.comment_id}"
 
 class Report(models.Model):
     user = models.ForeignKey(GUser, on_delete=models.CASCADE)
@@ -68,6 +137,12 @@ class Report(models.Model):
     def __str__(self):
         return f"Report on {self.post} by {self.user.username}"
 
+    class Meta:
+        indexes = [
+            # admin dashboard: unresolved reports, newest first
+            models.Index(fields=['-created_at'], condition=models.Q(is_resolved=False), name='report_open_idx'),
+        ]
+
 class Announcement(models.Model):
     title = models.CharField(max_length=200, verbose_name="Announcement Title")
     content = models.TextField(verbose_name="Announcement Content")
@@ -92,4 +167,46 @@ class UserCircleFollow(models.Model):
         verbose_name_plural = "User Circle Follow"
 
     def __str__(self):
-        return f"{self.user.username} follow {self.circle.name}"
\ No newline at end of file
+        return f"{self.user.username} follow {self.circle.name}"
+
+class StatBucket(models.Model):
+    GRANULARITY_CHOICES = [('hour', 'Hour'), ('day', 'Day')]
+
+    metric = models.CharField(max_length=20)  # posts, comments, users, reports, votes
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('metric', 'granularity', 'bucket_start')
+
+    def __str__(self):
+        return f"{self.metric} {self.granularity} {self.bucket_start:%Y-%m-%d %H:%M}: {self.count}"
+
+
+class Job(models.Model):
+    """A call to a registered task waiting for, or handled by, ``manage.py run_worker``; see forum/tasks.py."""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)  # higher runs first
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)  # pushed back after each failed attempt
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker's poll: ready jobs, most urgent first
+            models.Index(fields=['-priority', 'run_at'], condition=models.Q(status='queued'), name='job_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
@@ -0,0 +1,127 @@
+"""
+Whole-response cache for pages anonymous visitors all see the same way.
+
+``@anonymous_page_cache('announcements', ...)`` stores the rendered body of
+a logged-out GET under its path, the query parameters the page reads
+(``search``, ``sort``, ``page``) and the version stamps (forum/versions.py)
+of the scopes it shows. forum/signals.py bumps those stamps when a row
+changes, so editing one announcement only orphans the pages keyed on it and
+nothing is ever deleted by hand.
+
+On a miss the first request takes a short lock with ``cache.add`` and renders
+the page; others that miss at the same moment wait for its result instead of
+rendering it too, so a link shared to a lot of people costs one render.
+
+Logged-in users, requests with flash messages waiting and responses that set
+a cookie (session, CSRF, replica pin) are never cached, and neither is any
+page for the first ``PIN_SECONDS`` after one of its scopes changed while read
+replicas are in use, since it may be rendered from one that hasn't caught up
+(forum/routers.py). Without a cache every worker shares (``stamps_shared()``)
+pages aren't cached at all, since a worker that missed a bump would keep
+serving the old page.
+"""
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .profiling import metrics
+from .routers import may_lag
+from .versions import get_versions, stamps_shared
+
+DEFAULTS = {
+    'LOCK_TIMEOUT': 10,  # seconds a crashed renderer can hold the lock
+    'WAIT': 2.0,  # how long a request waits on someone else's render before rendering itself
+    'POLL_INTERVAL': 0.05,
+}
+PARAMS = ('search', 'sort', 'page')
+
+metrics.describe('forum_page_cache_total', 'Anonymous page cache lookups, by view and outcome')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PAGE_CACHE', {})}
+
+
+def cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    return not len(get_messages(request))
+
+
+def cacheable_response(request, response):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    # cookies the middleware would add on the way out
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        return False
+    session = getattr(request, 'session', None)
+    return not (session is not None and session.modified)
+
+
+def page_key(request, scopes, stamps=None):
+    params = urlencode(sorted((name, value) for name in PARAMS for value in request.GET.getlist(name)))
+    stamps = get_versions(*scopes) if stamps is None else stamps
+    digest = hashlib.md5(f'{params}|{"|".join(map(repr, stamps))}'.encode()).hexdigest()
+    return f'forum:page:{request.path}:{digest}'
+
+
+def anonymous_page_cache(*scope_patterns, ttl=None):
+    """
+    Cache a view's response for anonymous visitors.
+
+    Patterns are formatted with the view's URL kwargs, e.g.
+    ``@anonymous_page_cache('announcement:{announcement_id}')``; ``ttl``
+    defaults to ``FRAGMENT_CACHE_TTL``.
+    """
+    def decorator(view_func):
+        view_name = view_func.__name__
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not cacheable_request(request) or not stamps_shared():
+                return view_func(request, *args, **kwargs)
+            scopes = [pattern.format(**kwargs) for pattern in scope_patterns]
+            stamps = get_versions(*scopes)
+            if may_lag(stamps):
+                metrics.inc('forum_page_cache_total', view=view_name, outcome='bypass')
+                return view_func(request, *args, **kwargs)
+            config = get_config()
+            key = page_key(request, scopes, stamps)
+
+            entry = cache.get(key)
+            if entry is None and not cache.add(f'{key}:lock', 1, config['LOCK_TIMEOUT']):
+                # someone else is rendering this page; wait for it
+                deadline = time.monotonic() + config['WAIT']
+                while entry is None and time.monotonic() < deadline:
+                    time.sleep(config['POLL_INTERVAL'])
+                    entry = cache.get(key)
+                if entry is not None:
+                    metrics.inc('forum_page_cache_total', view=view_name, outcome='waited')
+            elif entry is not None:
+                metrics.inc('forum_page_cache_total', view=view_name, outcome='hit')
+            else:
+                try:
+                    response = view_func(request, *args, **kwargs)
+                    if cacheable_response(request, response):
+                        cache.set(key, {'content': response.content, 'content_type': response['Content-Type']},
+                                  settings.FRAGMENT_CACHE_TTL if ttl is None else ttl)
+                finally:
+                    cache.delete(f'{key}:lock')
+                metrics.inc('forum_page_cache_total', view=view_name, outcome='miss')
+                return response
+
+            if entry is None:
+                # the render we waited on failed or took too long
+                metrics.inc('forum_page_cache_total', view=view_name, outcome='timeout')
+                return view_func(request, *args, **kwargs)
+            return HttpResponse(entry['content'], content_type=entry['content_type'])
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,125 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page remembers the sort values of its last row and the
+next page asks for rows strictly after them, so page 1000 costs the same as
+page 1. The ordering must end with a unique field (normally ``id``) so ties are
+broken deterministically.
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder drops microseconds, which would make rows sharing a
+    # millisecond repeat or vanish between pages
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    """
+    One page of rows. Built with ``loader`` it runs no query until the rows or
+    the cursor are first used, so a template whose cached fragment is hit
+    never touches the database.
+    """
+
+    def __init__(self, object_list=None, next_cursor=None, loader=None):
+        self._object_list = object_list
+        self._next_cursor = next_cursor
+        self.loader = loader
+
+    def load(self):
+        if self.loader is not None:
+            self._object_list, self._next_cursor = self.loader()
+            self.loader = None
+
+    @property
+    def object_list(self):
+        self.load()
+        return self._object_list
+
+    @property
+    def next_cursor(self):
+        self.load()
+        return self._next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    """Return the cursor values converted back to python, or None if the cursor is bad."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    decoded = []
+    for name, value in zip(ordering, values):
+        try:
+            field = model._meta.get_field(name.lstrip('-'))
+        except FieldDoesNotExist:
+            # annotations such as comment_count are plain numbers already
+            decoded.append(value)
+            continue
+        try:
+            decoded.append(field.to_python(value))
+        except Exception:
+            return None
+    return decoded
+
+
+def keyset_filter(ordering, values):
+    """Q matching rows that sort strictly after ``values`` for ``ordering``."""
+    condition = Q(pk__in=[])
+    for i, name in enumerate(ordering):
+        field = name.lstrip('-')
+        lookup = '__lt' if name.startswith('-') else '__gt'
+        step = Q(**{field + lookup: values[i]})
+        for prev_name, prev_value in zip(ordering[:i], values[:i]):
+            step &= Q(**{prev_name.lstrip('-'): prev_value})
+        condition |= step
+    return condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=20):
+    """A lazy KeysetPage of ``queryset`` after ``cursor``."""
+    values = decode_cursor(cursor, queryset.model, ordering)
+    queryset = queryset.order_by(*ordering)
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    def load():
+        # fetch one extra row to know whether there is a next page
+        rows = list(queryset[:per_page + 1])
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            last = rows[-1]
+            next_cursor = encode_cursor([getattr(last, name.lstrip('-')) for name in ordering])
+        return rows, next_cursor
+
+    return KeysetPage(loader=load)
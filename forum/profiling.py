@@ -0,0 +1,224 @@
+"""
+Request profiling and process-wide metrics.
+
+``ProfilingMiddleware`` (forum/middleware.py) opens a RequestProfile for a
+sample of requests; database queries, template rendering and calls to
+external APIs add their time to the profile of the request they run in.
+Finished profiles are folded into ``metrics``, which the ``/metrics/`` view
+renders in the Prometheus text format. Metrics are per process, so scrape
+every worker (or run one worker per container).
+"""
+import contextvars
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,  # fraction of requests to profile
+    'SLOW_PROFILES': 0,  # keep a cProfile dump of the N slowest sampled requests, 0 disables
+    'PROFILE_DIR': 'profiles',
+    'DUPLICATE_THRESHOLD': 3,  # log a query fingerprint seen this many times in one request
+    'METRICS_TOKEN': None,  # bearer token for /metrics/, admins can always read it
+}
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+class Metrics:
+    """Thread-safe counters and histograms keyed by metric name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, value, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self.lock:
+            buckets, total, count = self.histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            self.histograms[key] = (buckets, total + value, count + 1)
+
+    def value(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self.help:
+                    lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {value:g}')
+        for (name, labels), (buckets, total, count) in histograms:
+            header(name, 'histogram')
+            for bound, n in zip(DURATION_BUCKETS, buckets):
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))} {n}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+metrics = Metrics()
+metrics.describe('forum_requests_total', 'Requests handled, by view, method and status')
+metrics.describe('forum_request_duration_seconds', 'Wall time of sampled requests')
+metrics.describe('forum_db_duration_seconds_total', 'Time spent in database queries by sampled requests')
+metrics.describe('forum_db_queries_total', 'Database queries run by sampled requests')
+metrics.describe('forum_duplicate_queries_total', 'Repeated identical query shapes within one sampled request')
+metrics.describe('forum_template_duration_seconds_total', 'Time spent rendering templates in sampled requests')
+metrics.describe('forum_external_http_duration_seconds_total', 'Time spent calling external APIs')
+metrics.describe('forum_external_http_requests_total', 'Calls to external APIs, by service and outcome')
+metrics.describe('forum_db_connections_total', 'Database connections handed to Django, new or from the pool')
+metrics.describe('forum_db_connect_seconds', 'Time to get a database connection, including waiting for the pool')
+metrics.describe('forum_db_pool_wait_seconds_total', 'Time spent waiting for a free pooled connection')
+metrics.describe('forum_request_connections_total', 'Sampled requests that queried the database, by whether they '
+                                                    'opened a connection or reused an open one')
+metrics.describe('forum_request_connect_seconds_total', 'Time sampled requests spent getting database connections')
+
+
+NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+IN_LIST_RE = re.compile(r'\(\s*(%s|\?)(\s*,\s*(%s|\?))*\s*\)')
+
+
+def fingerprint(sql):
+    """The shape of a query: literals and IN (...) lists collapsed so N+1 loops share one fingerprint."""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    return IN_LIST_RE.sub('(...)', sql)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.http_time = 0.0
+        self.connect_time = 0.0
+        self.connections = 0
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    def duplicates(self, threshold=2):
+        return {sql: n for sql, n in self.queries.items() if n >= threshold}
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries[fingerprint(sql)] += 1
+
+
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+@contextmanager
+def external_call(service):
+    """Time a call to a third-party API, e.g. ``with external_call('nominatim'): ...``."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - started
+        profile = current_profile.get()
+        if profile is not None:
+            profile.http_time += elapsed
+        metrics.inc('forum_external_http_duration_seconds_total', elapsed, service=service)
+        metrics.inc('forum_external_http_requests_total', service=service, outcome=outcome)
+
+
+def record_connect(alias, seconds=None, outcome='new', waited=0.0):
+    """
+    Count a connection Django just opened. Backends that can time it pass
+    ``seconds`` (forum/backends/postgresql); others are only counted, from the
+    ``connection_created`` signal.
+    """
+    metrics.inc('forum_db_connections_total', alias=alias, outcome=outcome)
+    if seconds is not None:
+        metrics.observe('forum_db_connect_seconds', seconds, alias=alias)
+    if waited:
+        metrics.inc('forum_db_pool_wait_seconds_total', waited, alias=alias)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.connections += 1
+        profile.connect_time += seconds or 0.0
+
+
+_template_patch_lock = threading.Lock()
+
+
+def instrument_templates():
+    """Make Template.render add its time to the current profile (outermost template only)."""
+    from django.template.base import Template
+
+    with _template_patch_lock:
+        if getattr(Template.render, 'profiled', False):
+            return
+        original = Template.render
+
+        def render(self, context):
+            profile = current_profile.get()
+            if profile is None:
+                return original(self, context)
+            profile.template_depth += 1
+            started = time.perf_counter()
+            try:
+                return original(self, context)
+            finally:
+                profile.template_depth -= 1
+                if not profile.template_depth:
+                    profile.template_time += time.perf_counter() - started
+
+        render.profiled = True
+        Template.render = render
@@ -0,0 +1,225 @@
+"""
+Per-user and per-IP rate limits for write endpoints.
+
+``@rate_limit('vote')`` looks its limits up in ``RATE_LIMITS['LIMITS']``,
+e.g. ``{'vote': {'user': '30/m', 'ip': '300/m'}}``, and checks every one
+that applies to the request: the user's id when logged in and the client
+address always. The IP limit is the looser one, since a campus network puts
+a lot of students behind one address. A request over any limit gets a 429
+with ``Retry-After`` and never reaches the view, and isn't counted against
+the other limits either.
+
+Two backends count the requests:
+
+``cache``
+    A sliding window over the default cache. Each period has a counter bumped
+    with the atomic ``cache.incr``, and the previous period's counter is
+    weighted by how much of it still overlaps the window. Every worker only
+    sees the same counts if that cache is shared (Redis, ``REDIS_URL``); with
+    the per-process LocMemCache each of ``WEB_CONCURRENCY`` workers counts on
+    its own, multiplying the effective limit, and check forum.W002 says so.
+``memory``
+    A token bucket per key in this process: ``limit`` tokens refilled
+    evenly over the period, so bursts up to the limit are fine but the
+    sustained rate is capped. Limits are per worker, so this suits a single
+    process or tests.
+
+Allowed and limited requests are counted in ``forum_ratelimit_total`` on
+``/metrics/``.
+"""
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from .profiling import metrics
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'cache',  # or 'memory'
+    'LIMITS': {},  # group -> {'user': rate, 'ip': rate}, rates like '30/m' or '5/10s'
+    'PROXY_COUNT': 0,  # trusted proxies in front of the app that append to X-Forwarded-For
+    'MAX_ENTRIES': 10000,  # memory backend: buckets kept before the least recently used are dropped
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+metrics.describe('forum_ratelimit_total', 'Rate-limited requests checked, by group, scope and outcome')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RATE_LIMITS', {})}
+
+
+def parse_rate(rate):
+    """``'30/m'`` -> ``(30, 60)``, ``'5/10s'`` -> ``(5, 10)``."""
+    match = RATE_RE.match(rate.replace(' ', ''))
+    if match is None:
+        raise ValueError(f"Invalid rate {rate!r}, expected something like '30/m' or '5/10s'")
+    limit, multiplier, unit = match.groups()
+    limit, period = int(limit), int(multiplier or 1) * PERIODS[unit]
+    if not limit or not period:
+        raise ValueError(f"Invalid rate {rate!r}, the count and period must be positive")
+    return limit, period
+
+
+def client_ip(request, proxy_count=0):
+    """The client address, taken from X-Forwarded-For only as far as ``proxy_count`` trusted hops."""
+    if proxy_count:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= proxy_count:
+            return forwarded[-proxy_count]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class MemoryBackend:
+    """Token buckets in this process, least recently used dropped first past ``max_entries``."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()  # key -> (tokens, time.monotonic() of last update)
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        """Take a token for ``key``; returns 0 if allowed, else seconds until one is free."""
+        rate = limit / period
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+        return 0 if allowed else (1 - tokens) / rate
+
+    def undo(self, key, limit, period):
+        """Give back the token an allowed ``hit`` took."""
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (min(limit, tokens + 1), updated)
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBackend:
+    """Sliding-window counters in the shared cache."""
+
+    def hit(self, key, limit, period):
+        """Count a request for ``key``; returns 0 if allowed, else seconds until one would be."""
+        now = time.time()
+        window = int(now // period)
+        current_key = f'forum:ratelimit:{key}:{window}'
+        cache.add(current_key, 0, period * 2)
+        try:
+            count = cache.incr(current_key)
+        except ValueError:  # evicted between add and incr
+            cache.set(current_key, 1, period * 2)
+            count = 1
+        previous = cache.get(f'forum:ratelimit:{key}:{window - 1}', 0)
+        elapsed = now - window * period
+        if previous * (1 - elapsed / period) + count <= limit:
+            return 0
+
+        # refused requests don't use up the allowance
+        cache.decr(current_key)
+        count -= 1
+        if count < limit:
+            # room once enough of the previous period has slid out of the window
+            return max(period * (1 - (limit - 1 - count) / previous) - elapsed, 0.001)
+        # this period alone is full: wait for the next one, and for this one to slide out in turn
+        return period - elapsed + period * (1 - (limit - 1) / count)
+
+    def undo(self, key, limit, period):
+        """Take back the count an allowed ``hit`` added."""
+        try:
+            cache.decr(f'forum:ratelimit:{key}:{int(time.time() // period)}')
+        except ValueError:  # expired, or the period rolled over since
+            pass
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(config=None):
+    config = config or get_config()
+    name = config['BACKEND']
+    with _backends_lock:
+        if name not in _backends:
+            if name == 'memory':
+                _backends[name] = MemoryBackend(config['MAX_ENTRIES'])
+            elif name == 'cache':
+                _backends[name] = CacheBackend()
+            else:
+                raise ValueError(f"Unknown rate limit backend {name!r}")
+        return _backends[name]
+
+
+def check(request, group, config=None):
+    """Seconds the client must wait before ``group`` accepts another request, 0 if it may go ahead."""
+    config = config or get_config()
+    limits = config['LIMITS'].get(group, {})
+    backend = get_backend(config)
+    keys = []
+    if 'user' in limits and request.user.is_authenticated:
+        keys.append(('user', f'{group}:user:{request.user.pk}'))
+    if 'ip' in limits:
+        keys.append(('ip', f'{group}:ip:{client_ip(request, config["PROXY_COUNT"])}'))
+
+    charged = []
+    for scope, key in keys:
+        limit, period = parse_rate(limits[scope])
+        retry_after = backend.hit(key, limit, period)
+        metrics.inc('forum_ratelimit_total', group=group, scope=scope,
+                    outcome='limited' if retry_after else 'allowed')
+        if retry_after:
+            # the request is refused, so it shouldn't use up the other limits either
+            for charged_key, charged_limit, charged_period in charged:
+                backend.undo(charged_key, charged_limit, charged_period)
+            return retry_after
+        charged.append((key, limit, period))
+    return 0
+
+
+def too_many_requests(request, retry_after):
+    seconds = max(math.ceil(retry_after), 1)
+    message = f"Too many requests, please try again in {seconds} seconds"
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        response = JsonResponse({'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+def rate_limit(group, methods=None):
+    """
+    Refuse requests over ``group``'s limits with a 429.
+
+    ``methods`` restricts the check to those HTTP methods, so a view that
+    shows a form on GET only counts the submissions.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            config = get_config()
+            if config['ENABLED'] and (methods is None or request.method in methods):
+                retry_after = check(request, group, config)
+                if retry_after:
+                    return too_many_requests(request, retry_after)
+            return view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
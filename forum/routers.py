@@ -0,0 +1,144 @@
+"""
+Read replicas for read-only page views.
+
+Views decorated with ``@replica_reads`` run their queries against a replica
+from ``READ_REPLICAS['DATABASES']`` when the request is a GET or HEAD; every
+other query, and every write, goes to ``default``. The chosen alias lives in
+a context variable for the length of the view, so nothing else (sessions,
+auth, the task worker) is affected.
+
+A client that wrote something is pinned to the primary for ``PIN_SECONDS``
+through a cookie set by ``ReplicaPinMiddleware`` (forum/middleware.py), so they see their own post
+or vote straight away rather than whatever the replica has caught up to.
+A replica that fails to connect is skipped until ``RETRY_AFTER`` seconds have
+passed and its reads fall back to the primary.
+
+Other readers can see up to replication lag's worth of stale data, but none
+of it is cached under a version stamp (forum/versions.py) newer than the
+replica: a view that fetches a stamp bumped less than ``PIN_SECONDS`` ago
+reads from the primary from then on (``primary_if_changed``), pages showing
+such a scope get no page cache entry or validators, and the home snapshot and
+followed-feed lists are always built from the primary. Like the pin, this
+assumes replication lag stays under ``PIN_SECONDS``.
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DATABASES': [],
+    'PIN_SECONDS': 5,  # read-your-writes window after a write
+    'PIN_COOKIE': 'forum_primary',
+    'RETRY_AFTER': 30,  # seconds before a failed replica is tried again
+}
+
+# alias reads in the current view go to, None for the primary
+read_alias = contextvars.ContextVar('read_alias', default=None)
+# set to a one-item list by ReplicaPinMiddleware; the router flags writes in it
+request_writes = contextvars.ContextVar('request_writes', default=None)
+
+_down = {}  # alias -> time.monotonic() when it failed
+_down_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+def mark_down(alias):
+    with _down_lock:
+        _down[alias] = time.monotonic()
+
+
+def healthy(alias, retry_after):
+    with _down_lock:
+        failed = _down.get(alias)
+        if failed is not None and time.monotonic() - failed < retry_after:
+            return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        logger.warning("Replica %s is unavailable, reading from the primary", alias, exc_info=True)
+        mark_down(alias)
+        return False
+    with _down_lock:
+        _down.pop(alias, None)
+    return True
+
+
+def choose_replica(config=None):
+    """A healthy replica alias picked at random, or None to use the primary."""
+    config = config or get_config()
+    aliases = list(config['DATABASES'])
+    random.shuffle(aliases)
+    for alias in aliases:
+        if healthy(alias, config['RETRY_AFTER']):
+            return alias
+    return None
+
+
+def replica_reads(view_func):
+    """Send the view's queries to a replica for safe requests from clients that aren't pinned."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        config = get_config()
+        if (not config['DATABASES'] or request.method not in ('GET', 'HEAD')
+                or config['PIN_COOKIE'] in request.COOKIES):
+            return view_func(request, *args, **kwargs)
+        token = read_alias.set(choose_replica(config))
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            read_alias.reset(token)
+
+    return wrapper
+
+
+def may_lag(stamps, config=None):
+    """Whether the replicas may not have caught up to changes made at ``stamps`` (``time.time()`` values)."""
+    config = config or get_config()
+    return bool(config['DATABASES'] and stamps) and time.time() - max(stamps) < config['PIN_SECONDS']
+
+
+def primary_if_changed(stamps):
+    """Send the rest of the view's reads to the primary if ``stamps`` are too recent for the replicas."""
+    if read_alias.get() is not None and may_lag(stamps):
+        # replica_reads resets this when the view returns
+        read_alias.set(None)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, e.g. to build something that gets cached."""
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        writes = request_writes.get()
+        if writes is not None:
+            writes[0] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,233 @@
+"""
+Full-text search over posts.
+
+Every term of the query must appear somewhere in the post, as a substring,
+the way the old ``icontains`` scan matched: 'ampu' finds 'campus', and Chinese
+text, which has no spaces to split words on, matches anywhere too.
+
+The index is trigram based: an FTS5 table with the ``trigram`` tokenizer on
+SQLite (3.34+), kept up to date by forum/signals.py on every Post save/delete
+and rebuilt in bulk by the ``rebuild_search_index`` management command, and a
+``pg_trgm`` GIN index on PostgreSQL, which the database maintains itself.
+Terms shorter than three characters can't be looked up in a trigram index,
+so queries with one are answered by the ``icontains`` scan, as are databases
+without either feature.
+"""
+import re
+
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import TopicCircle, Post
+
+REBUILD_BATCH_SIZE = 1000
+RESULTS_PER_PAGE = 20
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query or '')
+
+
+def substring_filter(query):
+    condition = Q()
+    for term in search_terms(query):
+        condition &= Q(content__icontains=term)
+    return condition
+
+
+class FallbackBackend:
+    """No index at all, same scan the views used to run."""
+    table = None
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        pass
+
+    def uninstall(self):
+        pass
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def rebuild(self, posts):
+        return 0
+
+    def filter_posts(self, query):
+        return Post.objects.using(self.connection.alias).filter(substring_filter(query))
+
+    def count(self, query):
+        return self.filter_posts(query).count()
+
+    def post_ids(self, query, offset, limit):
+        ids = self.filter_posts(query).order_by('-created_at').values_list('id', flat=True)
+        return list(ids[offset:offset + limit])
+
+
+class SQLiteFTSBackend(FallbackBackend):
+    table = 'forum_post_fts'
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5(content, tokenize='trigram')")
+            cursor.execute(f"INSERT INTO {self.table}(rowid, content) SELECT id, content FROM forum_post")
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index_post(self, post):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [post.pk])
+            cursor.execute(f"INSERT INTO {self.table}(rowid, content) VALUES (%s, %s)", [post.pk, post.content])
+
+    def remove_post(self, post_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [post_id])
+
+    def rebuild(self, posts):
+        total = 0
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            for batch in batched(posts.values_list('id', 'content'), REBUILD_BATCH_SIZE):
+                cursor.executemany(f"INSERT INTO {self.table}(rowid, content) VALUES (%s, %s)", batch)
+                total += len(batch)
+        return total
+
+    def match_expression(self, query):
+        # each quoted term matches as a substring anywhere in the post
+        return ' '.join(f'"{term}"' for term in search_terms(query))
+
+    def indexable(self, query):
+        return all(len(term) >= 3 for term in search_terms(query))
+
+    def count(self, query):
+        if not self.indexable(query):
+            return super().count(query)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {self.table} WHERE {self.table} MATCH %s",
+                           [self.match_expression(query)])
+            return cursor.fetchone()[0]
+
+    def post_ids(self, query, offset, limit):
+        if not self.indexable(query):
+            return super().post_ids(query, offset, limit)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s "
+                f"ORDER BY rank, rowid DESC LIMIT %s OFFSET %s",
+                [self.match_expression(query), limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresBackend(FallbackBackend):
+    """
+    The ``icontains`` scan itself, served by a ``pg_trgm`` GIN index on
+    ``UPPER(content)`` (the expression Django's ``icontains`` compares), so
+    there is no separate table to keep in sync. Matches are ranked by
+    ``word_similarity`` between the query and the post, newest first among
+    equals, much as FTS5's ``rank`` orders them on SQLite.
+    """
+
+    def post_ids(self, query, offset, limit):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        ids = self.filter_posts(query).annotate(
+            rank=TrigramWordSimilarity(query, 'content')
+        ).order_by('-rank', '-created_at').values_list('id', flat=True)
+        return list(ids[offset:offset + limit])
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable.iterator(chunk_size=size):
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def sqlite_has_trigram_fts(connection):
+    if connection.Database.sqlite_version_info < (3, 34):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def backend_class(connection):
+    if connection.vendor == 'postgresql':
+        return PostgresBackend
+    if connection.vendor == 'sqlite' and sqlite_has_trigram_fts(connection):
+        return SQLiteFTSBackend
+    return FallbackBackend
+
+
+_backends = {}
+
+
+def get_backend(using=None):
+    # queries follow the view's replica; index writes pass the alias they were saved to
+    connection = connections[using or router.db_for_read(Post)]
+    backend = _backends.get(connection.alias)
+    if backend is None:
+        backend = backend_class(connection)
+        if backend.table and backend.table not in connection.introspection.table_names():
+            # index not migrated on this database yet, don't remember that
+            return FallbackBackend(connection)
+        _backends[connection.alias] = backend
+    return backend(connection)
+
+
+class PostSearchResults:
+    """Lazy ranked result list, sliced by Paginator into single index lookups."""
+
+    def __init__(self, query, using=None):
+        self.query = query
+        self.backend = get_backend(using)
+
+    def count(self):
+        if not search_terms(self.query):
+            return 0
+        return self.backend.count(self.query)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        offset = item.start or 0
+        limit = (item.stop if item.stop is not None else offset + 1000) - offset
+        if limit <= 0 or not search_terms(self.query):
+            return []
+        ids = self.backend.post_ids(self.query, offset, limit)
+        posts = Post.objects.select_related('user', 'circle').in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def search_circles(query):
+    return TopicCircle.objects.filter(
+        Q(name__icontains=query) | Q(description__icontains=query),
+        is_active=True
+    )
+
+
+def search_posts(query):
+    return PostSearchResults(query)
+
+
+def search_forum(query, page_number=None):
+    """Results for the search page."""
+    paginator = Paginator(search_posts(query), RESULTS_PER_PAGE)
+    return {
+        'circles': search_circles(query),
+        'posts': paginator.get_page(page_number),
+    }
@@ -0,0 +1,116 @@
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    TopicCircle, Post, Comment, Announcement, GUser, Report, PostVote, CommentVote, UserCircleFollow
+)
+from .feed import invalidate_home_snapshot
+from .timeline import invalidate_circle
+from .versions import bump, scopes_for
+from .search import get_backend
+from .trending import score_update
+from .profiling import record_connect
+from .auth import user_cache
+from . import stats
+
+
+@receiver([post_save, post_delete], sender=TopicCircle)
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Announcement)
+def refresh_home_snapshot(sender, **kwargs):
+    invalidate_home_snapshot()
+
+
+@receiver([post_save, post_delete], sender=TopicCircle)
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Announcement)
+@receiver([post_save, post_delete], sender=GUser)
+@receiver([post_save, post_delete], sender=UserCircleFollow)
+def bump_fragment_versions(sender, instance, **kwargs):
+    bump(*scopes_for(instance))
+
+
+@receiver([post_save, post_delete], sender=Post)
+def refresh_circle_timeline(sender, instance, created=False, **kwargs):
+    # edits, votes and pins don't change which posts are newest
+    if created or kwargs['signal'] is post_delete:
+        invalidate_circle(instance.circle_id)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, using, update_fields=None, **kwargs):
+    # like/pin/recommend saves don't touch the text
+    if update_fields is not None and 'content' not in update_fields:
+        return
+    get_backend(using).index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, using, **kwargs):
+    get_backend(using).remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, using, **kwargs):
+    if created:
+        TopicCircle.objects.using(using).filter(pk=instance.circle_id).update(post_count=F('post_count') + 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, using, **kwargs):
+    TopicCircle.objects.using(using).filter(pk=instance.circle_id).update(post_count=F('post_count') - 1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, using, **kwargs):
+    if created:
+        Post.objects.using(using).filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1, trending_score=score_update({'comment_count': 1})
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, using, **kwargs):
+    Post.objects.using(using).filter(pk=instance.post_id).update(
+        comment_count=F('comment_count') - 1, trending_score=score_update({'comment_count': -1})
+    )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=GUser)
+@receiver(post_save, sender=Report)
+@receiver(post_save, sender=PostVote)
+@receiver(post_save, sender=CommentVote)
+def count_stat_created(sender, instance, created, using, **kwargs):
+    if created:
+        metric, field = stats.metric_for(sender)
+        stats.record(metric, getattr(instance, field), 1, using)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=GUser)
+@receiver(post_delete, sender=Report)
+@receiver(post_delete, sender=PostVote)
+@receiver(post_delete, sender=CommentVote)
+def count_stat_deleted(sender, instance, using, **kwargs):
+    metric, field = stats.metric_for(sender)
+    stats.record(metric, getattr(instance, field), -1, using)
+
+
+@receiver([post_save, post_delete], sender=GUser)
+def forget_cached_user(sender, instance, **kwargs):
+    # other processes notice through the user:<id> version bump
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    # forum/backends/postgresql records its own, with timings
+    if not hasattr(connection, 'pool'):
+        record_connect(connection.alias)
@@ -0,0 +1,159 @@
+"""
+Hourly and daily statistics rollups for the admin dashboard.
+
+Every create/delete of a counted model moves one hourly and one daily
+StatBucket by +1/-1 (see forum/signals.py), so any date range is answered by
+summing a few dozen bucket rows instead of a COUNT(*) over the whole table.
+Only the parts of a range that don't line up with whole hours fall back to
+counting rows directly.
+"""
+import datetime
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncHour, TruncDay
+
+from .models import StatBucket
+
+UTC = datetime.timezone.utc
+
+# metric -> (app_label.Model, timestamp field); votes span two tables
+METRICS = {
+    'posts': [('forum.Post', 'created_at')],
+    'comments': [('forum.Comment', 'created_at')],
+    'users': [('forum.GUser', 'date_joined')],
+    'reports': [('forum.Report', 'created_at')],
+    'votes': [('forum.PostVote', 'created_at'), ('forum.CommentVote', 'created_at')],
+}
+
+GRANULARITIES = {
+    'hour': (TruncHour, datetime.timedelta(hours=1)),
+    'day': (TruncDay, datetime.timedelta(days=1)),
+}
+
+
+def day_range(start_date, end_date):
+    """``YYYY-MM-DD`` strings to an aware ``[start, end)`` covering both whole days."""
+    start = datetime.datetime.strptime(start_date, '%Y-%m-%d').replace(tzinfo=UTC)
+    end = datetime.datetime.strptime(end_date, '%Y-%m-%d').replace(tzinfo=UTC) + datetime.timedelta(days=1)
+    return start, end
+
+
+def metric_for(model):
+    for metric, sources in METRICS.items():
+        for label, field in sources:
+            if model._meta.label == label:
+                return metric, field
+    return None, None
+
+
+def floor_to(granularity, when):
+    when = when.astimezone(UTC)
+    if granularity == 'day':
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_to(granularity, when):
+    floor = floor_to(granularity, when)
+    return floor if floor == when else floor + GRANULARITIES[granularity][1]
+
+
+def record(metric, when, delta=1, using='default'):
+    for granularity in GRANULARITIES:
+        bucket = dict(metric=metric, granularity=granularity, bucket_start=floor_to(granularity, when))
+        buckets = StatBucket.objects.using(using).filter(**bucket)
+        if buckets.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                StatBucket.objects.using(using).create(count=delta, **bucket)
+        except IntegrityError:
+            # another worker created the bucket first
+            buckets.update(count=F('count') + delta)
+
+
+def count_rows(metric, start, end):
+    total = 0
+    for label, field in METRICS[metric]:
+        model = global_apps.get_model(label)
+        total += model.objects.filter(**{f'{field}__gte': start, f'{field}__lt': end}).count()
+    return total
+
+
+def bucket_sums(metrics, granularity, start, end):
+    if start >= end:
+        return {}
+    rows = StatBucket.objects.filter(
+        metric__in=metrics, granularity=granularity, bucket_start__gte=start, bucket_start__lt=end
+    ).values('metric').annotate(total=Sum('count'))
+    return {row['metric']: row['total'] for row in rows}
+
+
+def totals(metrics, start, end):
+    """Number of each metric's rows created in ``[start, end)``."""
+    result = {metric: 0 for metric in metrics}
+    if start >= end:
+        return result
+
+    first_hour, last_hour = ceil_to('hour', start), floor_to('hour', end)
+    first_day, last_day = ceil_to('day', start), floor_to('day', end)
+    if first_hour >= last_hour:
+        # shorter than one whole hour, nothing to roll up
+        for metric in metrics:
+            result[metric] = count_rows(metric, start, end)
+        return result
+
+    ranges = []
+    if first_day < last_day:
+        ranges += [('day', first_day, last_day), ('hour', first_hour, first_day), ('hour', last_day, last_hour)]
+    else:
+        ranges.append(('hour', first_hour, last_hour))
+    for granularity, range_start, range_end in ranges:
+        for metric, total in bucket_sums(metrics, granularity, range_start, range_end).items():
+            result[metric] += total
+
+    for range_start, range_end in ((start, first_hour), (last_hour, end)):
+        if range_start < range_end:
+            for metric in metrics:
+                result[metric] += count_rows(metric, range_start, range_end)
+    return result
+
+
+def series(metric, granularity, start, end):
+    """Bucket counts from ``start`` to ``end`` with empty buckets filled in as 0."""
+    step = GRANULARITIES[granularity][1]
+    start, end = floor_to(granularity, start), ceil_to(granularity, end)
+    counts = dict(StatBucket.objects.filter(
+        metric=metric, granularity=granularity, bucket_start__gte=start, bucket_start__lt=end
+    ).values_list('bucket_start', 'count'))
+    points = []
+    current = start
+    while current < end:
+        points.append({'start': current.isoformat(), 'count': counts.get(current, 0)})
+        current += step
+    return points
+
+
+def rebuild(apps=global_apps, using='default'):
+    """Recompute every bucket from the source tables."""
+    Bucket = apps.get_model('forum', 'StatBucket')
+    Bucket.objects.using(using).all().delete()
+    created = 0
+    for metric, sources in METRICS.items():
+        for granularity, (trunc, _) in GRANULARITIES.items():
+            totals_by_bucket = {}
+            for label, field in sources:
+                model = apps.get_model(label)
+                rows = model.objects.using(using).annotate(
+                    bucket=trunc(field, tzinfo=UTC)
+                ).order_by().values('bucket').annotate(n=Count('pk')).values_list('bucket', 'n')
+                for bucket, n in rows:
+                    totals_by_bucket[bucket] = totals_by_bucket.get(bucket, 0) + n
+            Bucket.objects.using(using).bulk_create([
+                Bucket(metric=metric, granularity=granularity, bucket_start=bucket, count=n)
+                for bucket, n in totals_by_bucket.items()
+            ], batch_size=500)
+            created += len(totals_by_bucket)
+    return created
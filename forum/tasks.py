@@ -0,0 +1,260 @@
+"""
+Database-backed job queue for work a request shouldn't wait for.
+
+Functions registered with ``@task`` are queued with ``enqueue``, which writes a
+``Job`` row in the caller's transaction: if the request rolls back, the job
+was never queued, and ``manage.py run_worker`` only sees it after commit.
+Workers claim jobs with a conditional UPDATE (so several can share a queue
+without row locks), highest ``priority`` first, and retry failures with
+exponential backoff until ``max_attempts``. An ``idempotency_key`` makes
+enqueueing the same work twice return the first job instead.
+
+With ``TASKS['EAGER']`` jobs run inline inside ``enqueue`` and errors
+propagate, which is what tests and a worker-less dev server want. Otherwise
+a worker is required (the Procfile's ``worker`` process): without one,
+reports, circle deletions and deferred geocoding queue up and never happen,
+and the admin dashboard says so once jobs have waited ``STALLED_AFTER``.
+"""
+import datetime
+import hashlib
+import logging
+import random
+import signal
+import time
+import traceback
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job, TopicCircle, Post, Report
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'EAGER': False,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 10,  # seconds before the first retry, doubled for each one after
+    'MAX_BACKOFF': 60 * 60,
+    'POLL_INTERVAL': 1.0,  # seconds an idle worker sleeps between polls
+    'LEASE': 10 * 60,  # a job running longer than this is assumed lost with its worker
+    'KEEP_FINISHED': 7 * 24 * 60 * 60,  # finished jobs are purged after this many seconds
+    'STALLED_AFTER': 5 * 60,  # a ready job waiting this long means no worker is running
+}
+
+registry = {}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TASKS', {})}
+
+
+def task(name, priority=0, max_attempts=None, atomic=True):
+    """
+    Register a function as a task.
+
+    Its arguments must be JSON serializable keywords. ``atomic`` runs each
+    attempt in a transaction so a failed one leaves nothing behind; tasks that
+    commit in batches themselves turn it off and must be safe to resume.
+    """
+    def decorator(func):
+        func.task_name = name
+        func.priority = priority
+        func.max_attempts = max_attempts
+        func.atomic = atomic
+        registry[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name, key=None, priority=None, delay=0, **kwargs):
+    """Queue task ``name`` with ``kwargs``; returns the Job, or None when run eagerly."""
+    func = registry[name]
+    config = get_config()
+    if config['EAGER']:
+        call(func, kwargs)
+        return None
+
+    job = Job(
+        task=name,
+        kwargs=kwargs,
+        priority=func.priority if priority is None else priority,
+        max_attempts=func.max_attempts or config['MAX_ATTEMPTS'],
+        run_at=timezone.now() + datetime.timedelta(seconds=delay),
+        idempotency_key=key,
+    )
+    if key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=key)
+    return job
+
+
+def call(func, kwargs):
+    if func.atomic:
+        with transaction.atomic():
+            return func(**kwargs)
+    return func(**kwargs)
+
+
+def backoff(attempts, config):
+    """Delay before retry number ``attempts``, with jitter so failed batches spread out."""
+    delay = min(config['BACKOFF'] * 2 ** (attempts - 1), config['MAX_BACKOFF'])
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Worker:
+    def __init__(self, log=None):
+        self.config = get_config()
+        self.log = log or logger.info
+        self.stopping = False
+
+    def requeue_lost(self):
+        """Jobs left running by a worker that died are retried, or failed if out of attempts."""
+        lost = Job.objects.filter(
+            status=Job.RUNNING,
+            locked_at__lt=timezone.now() - datetime.timedelta(seconds=self.config['LEASE']),
+        )
+        lost.filter(attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED, finished_at=timezone.now(), last_error='Worker lost while running the job',
+        )
+        return lost.update(status=Job.QUEUED)
+
+    def claim(self):
+        now = timezone.now()
+        ready = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'id')
+        for pk in ready.values_list('pk', flat=True)[:10]:
+            # another worker may have taken it since the SELECT
+            if Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1,
+            ):
+                return Job.objects.get(pk=pk)
+        return None
+
+    def run(self, job):
+        """Run one claimed job; returns True if it succeeded."""
+        started = time.perf_counter()
+        try:
+            func = registry.get(job.task)
+            if func is None:
+                raise LookupError(f"No task registered as {job.task!r}")
+            call(func, job.kwargs)
+        except Exception:
+            self.failed(job, traceback.format_exc())
+            return False
+        Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now(), last_error='')
+        self.log(f"{job} done in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return True
+
+    def failed(self, job, error):
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, finished_at=timezone.now(), last_error=error)
+            logger.error("%s failed after %d attempts:\n%s", job, job.attempts, error)
+            return
+        delay = backoff(job.attempts, self.config)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.QUEUED, run_at=timezone.now() + datetime.timedelta(seconds=delay), last_error=error,
+        )
+        logger.warning("%s attempt %d failed, retrying in %.0fs:\n%s", job, job.attempts, delay, error)
+
+    def purge(self):
+        cutoff = timezone.now() - datetime.timedelta(seconds=self.config['KEEP_FINISHED'])
+        deleted, _ = Job.objects.filter(status__in=[Job.DONE, Job.FAILED], finished_at__lt=cutoff).delete()
+        return deleted
+
+    def run_pending(self, max_jobs=None):
+        """Run ready jobs until there are none left (or ``max_jobs``); returns how many ran."""
+        ran = 0
+        while not self.stopping and (max_jobs is None or ran < max_jobs):
+            job = self.claim()
+            if job is None:
+                break
+            self.run(job)
+            ran += 1
+        return ran
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def work(self, once=False, max_jobs=None):
+        """Poll until stopped; SIGTERM/SIGINT let the current job finish first."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        ran = 0
+        last_maintenance = 0
+        while not self.stopping and (max_jobs is None or ran < max_jobs):
+            if time.monotonic() - last_maintenance > self.config['LEASE'] / 2:
+                self.requeue_lost()
+                self.purge()
+                last_maintenance = time.monotonic()
+            job = self.claim()
+            if job is not None:
+                self.run(job)
+                ran += 1
+            elif once:
+                break
+            else:
+                time.sleep(self.config['POLL_INTERVAL'])
+            # drop connections the database closed while we waited or ran
+            close_old_connections()
+        return ran
+
+
+def stalled_jobs():
+    """How many jobs have been ready for longer than ``STALLED_AFTER``, i.e. nothing is working the queue."""
+    config = get_config()
+    if config['EAGER']:
+        return 0
+    cutoff = timezone.now() - datetime.timedelta(seconds=config['STALLED_AFTER'])
+    return Job.objects.filter(status=Job.QUEUED, run_at__lt=cutoff).count()
+
+
+def circles_being_deleted():
+    """Ids of circles whose ``forum.delete_circle`` job hasn't finished yet."""
+    kwargs = Job.objects.filter(task='forum.delete_circle', status__in=[Job.QUEUED, Job.RUNNING]) \
+        .values_list('kwargs', flat=True)
+    return {job_kwargs['circle_id'] for job_kwargs in kwargs}
+
+
+def reason_key(reason):
+    return hashlib.sha1(reason.encode()).hexdigest()[:16]
+
+
+# ---------------------------------------------------------------------------
+# Tasks
+
+@task('forum.fill_location', priority=10)
+def fill_location(model, pk, lat, lon):
+    from .geocoding import get_geocoder
+    get_geocoder().fill_location(apps.get_model(model), pk, lat, lon)
+
+
+@task('forum.create_report')
+def create_report(user_id, post_id, reason):
+    if Post.objects.filter(pk=post_id).exists():  # not deleted while queued
+        Report.objects.create(user_id=user_id, post_id=post_id, reason=reason)
+
+
+CIRCLE_DELETE_BATCH = 200
+
+
+@task('forum.delete_circle', priority=-10, atomic=False)
+def delete_circle(circle_id):
+    """Delete a deactivated circle a batch of posts at a time, so no transaction holds it all."""
+    if not TopicCircle.objects.filter(pk=circle_id, is_active=False).exists():
+        return  # already gone, or reactivated since
+    posts = Post.objects.filter(circle_id=circle_id)
+    while True:
+        ids = list(posts.values_list('pk', flat=True)[:CIRCLE_DELETE_BATCH])
+        if not ids:
+            break
+        with transaction.atomic():
+            Post.objects.filter(pk__in=ids).delete()
+    TopicCircle.objects.filter(pk=circle_id).delete()
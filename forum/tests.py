@@ -1,12 +1,28 @@
-from django.test import TestCase, Client
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from forum.models import (
-    GUser, TopicCircle, Post, Comment, Report, Announcement, UserCircleFollow
+    GUser, TopicCircle, Post, Comment, Report, Announcement, UserCircleFollow, Job
 )
 from forum.forms import (
     GUserCreationForm, NicknameForm, TopicCircleForm, AnnouncementForm
 )
+from forum.geocoding import reset_geocoder
+from forum.bench import seed_forum, run_benchmarks, compare, run_connections
+from forum.profiling import metrics, fingerprint, external_call
+from forum.trending import hot_score, top_posts
+from forum.transfer import export_forum, import_forum
+from forum.tasks import task, enqueue, Worker
+from forum import routers, ratelimit
 
 User = get_user_model()
 
@@ -105,6 +121,11 @@ class ViewsTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertTrue(Post.objects.filter(content='A new test post content').exists())
 
+    def test_circle_detail_requires_login(self):
+        url = reverse('circle_detail', args=[self.circle.id])
+        response = self.client.get(url)
+        self.assertRedirects(response, f"{reverse('login')}?next={url}")
+
     def test_like_post(self):
 
         self.client.login(username='testuser', password='testpass')
@@ -161,6 +182,1712 @@ class ViewsTest(TestCase):
         self.assertTemplateUsed(response, 'forum/admin_dashboard.html')
 
 
+# ===========================
+# Home Feed Snapshot Test
+class HomeFeedTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='feeduser',
+            email='feed@example.com',
+            password='feedpass'
+        )
+        self.circle = TopicCircle.objects.create(name='Feed Circle', created_by=self.user)
+        Post.objects.create(user=self.user, circle=self.circle, content='First feed post')
+
+    def test_home_snapshot_is_cached(self):
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'First feed post')
+
+    def test_home_snapshot_invalidated_on_post_save(self):
+        self.client.get(reverse('home'))
+        Post.objects.create(user=self.user, circle=self.circle, content='Second feed post', likes=5)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Second feed post')
+
+    def test_search_param_runs_no_search(self):
+        self.client.get(reverse('home'))
+        # the home page only puts the query back in the box; the search view answers it
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'), {'search': 'feed'})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_snapshot_not_cached_without_a_shared_cache(self):
+        from forum.feed import get_home_snapshot
+        get_home_snapshot()
+        # another worker's post, whose invalidation this process never sees
+        Post.objects.bulk_create([Post(user=self.user, circle=self.circle, content='Elsewhere', is_recommended=True)])
+        self.assertIn('Elsewhere', [post.content for post in get_home_snapshot()['recommended_posts']])
+
+
+# ===========================
+# Circle Detail Pagination Test
+class CirclePaginationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='pageuser',
+            email='page@example.com',
+            password='pagepass'
+        )
+        self.circle = TopicCircle.objects.create(name='Busy Circle', created_by=self.user)
+        for i in range(45):
+            post = Post.objects.create(user=self.user, circle=self.circle, content=f'Post {i}',
+                                       likes=i % 7, is_pinned=(i % 10 == 0))
+            for _ in range(i % 3):
+                Comment.objects.create(user=self.user, post=post, content='c')
+        self.client.login(username='pageuser', password='pagepass')
+
+    def walk(self, sort):
+        url = reverse('circle_detail', args=[self.circle.id])
+        ids, cursor = [], ''
+        while True:
+            response = self.client.get(url, {'sort': sort, 'cursor': cursor},
+                                       HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            data = response.json()
+            ids.extend(post['id'] for post in data['posts'])
+            if not data['has_next']:
+                return ids
+            cursor = data['next_cursor']
+
+    def test_cursor_walk_matches_full_ordering(self):
+        sort_options = {
+            'created_at_desc': '-created_at',
+            'created_at_asc': 'created_at',
+            'likes_desc': '-likes',
+            'likes_asc': 'likes',
+            'comments_desc': '-comment_count',
+            'comments_asc': 'comment_count',
+        }
+        for sort, field in sort_options.items():
+            tie = '-id' if field.startswith('-') else 'id'
+            expected = list(Post.objects.filter(circle=self.circle).order_by(
+                '-is_pinned', field, tie
+            ).values_list('id', flat=True))
+            self.assertEqual(self.walk(sort), expected, sort)
+
+    def test_first_page_is_bounded(self):
+        response = self.client.get(reverse('circle_detail', args=[self.circle.id]))
+        self.assertEqual(len(response.context['posts']), 20)
+        self.assertTrue(response.context['posts'].has_next())
+
+
+class CommentPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='threaduser', email='thread@example.com', password='threadpass')
+        circle = TopicCircle.objects.create(name='Thread Circle')
+        self.post = Post.objects.create(user=self.user, circle=circle, content='Viral post')
+        Comment.objects.bulk_create([
+            Comment(user=self.user, post=self.post, content=f'Comment {i}', likes=i % 4) for i in range(45)
+        ])
+        # several comments share a timestamp, so only the id tie-break keeps pages apart
+        for comment in Comment.objects.filter(post=self.post):
+            Comment.objects.filter(pk=comment.pk).update(
+                created_at=timezone.now() - timezone.timedelta(minutes=comment.pk // 3)
+            )
+        self.client.login(username='threaduser', password='threadpass')
+
+    def walk(self, sort):
+        url = reverse('post_detail', args=[self.post.id])
+        ids, cursor = [], ''
+        while True:
+            data = self.client.get(url, {'sort': sort, 'cursor': cursor}, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+            self.assertLessEqual(len(data['comments']), 20)
+            ids.extend(comment['id'] for comment in data['comments'])
+            if not data['has_next']:
+                return ids
+            cursor = data['next_cursor']
+
+    def test_cursor_walk_matches_full_ordering(self):
+        sort_options = {
+            'created_at_desc': '-created_at',
+            'created_at_asc': 'created_at',
+            'likes_desc': '-likes',
+            'likes_asc': 'likes',
+        }
+        for sort, field in sort_options.items():
+            tie = '-id' if field.startswith('-') else 'id'
+            expected = list(Comment.objects.filter(post=self.post).order_by(field, tie).values_list('id', flat=True))
+            self.assertEqual(self.walk(sort), expected, sort)
+
+    def test_first_page_is_bounded(self):
+        url = reverse('post_detail', args=[self.post.id])
+        cache.clear()  # both requests start cold
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertContains(response, 'load-more-comments')
+
+        Comment.objects.bulk_create([Comment(user=self.user, post=self.post, content='more') for _ in range(500)])
+        cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertEqual(len(large), len(small))
+
+
+# ===========================
+# Full-text Search Test
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='searchuser',
+            email='search@example.com',
+            password='searchpass'
+        )
+        self.circle = TopicCircle.objects.create(name='Search Circle', created_by=self.user)
+        self.match = Post.objects.create(user=self.user, circle=self.circle, content='Library opening hours on campus')
+        Post.objects.create(user=self.user, circle=self.circle, content='Football tonight')
+        self.client.login(username='searchuser', password='searchpass')
+
+    def result_ids(self, query):
+        response = self.client.get(reverse('search'), {'q': query})
+        return [post.id for post in response.context['search_results']['posts']]
+
+    def test_search_uses_index_with_prefix_terms(self):
+        self.assertEqual(self.result_ids('camp hours'), [self.match.id])
+        self.assertEqual(self.result_ids('basketball'), [])
+
+    def test_mid_word_and_cjk_queries(self):
+        chinese = Post.objects.create(user=self.user, circle=self.circle, content='格拉斯哥大学图书馆今晚开放')
+        self.assertEqual(self.result_ids('brary'), [self.match.id])
+        self.assertEqual(self.result_ids('大学图书馆'), [chinese.id])
+        # two characters is below the trigram length, answered by the scan
+        self.assertEqual(self.result_ids('今晚'), [chinese.id])
+        self.assertEqual(self.result_ids('图书 Library'), [])
+
+    def test_index_follows_post_edit_and_delete(self):
+        self.match.content = 'Canteen menu'
+        self.match.save()
+        self.assertEqual(self.result_ids('library'), [])
+        self.assertEqual(self.result_ids('canteen'), [self.match.id])
+        self.match.delete()
+        self.assertEqual(self.result_ids('canteen'), [])
+
+    def test_rebuild_search_index_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 2 posts', out.getvalue())
+        self.assertEqual(self.result_ids('football'), [Post.objects.get(content='Football tonight').id])
+
+
+# ===========================
+# Vote Counter Test
+class VoteCounterTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='voter',
+            email='voter@example.com',
+            password='voterpass'
+        )
+        self.circle = TopicCircle.objects.create(name='Vote Circle', created_by=self.user)
+        self.post = Post.objects.create(user=self.user, circle=self.circle, content='Vote on me')
+        self.client.login(username='voter', password='voterpass')
+
+    def test_repeat_like_is_counted_once(self):
+        for _ in range(3):
+            self.client.get(reverse('like_post', args=[self.post.id]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+
+    def test_switching_vote_moves_the_count(self):
+        self.client.get(reverse('like_post', args=[self.post.id]))
+        self.client.get(reverse('dislike_post', args=[self.post.id]))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes, self.post.dislikes), (0, 1))
+
+    def test_concurrent_switches_move_the_count_once(self):
+        from unittest import mock
+        from forum.counters import cast_vote, LIKE, DISLIKE
+        from forum.models import PostVote
+        cast_vote(self.user, self.post, LIKE)
+        stale = PostVote.objects.get(user=self.user, post=self.post)
+        self.assertTrue(cast_vote(self.user, self.post, DISLIKE))
+        # a second request that read the vote before the first one switched it
+        with mock.patch.object(PostVote.objects, 'get_or_create', return_value=(stale, False)):
+            self.assertFalse(cast_vote(self.user, self.post, DISLIKE))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes, self.post.dislikes), (0, 1))
+
+    def test_timer_flush_closes_its_connections(self):
+        from unittest import mock
+        from forum.counters import VoteBuffer
+        buffer = VoteBuffer(max_pending=100, max_age=60)
+        buffer.add(Post, self.post.id, {'likes': 1})
+        buffer.timer.cancel()
+        with mock.patch('forum.counters.connections.close_all') as close_all:
+            buffer.flush_from_timer()
+        close_all.assert_called_once()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+
+    def test_buffer_coalesces_into_one_update(self):
+        from forum.counters import VoteBuffer
+        buffer = VoteBuffer(max_pending=100, max_age=60)
+        for _ in range(10):
+            buffer.add(Post, self.post.id, {'likes': 1})
+        self.assertEqual(len(buffer), 1)
+        with self.assertNumQueries(1):
+            buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 10)
+
+
+# ===========================
+# Geocoding Test
+STUB_GEOCODER = {'BACKEND': 'forum.geocoding.StubBackend', 'DEFERRED': False}
+
+
+@override_settings(GEOCODER=STUB_GEOCODER)
+class GeocodingTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='geouser',
+            email='geo@example.com',
+            password='geopass'
+        )
+        self.circle = TopicCircle.objects.create(name='Geo Circle', created_by=self.user)
+        self.client.login(username='geouser', password='geopass')
+        reset_geocoder(setting='GEOCODER')  # fresh stub and cache per test
+
+    @override_settings(GEOCODER={**STUB_GEOCODER, 'DEFERRED': True})
+    def test_filled_location_refreshes_cached_pages(self):
+        self.client.post(reverse('create_post', args=[self.circle.id]),
+                         {'content': 'Deferred', 'use_location': 'on', 'lat': '55.8721', 'lon': '-4.2888'})
+        url = reverse('circle_detail', args=[self.circle.id])
+        self.client.get(url)  # shows the "created" message
+        response = self.client.get(url)
+        self.assertContains(response, 'Lat: 55.8721, Lon: -4.2888')
+        etag = response['ETag']
+        Worker().run_pending()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Stub Location (55.872, -4.289)')
+
+    def test_nearby_coordinates_share_one_lookup(self):
+        from forum.geocoding import get_geocoder
+        url = reverse('create_post', args=[self.circle.id])
+        self.client.post(url, {'content': 'here', 'use_location': 'on', 'lat': '55.87211', 'lon': '-4.28881'})
+        self.client.post(url, {'content': 'also here', 'use_location': 'on', 'lat': '55.87214', 'lon': '-4.28879'})
+        response = self.client.get(reverse('geocode'), {'lat': '55.8721', 'lon': '-4.2888'})
+        self.assertEqual(get_geocoder().backend.calls, 1)
+        self.assertEqual(Post.objects.get(content='here').location, 'Stub Location (55.872, -4.289)')
+        self.assertEqual(response.json()['location'], 'Stub Location (55.872, -4.289)')
+
+    def test_comment_location(self):
+        post = Post.objects.create(user=self.user, circle=self.circle, content='p')
+        self.client.post(reverse('add_comment', args=[post.id]),
+                         {'content': 'c', 'use_location': 'on', 'lat': '1', 'lon': '2'})
+        self.assertEqual(Comment.objects.get(post=post).location, 'Stub Location (1.000, 2.000)')
+
+    def test_cache_evicts_least_recently_used(self):
+        from forum.geocoding import GeoCache
+        cache = GeoCache(precision=2, max_entries=2)
+        cache.set(1, 1, 'a')
+        cache.set(2, 2, 'b')
+        cache.get(1.001, 1.001)
+        cache.set(3, 3, 'c')
+        self.assertEqual(cache.get(1, 1), 'a')
+        self.assertIsNone(cache.get(2, 2))
+
+    def test_deferred_mode_saves_coordinates_first(self):
+        from forum.geocoding import Geocoder, GeoCache, StubBackend
+        geocoder = Geocoder(StubBackend(), GeoCache(), deferred=True)
+        self.assertEqual(geocoder.location_for(10.5, 20.25), ('Lat: 10.5, Lon: 20.25', True))
+        self.assertEqual(geocoder.backend.calls, 0)
+
+
+# ===========================
+# Weather Provider Test
+class WeatherProviderTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def slow_fetch(self, lat, lon):
+        import time
+        self.calls += 1
+        time.sleep(0.2)
+        return {'name': 'Glasgow', 'temp': self.calls}
+
+    def test_concurrent_misses_share_one_call(self):
+        import threading
+        from forum.weather import WeatherProvider
+        provider = WeatherProvider(fetch=self.slow_fetch)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(provider.get(55.861, -4.251)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(results), 5)
+
+    def test_stale_reading_served_while_revalidating(self):
+        from forum.weather import WeatherProvider
+        provider = WeatherProvider(fetch=self.slow_fetch, fresh_ttl=0)
+        self.assertEqual(provider.get(55.86, -4.25)['temp'], 1)
+        # nearby and stale: answered from cache at once, refresh runs behind
+        self.assertEqual(provider.get(55.8612, -4.2504)['temp'], 1)
+        provider.executor.shutdown(wait=True)
+        self.assertEqual(self.calls, 2)
+        provider.fresh_ttl = 600
+        self.assertEqual(provider.get(55.86, -4.25)['temp'], 2)
+
+    def test_unexpected_response_fails_every_waiter(self):
+        import threading
+        import time
+        from forum.weather import WeatherProvider, WeatherUnavailable, parse_weather
+
+        def broken_fetch(lat, lon):
+            time.sleep(0.1)
+            return parse_weather([])  # a list where the API sends an object
+
+        provider = WeatherProvider(fetch=broken_fetch)
+        errors = []
+
+        def get():
+            try:
+                provider.get(55.861, -4.251)
+            except WeatherUnavailable as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        with self.assertLogs('forum.weather', 'ERROR'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=5)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(len(errors), 3)
+
+    @override_settings(SERVER_MODE='asgi')
+    def test_async_misses_share_one_call(self):
+        import asyncio
+        from forum.weather import WeatherProvider, WeatherUnavailable
+
+        async def slow_afetch(lat, lon):
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            if lat > 80:
+                raise ValueError('no station')
+            return {'name': 'Glasgow', 'temp': self.calls}
+
+        provider = WeatherProvider(afetch=slow_afetch)
+
+        async def main():
+            results = await asyncio.gather(*(provider.aget(55.861, -4.251) for _ in range(5)))
+            with self.assertRaises(WeatherUnavailable):
+                await provider.aget(85, 0)
+            return results
+
+        results = asyncio.run(main())
+        self.assertEqual(self.calls, 2)
+        self.assertEqual([r['temp'] for r in results], [1] * 5)
+        # cached for the sync path too
+        self.assertEqual(provider.get(55.861, -4.251)['temp'], 1)
+
+    def test_async_view_under_wsgi_shares_one_call(self):
+        import threading
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from django.test import RequestFactory
+        from forum import views
+        from forum.weather import WeatherProvider
+        async def afetch(lat, lon):
+            return self.slow_fetch(lat, lon)
+
+        provider = WeatherProvider(fetch=self.slow_fetch, afetch=afetch)
+        request = RequestFactory().get(reverse('get_weather'), {'lat': 55.861, 'lon': -4.251})
+        statuses = []
+
+        # what the WSGI handler does: each request on its own thread and event loop
+        def one():
+            statuses.append(async_to_sync(views.get_weather)(request).status_code)
+
+        with mock.patch('forum.views.get_weather_provider', return_value=provider):
+            threads = [threading.Thread(target=one) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(statuses, [200] * 4)
+        self.assertEqual(self.calls, 1)
+
+
+@override_settings(GEOCODER={'BACKEND': 'forum.geocoding.StubBackend', 'OPTIONS': {'delay': 0.2},
+                             'DEFERRED': False})
+class AsyncViewTest(TestCase):
+
+    def setUp(self):
+        reset_geocoder('GEOCODER')
+
+    @override_settings(SERVER_MODE='asgi')
+    async def test_geocode_requests_overlap(self):
+        import asyncio
+        import time
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            self.async_client.get(reverse('geocode'), {'lat': 55.8 + i / 100, 'lon': -4.2}) for i in range(5)
+        ))
+        # five 0.2s upstream calls waited on together, not one after another
+        self.assertLess(time.perf_counter() - started, 0.8)
+        self.assertEqual([r.json()['status'] for r in responses], ['success'] * 5)
+        self.assertEqual(responses[0].json()['location'], 'Stub Location (55.800, -4.200)')
+
+    def test_async_views_still_work_under_wsgi(self):
+        response = self.client.get(reverse('geocode'), {'lat': 55.86, 'lon': -4.25})
+        self.assertEqual(response.json()['location'], 'Stub Location (55.860, -4.250)')
+        self.assertEqual(self.client.get(reverse('get_weather')).status_code, 400)
+
+
+# ===========================
+# Query Budget Test
+class QueryBudgetMixin:
+    """
+    assertQueryBudget fails when the block runs more than ``budget`` queries
+    and lists them, so an N+1 shows up as a failing test instead of in production.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        if len(context) > budget:
+            queries = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, 1))
+            self.fail(f"{len(context)} queries executed, budget is {budget}:\n{queries}")
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    # session + user lookups for the logged in client are included
+    BUDGETS = {
+        'home': 7,  # cold snapshot cache
+        'circle_detail': 5,
+        'post_detail': 4,
+        'all_circles': 3,
+        'search': 6,
+        'profile': 4,
+        'admin_dashboard': 7,  # + circles being deleted, stalled jobs
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.admin_user = User.objects.create_user(
+            username='budgetadmin',
+            email='budget@example.com',
+            password='budgetpass',
+            is_admin=True
+        )
+        self.circle = TopicCircle.objects.create(name='Budget Circle', created_by=self.admin_user)
+        self.post = Post.objects.create(user=self.admin_user, circle=self.circle, content='budget post')
+        self.client.login(username='budgetadmin', password='budgetpass')
+
+    def add_rows(self, n):
+        for i in range(n):
+            author = User.objects.create_user(username=f'author{self.circle.id}_{i}_{Post.objects.count()}',
+                                              email=f'a{i}_{Post.objects.count()}@example.com', password='x')
+            circle = TopicCircle.objects.create(name=f'Circle {TopicCircle.objects.count()}', created_by=author)
+            UserCircleFollow.objects.create(user=self.admin_user, circle=circle)
+            post = Post.objects.create(user=author, circle=self.circle, content=f'budget post {i}', is_recommended=True)
+            Post.objects.create(user=self.admin_user, circle=circle, content=f'budget own {i}')
+            Comment.objects.create(user=author, post=self.post, content=f'budget comment {i}')
+            Report.objects.create(user=author, post=post, reason='spam')
+            Announcement.objects.create(title=f'Notice {i}', content='x', created_by=author)
+
+    def get_pages(self):
+        return {
+            'home': reverse('home'),
+            'circle_detail': reverse('circle_detail', args=[self.circle.id]),
+            'post_detail': reverse('post_detail', args=[self.post.id]),
+            'all_circles': reverse('all_circles'),
+            'search': reverse('search') + '?q=budget',
+            'profile': reverse('profile'),
+            'admin_dashboard': reverse('admin_dashboard'),
+        }
+
+    def test_list_views_stay_within_budget_as_rows_grow(self):
+        for rows in (2, 10):
+            self.add_rows(rows)
+            for name, url in self.get_pages().items():
+                cache.clear()
+                with self.subTest(view=name, rows=rows), self.assertQueryBudget(self.BUDGETS[name]):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+
+# ===========================
+# Denormalized Count Test
+class DenormalizedCountTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='countuser',
+            email='count@example.com',
+            password='countpass'
+        )
+        self.circle = TopicCircle.objects.create(name='Count Circle', created_by=self.user)
+
+    def test_counts_follow_create_and_delete(self):
+        post = Post.objects.create(user=self.user, circle=self.circle, content='p1')
+        Post.objects.create(user=self.user, circle=self.circle, content='p2')
+        Comment.objects.create(user=self.user, post=post, content='c1')
+        comment = Comment.objects.create(user=self.user, post=post, content='c2')
+        comment.delete()
+        self.circle.refresh_from_db()
+        post.refresh_from_db()
+        self.assertEqual((self.circle.post_count, post.comment_count), (2, 1))
+        post.delete()
+        self.circle.refresh_from_db()
+        self.assertEqual(self.circle.post_count, 1)
+
+    def test_reconcile_counts_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        post = Post.objects.create(user=self.user, circle=self.circle, content='p')
+        Post.objects.filter(pk=post.pk).update(comment_count=7)
+        TopicCircle.objects.filter(pk=self.circle.pk).update(post_count=0)
+        out = StringIO()
+        call_command('reconcile_counts', stdout=out)
+        post.refresh_from_db()
+        self.circle.refresh_from_db()
+        self.assertEqual((self.circle.post_count, post.comment_count), (1, 0))
+        self.assertIn('TopicCircle.post_count: 1 rows out of sync', out.getvalue())
+
+
+# ===========================
+# Statistics Rollup Test
+class StatsRollupTest(TestCase):
+
+    def setUp(self):
+        import datetime
+        self.admin_user = User.objects.create_user(
+            username='statsadmin',
+            email='stats@example.com',
+            password='statspass',
+            is_admin=True
+        )
+        self.circle = TopicCircle.objects.create(name='Stats Circle', created_by=self.admin_user)
+        base = datetime.datetime(2025, 3, 10, 22, 30, tzinfo=datetime.timezone.utc)
+        for hours in (0, 1, 2, 30, 50):
+            post = Post.objects.create(user=self.admin_user, circle=self.circle, content='s')
+            # auto_now_add can't be overridden on create, so rewrite and re-bucket
+            Post.objects.filter(pk=post.pk).update(created_at=base + datetime.timedelta(hours=hours))
+            Comment.objects.create(user=self.admin_user, post=post, content='c')
+        from forum.stats import rebuild
+        rebuild()
+        self.client.login(username='statsadmin', password='statspass')
+
+    def test_totals_match_raw_counts(self):
+        import datetime
+        from forum.stats import totals
+        utc = datetime.timezone.utc
+        ranges = [
+            (datetime.datetime(2025, 3, 10, tzinfo=utc), datetime.datetime(2025, 3, 13, tzinfo=utc)),
+            (datetime.datetime(2025, 3, 10, 23, 15, tzinfo=utc), datetime.datetime(2025, 3, 12, 0, 45, tzinfo=utc)),
+            (datetime.datetime(2025, 3, 11, 0, 0, tzinfo=utc), datetime.datetime(2025, 3, 11, 0, 40, tzinfo=utc)),
+        ]
+        for start, end in ranges:
+            expected = Post.objects.filter(created_at__gte=start, created_at__lt=end).count()
+            self.assertEqual(totals(['posts'], start, end)['posts'], expected, (start, end))
+
+    def test_dashboard_reports_several_metrics(self):
+        response = self.client.get(reverse('admin_dashboard'), {
+            'start_date': '2025-03-10', 'end_date': '2025-03-11', 'stat_type': ['posts', 'users']
+        })
+        self.assertEqual(response.context['stats'], [('Num of Posts', 3), ('Num of Users', 0)])
+
+    def test_series_endpoint(self):
+        response = self.client.get(reverse('stats_series'), {
+            'start_date': '2025-03-10', 'end_date': '2025-03-13', 'stat_type': 'posts', 'granularity': 'day'
+        })
+        counts = [point['count'] for point in response.json()['series']['posts']]
+        self.assertEqual(counts, [2, 1, 1, 1])
+
+    def test_new_rows_update_buckets(self):
+        from django.utils import timezone
+        from forum.stats import totals
+        now = timezone.now()
+        before = totals(['comments'], now - timezone.timedelta(days=1), now + timezone.timedelta(days=1))
+        Comment.objects.create(user=self.admin_user, post=Post.objects.first(), content='new')
+        after = totals(['comments'], now - timezone.timedelta(days=1), now + timezone.timedelta(days=1))
+        self.assertEqual(after['comments'], before['comments'] + 1)
+
+
+# ===========================
+# Index Usage Test
+class IndexUsageTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([
+            User(username=f'indexuser{i}', email=f'index{i}@example.com') for i in range(20)
+        ])
+        circles = TopicCircle.objects.bulk_create([
+            TopicCircle(name=f'Index Circle {i}', is_active=i % 5 != 0, post_count=i) for i in range(20)
+        ])
+        posts = Post.objects.bulk_create([
+            Post(user=users[i % 20], circle=circles[i % 20], content='x', likes=i % 50,
+                 is_pinned=i % 97 == 0, is_recommended=i % 31 == 0) for i in range(2000)
+        ])
+        Comment.objects.bulk_create([
+            Comment(user=users[i % 20], post=posts[i % 200], content='c', likes=i % 9) for i in range(2000)
+        ])
+        Report.objects.bulk_create([
+            Report(user=users[i % 20], post=posts[i], reason='r', is_resolved=i % 10 != 0) for i in range(500)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # a seeded test table is small enough that a seq scan would still win
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_main_view_queries_use_indexes(self):
+        circle = TopicCircle.objects.get(name='Index Circle 3')
+        user = User.objects.get(username='indexuser3')
+        post = Post.objects.order_by('id').first()
+        queries = {
+            'post_circle_created_idx': Post.objects.filter(circle=circle).order_by('-is_pinned', '-created_at', '-id')[:21],
+            'post_circle_likes_idx': Post.objects.filter(circle=circle).order_by('-is_pinned', '-likes', '-id')[:21],
+            'post_circle_comments_idx': Post.objects.filter(circle=circle).order_by('-is_pinned', '-comment_count', '-id')[:21],
+            'post_user_created_idx': Post.objects.filter(user=user).order_by('-created_at'),
+            'post_recommended_idx': Post.objects.filter(is_recommended=True).order_by('-created_at')[:5],
+            'post_trending_idx': Post.objects.order_by('-trending_score', '-id')[:5],
+            'post_circle_trending_idx': Post.objects.filter(circle=circle).order_by('-trending_score', '-id')[:5],
+            'comment_post_created_idx': Comment.objects.filter(post=post).order_by('-created_at'),
+            'comment_post_likes_idx': Comment.objects.filter(post=post).order_by('-likes'),
+            'report_open_idx': Report.objects.filter(is_resolved=False).order_by('-created_at'),
+            'circle_active_posts_idx': TopicCircle.objects.filter(is_active=True).order_by('-post_count')[:5],
+            'circle_active_name_idx': TopicCircle.objects.filter(is_active=True).order_by('name')[:10],
+        }
+        for index, queryset in queries.items():
+            with self.subTest(index=index):
+                self.assertIn(index, self.explain(queryset))
+
+
+
+class BenchmarkTest(TestCase):
+
+    def test_seed_and_benchmark(self):
+        totals = seed_forum(users=5, circles=3, posts=30, reports=4)
+        self.assertEqual(totals['posts'], 30)
+        self.assertEqual(totals['reports'], 4)
+        self.assertEqual(sum(TopicCircle.objects.values_list('post_count', flat=True)), 30)
+        # seeding again with the same sizes adds nothing
+        self.assertEqual(seed_forum(users=5, circles=3, posts=30, reports=4), totals)
+
+        results = run_benchmarks(iterations=3, warmup=1, only=['home', 'circle_detail', 'like_post'])
+        self.assertEqual(set(results), {'home', 'circle_detail', 'like_post'})
+        self.assertEqual(results['home']['n'], 3)
+        self.assertLessEqual(results['home']['p50_ms'], results['home']['max_ms'])
+
+    def test_compare_flags_regressions(self):
+        def run(p50, queries):
+            return {'runs': {'1000': {'results': {'home': {'p50_ms': p50, 'p99_ms': p50, 'queries': queries}}}}}
+        rows = compare(run(10, 3), run(11, 4), threshold=0.2)
+        regressed = {metric for _, _, metric, _, _, flag in rows if flag}
+        self.assertEqual(regressed, {'queries'})
+
+
+class ProfilingTest(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.user = User.objects.create_user(username='admin', email='admin@example.com', password='pass',
+                                             is_admin=True)
+        self.circle = TopicCircle.objects.create(name='Circle')
+        for i in range(3):
+            Post.objects.create(user=self.user, circle=self.circle, content=f'post {i}')
+
+    def profiling(self, **options):
+        return override_settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 1.0, 'PROFILE_DIR': self.profile_dir,
+                                            'METRICS_TOKEN': 'secret', **options})
+
+    def test_records_request_metrics(self):
+        with self.profiling(SLOW_PROFILES=1):
+            client = Client()
+            client.get(reverse('home'))
+            client.get(reverse('all_circles'))
+        self.assertEqual(metrics.value('forum_requests_total', view='home', method='GET', status=200), 1)
+        self.assertGreater(metrics.value('forum_db_queries_total', view='home'), 0)
+        self.assertGreater(metrics.value('forum_template_duration_seconds_total', view='home'), 0)
+        # only the slowest request's dump is kept
+        self.assertEqual(len(os.listdir(self.profile_dir)), 1)
+
+    def test_disabled_by_default(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(metrics.value('forum_requests_total', view='home', method='GET', status=200), 0)
+
+    def test_fingerprint_groups_n_plus_one(self):
+        self.assertEqual(fingerprint('SELECT * FROM "forum_post" WHERE "id" = 12'),
+                         fingerprint('SELECT * FROM "forum_post" WHERE "id" = 7'))
+        self.assertEqual(fingerprint("SELECT 1 WHERE x IN (%s, %s, %s) AND y = 'a'"), "SELECT ? WHERE x IN (...) AND y = ?")
+
+    def test_external_calls_are_timed(self):
+        with self.assertRaises(ValueError):
+            with external_call('nominatim'):
+                raise ValueError
+        self.assertEqual(metrics.value('forum_external_http_requests_total', service='nominatim', outcome='error'), 1)
+
+    def test_metrics_endpoint(self):
+        with self.profiling():
+            client = Client()
+            client.get(reverse('home'))
+            self.assertEqual(client.get(reverse('metrics')).status_code, 404)
+            response = client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            body = response.content.decode()
+            self.assertIn('# TYPE forum_request_duration_seconds histogram', body)
+            self.assertIn('forum_requests_total{method="GET",status="200",view="home"} 1', body)
+            client.force_login(self.user)
+            self.assertEqual(client.get(reverse('metrics')).status_code, 200)
+
+
+@override_settings(FOLLOWED_FEED={'LIST_LENGTH': 6, 'TTL': 60})
+class FollowedFeedTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='feeduser', email='feed@example.com', password='feedpass')
+        self.circles = [TopicCircle.objects.create(name=f'Feed Circle {i}') for i in range(4)]
+        for circle in self.circles[:3]:
+            UserCircleFollow.objects.create(user=self.user, circle=circle)
+        # uneven activity and shared timestamps so ties and trimmed lists both matter
+        start = timezone.now()
+        for i in range(40):
+            post = Post.objects.create(user=self.user, circle=self.circles[i % 4 if i < 20 else 0], content=f'Post {i}')
+            Post.objects.filter(pk=post.pk).update(created_at=start - timezone.timedelta(minutes=i // 3))
+        self.client.login(username='feeduser', password='feedpass')
+
+    def expected(self):
+        return list(Post.objects.filter(circle__in=self.circles[:3]).order_by('-created_at', '-id')
+                    .values_list('id', flat=True))
+
+    def walk(self):
+        ids, cursor = [], ''
+        while True:
+            data = self.client.get(reverse('followed_feed'), {'cursor': cursor},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+            ids.extend(post['id'] for post in data['posts'])
+            if not data['has_next']:
+                return ids
+            cursor = data['next_cursor']
+
+    def test_walk_matches_database_order(self):
+        self.assertEqual(self.walk(), self.expected())
+        # and again from the cached lists
+        self.assertEqual(self.walk(), self.expected())
+
+    def test_new_post_invalidates_circle_list(self):
+        self.walk()
+        post = Post.objects.create(user=self.user, circle=self.circles[1], content='Fresh')
+        data = self.client.get(reverse('followed_feed'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(data['posts'][0]['id'], post.id)
+        post.delete()
+        data = self.client.get(reverse('followed_feed'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertNotIn(post.id, [item['id'] for item in data['posts']])
+
+    @override_settings(WEB_CONCURRENCY=2, FOLLOWED_FEED={'LIST_LENGTH': 100, 'TTL': 60})
+    def test_lists_not_cached_without_a_shared_cache(self):
+        self.walk()
+        # written by another worker: its invalidation never reaches this process's cache
+        post, = Post.objects.bulk_create([Post(user=self.user, circle=self.circles[1], content='Elsewhere')])
+        data = self.client.get(reverse('followed_feed'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(data['posts'][0]['id'], post.id)
+
+    def test_first_page_cost_does_not_grow_with_follows(self):
+        self.client.get(reverse('followed_feed'))
+        for i in range(30):
+            circle = TopicCircle.objects.create(name=f'Extra {i}')
+            Post.objects.create(user=self.user, circle=circle, content='extra')
+            UserCircleFollow.objects.create(user=self.user, circle=circle)
+        with CaptureQueriesContext(connection) as cold:
+            self.assertEqual(self.client.get(reverse('followed_feed')).status_code, 200)
+        with CaptureQueriesContext(connection) as warm:
+            self.client.get(reverse('followed_feed'))
+        # session, user, follows, rebuild of missing lists, page of posts
+        self.assertLessEqual(len(cold), 5)
+        self.assertLessEqual(len(warm), 4)
+
+
+class TrendingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='trenduser', email='trend@example.com', password='trendpass')
+        self.voters = [User.objects.create_user(username=f'voter{i}', email=f'voter{i}@example.com', password='x')
+                       for i in range(5)]
+        self.circle = TopicCircle.objects.create(name='Trend Circle')
+        self.other = TopicCircle.objects.create(name='Other Circle')
+
+    def assertScoreMatchesCounters(self, post):
+        post.refresh_from_db()
+        self.assertAlmostEqual(post.trending_score,
+                               hot_score(post.likes, post.dislikes, post.comment_count, post.created_at), places=3)
+
+    def test_votes_and_comments_move_the_score(self):
+        from forum.counters import cast_vote, LIKE, DISLIKE
+        post = Post.objects.create(user=self.user, circle=self.circle, content='Score me')
+        self.assertScoreMatchesCounters(post)
+        for voter in self.voters[:4]:
+            cast_vote(voter, post, LIKE)
+        self.assertScoreMatchesCounters(post)
+        cast_vote(self.voters[0], post, DISLIKE)
+        cast_vote(self.voters[4], post, DISLIKE)
+        self.assertScoreMatchesCounters(post)
+        comment = Comment.objects.create(user=self.user, post=post, content='c')
+        self.assertScoreMatchesCounters(post)
+        comment.delete()
+        self.assertScoreMatchesCounters(post)
+
+    def test_recent_posts_outrank_old_popular_ones(self):
+        from io import StringIO
+        from django.core.management import call_command
+        old = Post.objects.create(user=self.user, circle=self.circle, content='Old', likes=50)
+        Post.objects.filter(pk=old.pk).update(created_at=timezone.now() - timezone.timedelta(days=3))
+        call_command('rebuild_trending', stdout=StringIO())
+        new = Post.objects.create(user=self.user, circle=self.circle, content='New', likes=2)
+        elsewhere = Post.objects.create(user=self.user, circle=self.other, content='Elsewhere')
+        self.assertEqual([p.id for p in top_posts(3)], [new.id, elsewhere.id, old.id])
+        self.assertEqual([p.id for p in top_posts(5, circle=self.circle)], [new.id, old.id])
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual([p.id for p in response.context['popular_posts']], [new.id, elsewhere.id, old.id])
+
+
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='fraguser', email='frag@example.com', password='fragpass')
+        self.circle = TopicCircle.objects.create(name='Fragment Circle')
+        self.post = Post.objects.create(user=self.user, circle=self.circle, content='Cached post')
+        self.comment = Comment.objects.create(user=self.user, post=self.post, content='Cached comment')
+        self.client.login(username='fraguser', password='fragpass')
+
+    def queried(self, url, table):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        return response, any(f'FROM "{table}"' in query['sql'] for query in captured)
+
+    def test_circle_posts_fragment(self):
+        url = reverse('circle_detail', args=[self.circle.id])
+        self.assertTrue(self.queried(url, 'forum_post')[1])
+        # unchanged: neither the listing query nor the render runs again
+        self.assertFalse(self.queried(url, 'forum_post')[1])
+
+        self.client.get(reverse('like_post', args=[self.post.id]))
+        response, listed = self.queried(url, 'forum_post')
+        self.assertTrue(listed)
+        self.assertContains(response, '👍 1')
+
+        Post.objects.create(user=self.user, circle=self.circle, content='Brand new post')
+        self.assertContains(self.client.get(url), 'Brand new post')
+
+    def test_post_comments_fragment(self):
+        url = reverse('post_detail', args=[self.post.id])
+        self.assertTrue(self.queried(url, 'forum_comment')[1])
+        self.assertFalse(self.queried(url, 'forum_comment')[1])
+
+        self.client.get(reverse('like_comment', args=[self.comment.id]))
+        self.assertContains(self.client.get(url), '👍 1')
+        self.comment.delete()
+        self.assertContains(self.client.get(url), 'No comments yet')
+
+    def test_home_fragments(self):
+        self.client.get(reverse('home'))
+        cache.delete('forum:home:snapshot')
+        # every fragment is cached, so the snapshot isn't even rebuilt
+        response, listed = self.queried(reverse('home'), 'forum_announcement')
+        self.assertFalse(listed)
+        self.assertIsNone(cache.get('forum:home:snapshot'))
+
+        Announcement.objects.create(title='Fresh notice', content='Hello', created_by=self.user)
+        self.assertContains(self.client.get(reverse('home')), 'Fresh notice')
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_off_without_a_shared_cache(self):
+        from forum.checks import check_shared_cache
+        url = reverse('circle_detail', args=[self.circle.id])
+        self.assertTrue(self.queried(url, 'forum_post')[1])
+        # another worker could have changed the posts without this one knowing
+        self.assertTrue(self.queried(url, 'forum_post')[1])
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['forum.W001'])
+
+    @override_settings(TASK_WORKERS=1)
+    def test_a_task_worker_needs_a_shared_cache_too(self):
+        from forum.checks import check_shared_cache
+        from forum.versions import stamps_shared
+        # its deletions and reports bump stamps in its own cache only
+        self.assertFalse(stamps_shared())
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['forum.W001'])
+        with override_settings(TASKS={'EAGER': True}):
+            self.assertTrue(stamps_shared())
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='etaguser', email='etag@example.com', password='etagpass')
+        self.circle = TopicCircle.objects.create(name='ETag Circle')
+        self.post = Post.objects.create(user=self.user, circle=self.circle, content='Polled post')
+        self.announcement = Announcement.objects.create(title='Notice', content='Read me', created_by=self.user)
+        self.client.login(username='etaguser', password='etagpass')
+
+    def revalidate(self, url, **headers):
+        etag = self.client.get(url, **headers)['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag, **headers)
+
+    def test_unchanged_pages_return_304_without_queries(self):
+        for url in (reverse('circle_detail', args=[self.circle.id]), reverse('post_detail', args=[self.post.id]),
+                    reverse('all_circles'), reverse('announcement_detail', args=[self.announcement.id])):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                # session and user come from the cache too
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_changes_invalidate(self):
+        url = reverse('circle_detail', args=[self.circle.id])
+        etag = self.client.get(url)['ETag']
+        Post.objects.create(user=self.user, circle=self.circle, content='Another')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # following changes the button, so the viewer's own state counts too
+        etag = self.client.get(url)['ETag']
+        UserCircleFollow.objects.create(user=self.user, circle=self.circle)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = reverse('post_detail', args=[self.post.id])
+        etag = self.client.get(url)['ETag']
+        self.client.get(reverse('like_post', args=[self.post.id]))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = reverse('announcement_detail', args=[self.announcement.id])
+        etag = self.client.get(url)['ETag']
+        self.announcement.content = 'Edited'
+        self.announcement.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_no_validators_without_a_shared_cache(self):
+        response = self.client.get(reverse('post_detail', args=[self.post.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_json_and_html_have_different_etags(self):
+        url = reverse('all_circles')
+        html = self.client.get(url)
+        xhr = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertNotEqual(html['ETag'], xhr['ETag'])
+        self.assertIn('X-Requested-With', xhr['Vary'])
+        self.assertEqual(self.revalidate(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code, 304)
+
+    def test_other_users_and_flash_messages_get_full_pages(self):
+        url = reverse('post_detail', args=[self.post.id])
+        etag = self.client.get(url)['ETag']
+        User.objects.create_user(username='other', email='other@example.com', password='otherpass')
+        other = Client()
+        other.login(username='other', password='otherpass')
+        self.assertEqual(other.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # reporting leaves a success message to show on the next page
+        self.client.post(reverse('report_post', args=[self.post.id]), {'reason': 'spam'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+class TransferTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.user = User.objects.create_user(username='exporter', email='exporter@example.com', password='pass',
+                                             anonymous_nicknames=['Exp, "quoted"'])
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='pass')
+        self.circle = TopicCircle.objects.create(name='Export Circle', created_by=self.user)
+        self.post = Post.objects.create(user=self.user, circle=self.circle, content='Line one\nline two, with comma',
+                                        location='Glasgow')
+        Post.objects.create(user=self.other, circle=self.circle, content='Second')
+        Comment.objects.create(user=self.other, post=self.post, content='Reply')
+        Report.objects.create(user=self.other, post=self.post, reason='Spam')
+        Announcement.objects.create(title='Notice', content='Hello', created_by=self.user)
+        UserCircleFollow.objects.create(user=self.other, circle=self.circle)
+        self.old = timezone.now() - timezone.timedelta(days=30)
+        Post.objects.filter(pk=self.post.pk).update(created_at=self.old)
+
+    def clear(self):
+        Announcement.objects.all().delete()
+        TopicCircle.objects.all().delete()
+        User.objects.all().delete()
+
+    def test_round_trip_keeps_ids(self):
+        for fmt in ('jsonl', 'csv'):
+            with self.subTest(fmt=fmt):
+                directory = os.path.join(self.directory, fmt)
+                totals = export_forum(directory, fmt)
+                self.assertEqual(totals['Post'], 2)
+                ids = sorted(Post.objects.values_list('id', flat=True))
+                self.clear()
+                totals, skipped = import_forum(directory)
+                self.assertEqual(skipped, {})
+                self.assertEqual(totals['Comment'], 1)
+                self.assertEqual(sorted(Post.objects.values_list('id', flat=True)), ids)
+                post = Post.objects.get(pk=self.post.pk)
+                self.assertEqual(post.content, 'Line one\nline two, with comma')
+                self.assertEqual(post.created_at, self.old)
+                self.assertEqual(post.user.anonymous_nicknames, ['Exp, "quoted"'])
+                self.assertIsNone(post.nickname)
+                self.assertEqual(post.comment_count, 1)
+                self.assertEqual(TopicCircle.objects.get().post_count, 2)
+                self.assertTrue(User.objects.get(username='exporter').check_password('pass'))
+                self.assertEqual(Report.objects.get().post_id, post.pk)
+        # new rows don't collide with imported ids
+        self.assertGreater(Post.objects.create(user=post.user, circle=post.circle, content='New').pk, max(ids))
+
+    def test_remap_merges_into_existing_data(self):
+        export_forum(self.directory)
+        Post.objects.all().delete()
+        Report.objects.all().delete()
+        UserCircleFollow.objects.all().delete()
+        Announcement.objects.all().delete()
+        newcomer = User.objects.create_user(username='newcomer', email='new@example.com', password='pass')
+        Post.objects.create(user=newcomer, circle=self.circle, content='Already here')
+
+        # one row per batch, so every id has to come back out of the id map table
+        totals, skipped = import_forum(self.directory, remap=True, batch_size=1)
+        # users and the circle are matched by name instead of duplicated
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(TopicCircle.objects.count(), 1)
+        self.assertEqual(Post.objects.count(), 3)
+        imported = Post.objects.get(content__startswith='Line one')
+        self.assertEqual(imported.user, self.user)
+        self.assertEqual(imported.created_at, self.old)
+        self.assertEqual(Comment.objects.get().post, imported)
+        self.assertEqual(Report.objects.get().post, imported)
+        self.assertEqual(TopicCircle.objects.get().post_count, 3)
+        self.assertEqual(UserCircleFollow.objects.get().user, self.other)
+
+    def test_csv_keeps_text_that_looks_like_null(self):
+        Post.objects.filter(pk=self.post.pk).update(content='\\N', location='\\\\share')
+        export_forum(self.directory, 'csv')
+        self.clear()
+        import_forum(self.directory)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.content, '\\N')
+        self.assertEqual(post.location, '\\\\share')
+        self.assertIsNone(post.nickname)
+
+    def test_commands(self):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('export_forum', self.directory, '--format', 'csv', '--models', 'GUser', 'TopicCircle',
+                     stdout=out, stderr=StringIO())
+        self.assertEqual(sorted(os.listdir(self.directory)), ['forum.guser.csv', 'forum.topiccircle.csv'])
+        self.clear()
+        call_command('import_forum', self.directory, stdout=out, stderr=StringIO())
+        self.assertEqual(TopicCircle.objects.get().created_by.username, 'exporter')
+
+
+TASK_CALLS = []
+
+
+@task('tests.record')
+def record_task(label):
+    TASK_CALLS.append(label)
+
+
+@task('tests.flaky', max_attempts=3)
+def flaky_task():
+    TASK_CALLS.append('attempt')
+    raise RuntimeError('boom')
+
+
+class TaskQueueTest(TestCase):
+
+    def setUp(self):
+        TASK_CALLS.clear()
+        self.worker = Worker()
+        self.admin = User.objects.create_user(username='taskadmin', email='taskadmin@example.com', password='pass',
+                                              is_admin=True)
+        self.circle = TopicCircle.objects.create(name='Task Circle', created_by=self.admin)
+
+    def test_higher_priority_runs_first(self):
+        enqueue('tests.record', priority=-1, label='low')
+        enqueue('tests.record', label='default')
+        enqueue('tests.record', priority=5, label='high')
+        self.assertEqual(self.worker.run_pending(), 3)
+        self.assertEqual(TASK_CALLS, ['high', 'default', 'low'])
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {Job.DONE})
+
+    def test_idempotency_key(self):
+        first = enqueue('tests.record', key='only-once', label='a')
+        self.assertEqual(enqueue('tests.record', key='only-once', label='a').pk, first.pk)
+        self.worker.run_pending()
+        enqueue('tests.record', key='only-once', label='a')
+        self.assertEqual(self.worker.run_pending(), 0)
+        self.assertEqual(TASK_CALLS, ['a'])
+
+    def test_failures_back_off_then_give_up(self):
+        job = enqueue('tests.flaky')
+        for attempt in (1, 2):
+            with self.assertLogs('forum.tasks', 'WARNING'):
+                self.worker.run_pending()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, attempt))
+            self.assertIn('boom', job.last_error)
+            self.assertGreater(job.run_at, timezone.now())
+            # not ready until the backoff has passed
+            self.assertEqual(self.worker.run_pending(), 0)
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('forum.tasks', 'ERROR'):
+            self.worker.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertEqual(len(TASK_CALLS), 3)
+
+    def test_lost_jobs_are_requeued(self):
+        job = enqueue('tests.record', label='lost')
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=1,
+                                             locked_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(self.worker.requeue_lost(), 1)
+        self.worker.run_pending()
+        self.assertEqual(TASK_CALLS, ['lost'])
+
+    @override_settings(TASKS={'EAGER': True})
+    def test_eager_mode_runs_inline(self):
+        self.assertIsNone(enqueue('tests.record', label='now'))
+        self.assertEqual(TASK_CALLS, ['now'])
+        self.assertFalse(Job.objects.exists())
+        with self.assertRaises(RuntimeError):
+            enqueue('tests.flaky')
+
+    def test_circle_delete_hides_then_deletes_in_background(self):
+        post = Post.objects.create(user=self.admin, circle=self.circle, content='Doomed')
+        Comment.objects.create(user=self.admin, post=post, content='Also doomed')
+        self.client.login(username='taskadmin', password='pass')
+        self.client.post(reverse('circle_delete', args=[self.circle.id]))
+        self.assertEqual(self.client.get(reverse('circle_detail', args=[self.circle.id])).status_code, 404)
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+        # while it's queued it can't be edited back to active, and the dashboard doesn't list it
+        response = self.client.post(reverse('circle_edit', args=[self.circle.id]),
+                                    {'name': 'Task Circle', 'description': '', 'is_active': 'true'})
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn(self.circle, self.client.get(reverse('admin_dashboard')).context['circles'])
+        self.worker.run_pending()
+        self.assertFalse(TopicCircle.objects.filter(pk=self.circle.pk).exists())
+        self.assertFalse(Comment.objects.exists())
+
+    @override_settings(GEOCODER={'BACKEND': 'forum.geocoding.StubBackend', 'DEFERRED': True})
+    def test_reports_and_geocoding_are_queued(self):
+        reset_geocoder(setting='GEOCODER')
+        self.client.login(username='taskadmin', password='pass')
+        self.client.post(reverse('create_post', args=[self.circle.id]),
+                         {'content': 'Located', 'use_location': 'on', 'lat': '55.8721', 'lon': '-4.2888'})
+        post = Post.objects.get(content='Located')
+        self.assertEqual(post.location, 'Lat: 55.8721, Lon: -4.2888')
+        for _ in range(2):
+            self.client.post(reverse('report_post', args=[post.id]), {'reason': 'spam'})
+        self.assertFalse(Report.objects.exists())
+        self.assertEqual(self.worker.run_pending(), 2)
+        post.refresh_from_db()
+        self.assertEqual(post.location, 'Stub Location (55.872, -4.289)')
+        self.assertEqual(Report.objects.get().reason, 'spam')
+
+        # the same report made again later isn't taken for a double submit
+        from unittest import mock
+        later = timezone.now() + timezone.timedelta(hours=1)
+        with mock.patch('forum.views.timezone.now', return_value=later):
+            self.client.post(reverse('report_post', args=[post.id]), {'reason': 'spam'})
+            self.worker.run_pending()
+        self.assertEqual(Report.objects.count(), 2)
+
+    def test_dashboard_warns_when_no_worker_runs_the_queue(self):
+        self.client.login(username='taskadmin', password='pass')
+        job = enqueue('tests.record', label='waiting')
+        self.assertEqual(self.client.get(reverse('admin_dashboard')).context['stalled_jobs'], 0)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertContains(self.client.get(reverse('admin_dashboard')), 'Is <code>manage.py run_worker</code>')
+        self.worker.run_pending()
+        self.assertEqual(self.client.get(reverse('admin_dashboard')).context['stalled_jobs'], 0)
+
+
+@override_settings(READ_REPLICAS={'DATABASES': ['replica1'], 'PIN_SECONDS': 5, 'RETRY_AFTER': 30})
+class ReadReplicaTest(TransactionTestCase):
+    # the replica is a second connection to the test database (TEST MIRROR), which
+    # only sees committed rows, so these tests can't run inside a TestCase transaction
+    databases = {'default', 'replica1'}
+
+    def setUp(self):
+        routers._down.clear()
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', password='pass')
+        self.circle = TopicCircle.objects.create(name='Replica Circle', created_by=self.user)
+        Post.objects.create(user=self.user, circle=self.circle, content='Replicated')
+        self.client.login(username='reader', password='pass')
+        self.client.cookies.pop('forum_primary', None)
+        self.settle('announcements', 'circles', 'posts', f'circle:{self.circle.id}', f'user:{self.user.pk}')
+
+    def settle(self, *scopes):
+        # as if the replicas had caught up with these changes long ago
+        import time
+        from forum.versions import version_key
+        cache.set_many({version_key(scope): time.time() - 60 for scope in scopes}, None)
+
+    def replica_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connections['replica1']) as replica:
+            response = getattr(self.client, method)(url, data or {})
+        return response, len(replica)
+
+    def test_listing_pages_read_from_the_replica(self):
+        for url in (reverse('all_circles'), reverse('circle_detail', args=[self.circle.id]), reverse('profile')):
+            with self.subTest(url=url):
+                response, queries = self.replica_queries('get', url)
+                self.assertEqual(response.status_code, 200)
+                self.assertGreater(queries, 0)
+                self.assertNotIn('forum_primary', response.cookies)
+
+    def test_writers_are_pinned_to_the_primary(self):
+        url = reverse('create_post', args=[self.circle.id])
+        response, queries = self.replica_queries('post', url, {'content': 'Fresh'})
+        self.assertEqual(queries, 0)
+        self.assertEqual(response.cookies['forum_primary']['max-age'], 5)
+        response, queries = self.replica_queries('get', reverse('circle_detail', args=[self.circle.id]))
+        self.assertEqual(queries, 0)
+        self.assertContains(response, 'Fresh')
+
+    def test_recent_changes_are_read_from_the_primary(self):
+        from forum.versions import bump, get_versions
+        token = routers.read_alias.set('replica1')
+        try:
+            get_versions('circles')
+            self.assertEqual(routers.read_alias.get(), 'replica1')
+            bump('circles')
+            get_versions('circles')
+            self.assertIsNone(routers.read_alias.get())
+        finally:
+            routers.read_alias.reset(token)
+
+        # and the page gets no validators that would keep a replica's render under the new stamp
+        url = reverse('all_circles')
+        self.assertFalse(self.client.get(url).has_header('ETag'))
+        self.settle('circles')
+        self.assertTrue(self.client.get(url).has_header('ETag'))
+
+    def test_cached_lists_are_built_from_the_primary(self):
+        from forum.feed import get_home_snapshot
+        from forum.timeline import recent_lists
+        cache.clear()
+        token = routers.read_alias.set('replica1')
+        try:
+            with CaptureQueriesContext(connections['replica1']) as replica:
+                get_home_snapshot()
+                recent_lists([self.circle.id])
+        finally:
+            routers.read_alias.reset(token)
+        self.assertEqual(len(replica), 0)
+
+    def test_search_reads_from_the_replica_without_pinning(self):
+        response, queries = self.replica_queries('get', reverse('search'), {'q': 'Replicated'})
+        self.assertGreater(queries, 0)
+        self.assertNotIn('forum_primary', response.cookies)
+
+    def test_unavailable_replica_falls_back_to_the_primary(self):
+        from unittest import mock
+        from django.db import OperationalError
+        with CaptureQueriesContext(connections['replica1']) as replica, \
+                mock.patch.object(connections['replica1'], 'ensure_connection',
+                                  side_effect=OperationalError('replica down')) as connect:
+            with self.assertLogs('forum.routers', 'WARNING'):
+                response = self.client.get(reverse('all_circles'))
+            self.assertEqual(response.status_code, 200)
+            # not retried until RETRY_AFTER has passed
+            self.client.get(reverse('home'))
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(len(replica), 0)
+
+    def test_writes_and_migrations_stay_on_the_primary(self):
+        router = routers.ReplicaRouter()
+        token = routers.read_alias.set('replica1')
+        try:
+            self.assertEqual(router.db_for_read(Post), 'replica1')
+            self.assertEqual(router.db_for_write(Post), 'default')
+        finally:
+            routers.read_alias.reset(token)
+        self.assertIsNone(router.db_for_read(Post))
+        self.assertFalse(router.allow_migrate('replica1', 'forum'))
+
+
+class ConnectionTest(TestCase):
+    databases = {'default', 'replica1'}
+
+    def setUp(self):
+        import sqlite3
+        metrics.reset()
+        self.path = os.path.join(tempfile.mkdtemp(), 'pool.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+        self.opened = 0
+
+        def connect():
+            self.opened += 1
+            return sqlite3.connect(self.path, check_same_thread=False)
+        self.connect = connect
+
+    def test_pool_reuses_connections(self):
+        from forum.dbpool import ConnectionPool
+        pool = ConnectionPool(self.connect, max_size=2)
+        first, waited, reused = pool.acquire()
+        self.assertFalse(reused)
+        pool.release(first)
+        again, _, reused = pool.acquire()
+        self.assertIs(again, first)
+        self.assertTrue(reused)
+        pool.release(again)
+        self.assertEqual(self.opened, 1)
+
+    def test_pool_waits_then_times_out_when_exhausted(self):
+        from forum.dbpool import ConnectionPool, PoolTimeout
+        pool = ConnectionPool(self.connect, max_size=1, timeout=0.05)
+        conn, _, _ = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        pool.release(conn)
+        pool.release(pool.acquire()[0])
+
+    def test_pool_drops_broken_and_stale_connections(self):
+        from forum.dbpool import ConnectionPool
+        pool = ConnectionPool(self.connect, max_size=2, check_after=0, check=lambda conn: False,
+                              reset=lambda conn: conn is not None)
+        conn, _, _ = pool.acquire()
+        pool.release(conn)
+        # idle past check_after and fails the check, so a new one is opened
+        replacement, _, reused = pool.acquire()
+        self.assertFalse(reused)
+        self.assertIsNot(replacement, conn)
+        pool.release(replacement, discard=True)
+        self.assertEqual(len(pool), 0)
+
+    def test_postgres_pool_reset_discards_session_state(self):
+        from forum.backends.postgresql.base import reset
+        executed = []
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                pass
+
+            def execute(self, sql):
+                executed.append((sql, conn.autocommit))
+
+        class Conn:
+            closed = False
+            autocommit = False
+
+            def rollback(self):
+                executed.append(('ROLLBACK', self.autocommit))
+
+            def cursor(self):
+                return Cursor()
+
+        conn = Conn()
+        self.assertTrue(reset(conn))
+        # DISCARD ALL refuses to run inside a transaction
+        self.assertEqual(executed, [('ROLLBACK', False), ('DISCARD ALL', True)])
+        self.assertFalse(conn.autocommit)
+
+    def test_new_connections_are_counted(self):
+        replica = connections['replica1']
+        # a second wrapper, as a new thread would get; in-memory SQLite ignores close()
+        wrapper = type(replica)(replica.settings_dict, 'replica1')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        self.assertEqual(metrics.value('forum_db_connections_total', alias='replica1', outcome='new'), 1)
+        wrapper.ensure_connection()
+        self.assertEqual(metrics.value('forum_db_connections_total', alias='replica1', outcome='new'), 1)
+
+    def test_connection_benchmark(self):
+        results = run_connections('replica1', iterations=3, warmup=1)
+        self.assertEqual(results['new']['n'], 3)
+        self.assertIn('persistent', results)
+        self.assertNotIn('pooled', results)
+
+
+class AuthCacheTest(TestCase):
+
+    def setUp(self):
+        from forum.auth import user_cache
+        cache.clear()
+        user_cache.clear()
+        self.user = User.objects.create_user(username='cached', email='cached@example.com', password='pass',
+                                             is_admin=True)
+        self.client.login(username='cached', password='pass')
+
+    def test_warm_requests_skip_session_and_user_queries(self):
+        url = reverse('all_circles')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('forum_guser', tables)
+
+    def test_profile_changes_show_up_on_the_next_request(self):
+        self.client.get(reverse('profile'))
+        self.client.post(reverse('profile'), {'nickname': 'Shadow'})
+        self.assertEqual(self.client.get(reverse('profile')).context['nicknames'], ['Shadow'])
+
+    def test_revoked_admin_is_refused_at_once(self):
+        self.assertEqual(self.client.get(reverse('admin_dashboard')).status_code, 200)
+        self.user.is_admin = False
+        self.user.save()
+        self.assertRedirects(self.client.get(reverse('admin_dashboard')), reverse('home'),
+                             fetch_redirect_response=False)
+
+    def test_sessions_skip_a_per_process_cache(self):
+        from our_circle.settings import session_engine
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}
+        self.assertEqual(session_engine(locmem, 1), 'django.contrib.sessions.backends.cached_db')
+        self.assertEqual(session_engine(redis, 2), 'django.contrib.sessions.backends.cached_db')
+        # another worker would keep a logged-out session in its own cache
+        self.assertEqual(session_engine(locmem, 2), 'django.contrib.sessions.backends.db')
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_logout_ends_the_session_with_the_db_engine(self):
+        from django.conf import settings
+        self.client.login(username='cached', password='pass')
+        session_key = self.client.session.session_key
+        other_worker = Client()
+        other_worker.cookies[settings.SESSION_COOKIE_NAME] = session_key
+        self.assertEqual(other_worker.get(reverse('admin_dashboard')).status_code, 200)
+        self.client.post(reverse('logout'))
+        self.assertNotEqual(other_worker.get(reverse('admin_dashboard')).status_code, 200)
+
+    def test_callers_get_their_own_copy(self):
+        from forum.auth import CachedModelBackend
+        backend = CachedModelBackend()
+        first = backend.get_user(self.user.pk)
+        first.anonymous_nicknames.append('leak')
+        self.assertEqual(backend.get_user(self.user.pk).anonymous_nicknames, [])
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_off_without_a_shared_cache(self):
+        from forum.auth import CachedModelBackend
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        # another worker could have demoted them without this one seeing the bump
+        with self.assertNumQueries(1):
+            self.assertTrue(backend.get_user(self.user.pk).is_admin)
+
+
+class PageCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = User.objects.create_user(username='pageuser', email='page@example.com', password='pagepass')
+        self.announcement = Announcement.objects.create(title='Open day', content='All welcome', created_by=self.user)
+        self.other = Announcement.objects.create(title='Exams', content='Good luck', created_by=self.user)
+
+    def test_second_anonymous_visit_is_served_from_cache(self):
+        for url in (reverse('home'), reverse('announcement_detail', args=[self.announcement.id])):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                with self.assertNumQueries(0):
+                    second = self.client.get(url)
+                self.assertEqual(second.status_code, 200)
+                self.assertEqual(second.content, first.content)
+        self.assertEqual(metrics.value('forum_page_cache_total', view='home', outcome='hit'), 1)
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_off_without_a_shared_cache(self):
+        url = reverse('announcement_detail', args=[self.announcement.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(queries.captured_queries)
+
+    def test_query_params_are_part_of_the_key(self):
+        self.client.get(reverse('home'), {'sort': 'new', 'page': 2, 'utm_source': 'mail'})
+        with self.assertNumQueries(0):
+            # order and unrelated parameters don't matter
+            self.client.get(reverse('home'), {'utm_source': 'chat', 'page': 2, 'sort': 'new'})
+        response = self.client.get(reverse('home'), {'search': 'Open'})
+        self.assertEqual(metrics.value('forum_page_cache_total', view='home', outcome='miss'), 2)
+        self.assertIsNotNone(response.context)
+
+    def test_saving_an_announcement_purges_only_its_page(self):
+        url = reverse('announcement_detail', args=[self.announcement.id])
+        other_url = reverse('announcement_detail', args=[self.other.id])
+        self.client.get(url)
+        self.client.get(other_url)
+        self.announcement.content = 'Moved to Friday'
+        self.announcement.save()
+        self.assertContains(self.client.get(url), 'Moved to Friday')
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+
+    def test_logged_in_users_are_not_cached(self):
+        self.client.get(reverse('home'))
+        self.client.login(username='pageuser', password='pagepass')
+        response = self.client.get(reverse('home'))
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'csrf-token')
+        self.assertEqual(metrics.value('forum_page_cache_total', view='home', outcome='hit'), 0)
+
+    def test_anonymous_pages_set_no_cookies(self):
+        response = self.client.get(reverse('home'))
+        self.assertNotIn('csrftoken', response.cookies)
+        self.assertNotContains(response, 'csrf-token')
+
+    @override_settings(PAGE_CACHE={'WAIT': 0.2, 'POLL_INTERVAL': 0.01})
+    def test_concurrent_miss_waits_for_the_render_in_progress(self):
+        from unittest import mock
+        from forum.pagecache import page_key
+        url = reverse('announcement_detail', args=[self.announcement.id])
+        response = self.client.get(url)
+        key = page_key(response.wsgi_request, [f'announcement:{self.announcement.id}'])
+        cached = cache.get(key)
+        cache.delete(key)
+        cache.add(f'{key}:lock', 1)
+        # the lock holder finishes while we wait
+        with mock.patch('forum.pagecache.time.sleep', lambda seconds: cache.set(key, cached)):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).content, response.content)
+        self.assertEqual(metrics.value('forum_page_cache_total', view='announcement_detail', outcome='waited'), 1)
+
+        # a holder that never finishes only delays us by WAIT
+        cache.delete(key)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(metrics.value('forum_page_cache_total', view='announcement_detail', outcome='timeout'), 1)
+
+
+class RateLimitTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        ratelimit._backends.clear()
+        self.user = User.objects.create_user(username='spammer', email='spam@example.com', password='spampass')
+        self.circle = TopicCircle.objects.create(name='Limits')
+        self.post = Post.objects.create(user=self.user, circle=self.circle, content='Like me')
+        self.client.login(username='spammer', password='spampass')
+
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate('30/m'), (30, 60))
+        self.assertEqual(ratelimit.parse_rate('5/10s'), (5, 10))
+        for rate in ('0/m', '5/0s', 'lots', '5/w'):
+            with self.assertRaises(ValueError):
+                ratelimit.parse_rate(rate)
+
+    def test_user_over_the_limit_gets_429(self):
+        url = reverse('like_post', args=[self.post.id])
+        for backend in ('memory', 'cache'):
+            with self.subTest(backend=backend), override_settings(RATE_LIMITS={
+                'BACKEND': backend, 'LIMITS': {'vote': {'user': '2/m'}},
+            }):
+                cache.clear()
+                self.assertEqual(self.client.get(url).status_code, 302)
+                self.assertEqual(self.client.get(url).status_code, 302)
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 429)
+                self.assertGreaterEqual(int(response['Retry-After']), 1)
+                self.assertLessEqual(int(response['Retry-After']), 120)
+
+                User.objects.create_user(username=f'calm-{backend}', email=f'{backend}@example.com', password='pass')
+                other = Client()
+                other.login(username=f'calm-{backend}', password='pass')
+                self.assertEqual(other.get(url).status_code, 302)
+        self.assertEqual(metrics.value('forum_ratelimit_total', group='vote', scope='user', outcome='limited'), 2)
+        self.assertIn('forum_ratelimit_total{group="vote",outcome="limited",scope="user"} 2', metrics.render())
+
+    @override_settings(RATE_LIMITS={'PROXY_COUNT': 1, 'LIMITS': {'comment': {'ip': '1/m'}}})
+    def test_ip_limit_uses_the_trusted_forwarded_address(self):
+        url = reverse('add_comment', args=[self.post.id])
+        self.client.get(url)  # only submissions count
+        self.assertEqual(self.client.post(url, {'content': 'first'}, HTTP_X_FORWARDED_FOR='10.0.0.1').status_code,
+                         302)
+        # a spoofed first hop doesn't change which address the proxy saw
+        response = self.client.post(url, {'content': 'second'}, HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.1',
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('error', response.json())
+        self.assertEqual(self.client.post(url, {'content': 'third'}, HTTP_X_FORWARDED_FOR='10.0.0.2').status_code,
+                         302)
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 2)
+
+    def test_refused_requests_are_not_charged_to_other_limits(self):
+        url = reverse('like_post', args=[self.post.id])
+        for backend in ('memory', 'cache'):
+            with self.subTest(backend=backend), override_settings(RATE_LIMITS={
+                'BACKEND': backend, 'LIMITS': {'vote': {'user': '2/m', 'ip': '1/m'}},
+            }):
+                cache.clear()
+                self.assertEqual(self.client.get(url).status_code, 302)
+                for _ in range(3):
+                    self.assertEqual(self.client.get(url).status_code, 429)
+                # a fresh address: the user has only used one of their two
+                self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.9').status_code, 302)
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_per_process_cache_is_flagged(self):
+        from forum.checks import check_rate_limit_cache
+        self.assertEqual([warning.id for warning in check_rate_limit_cache(None)], ['forum.W002'])
+        with override_settings(RATE_LIMITS={'BACKEND': 'memory'}):
+            self.assertEqual(check_rate_limit_cache(None), [])
+
+    def test_sliding_window_counts_part_of_the_previous_period(self):
+        from unittest import mock
+        backend = ratelimit.CacheBackend()
+        with mock.patch('forum.ratelimit.time.time', return_value=6000.0):  # start of a period
+            for _ in range(10):
+                self.assertEqual(backend.hit('k', 10, 60), 0)
+            self.assertAlmostEqual(backend.hit('k', 10, 60), 60 + 60 * (1 - 9 / 10))
+        # halfway through the next period half of those ten still count
+        with mock.patch('forum.ratelimit.time.time', return_value=6090.0):
+            for _ in range(5):
+                self.assertEqual(backend.hit('k', 10, 60), 0)
+            self.assertAlmostEqual(backend.hit('k', 10, 60), 60 * (1 - 4 / 10) - 30)
+
+    def test_token_bucket_refills_evenly(self):
+        from unittest import mock
+        backend = ratelimit.MemoryBackend(max_entries=2)
+        with mock.patch('forum.ratelimit.time.monotonic', return_value=100.0):
+            for _ in range(3):
+                self.assertEqual(backend.hit('k', 3, 60), 0)
+            self.assertAlmostEqual(backend.hit('k', 3, 60), 20)
+        with mock.patch('forum.ratelimit.time.monotonic', return_value=120.0):
+            self.assertEqual(backend.hit('k', 3, 60), 0)
+            self.assertGreater(backend.hit('k', 3, 60), 0)
+            backend.hit('a', 3, 60)
+            backend.hit('b', 3, 60)
+        self.assertEqual(list(backend.buckets), ['a', 'b'])
+
+
 # ===========================
 # 3. Forms Test
 
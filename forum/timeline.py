@@ -0,0 +1,119 @@
+"""
+Followed-circles timeline.
+
+Every circle keeps a cached list of its newest ``LIST_LENGTH`` posts as
+``(created_at, id)`` pairs. A user's timeline is a k-way merge of the lists of
+the circles they follow: one ``get_many`` for the lists, one windowed query to
+rebuild any that are missing, and one ``in_bulk`` for the posts on the page,
+however many circles are followed. Only pages that reach past the end of a
+full cached list go to the posts table directly.
+
+forum/signals.py drops a circle's list whenever one of its posts is created or
+deleted. That only reaches other processes through a shared cache, so like
+the stamp-keyed caches the lists aren't cached at all unless
+``stamps_shared()`` (forum/versions.py); every page then rebuilds them in the
+one windowed query.
+"""
+import heapq
+from itertools import dropwhile, islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Post, UserCircleFollow
+from .pagination import KeysetPage, encode_cursor, decode_cursor, keyset_filter
+from .routers import primary_reads
+from .versions import stamps_shared
+
+ORDERING = ['-created_at', '-id']
+DEFAULTS = {
+    'LIST_LENGTH': 100,
+    'TTL': 60 * 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'FOLLOWED_FEED', {})}
+
+
+def circle_key(circle_id):
+    return f'forum:circle:{circle_id}:recent'
+
+
+def invalidate_circle(circle_id):
+    cache.delete(circle_key(circle_id))
+
+
+def followed_circle_ids(user):
+    return list(UserCircleFollow.objects.filter(user=user, circle__is_active=True).values_list('circle_id', flat=True))
+
+
+def recent_lists(circle_ids):
+    """``{circle_id: [(created_at, id), ...]}`` newest first, from the cache or rebuilt in one query."""
+    config = get_config()
+    shared = stamps_shared()
+    keys = {circle_key(circle_id): circle_id for circle_id in circle_ids}
+    found = cache.get_many(keys) if shared else {}
+    lists = {keys[key]: entries for key, entries in found.items()}
+
+    missing = [circle_id for circle_id in circle_ids if circle_id not in lists]
+    if missing:
+        rows = Post.objects.filter(circle_id__in=missing).annotate(
+            position=Window(RowNumber(), partition_by=[F('circle_id')], order_by=[F('created_at').desc(), F('id').desc()])
+        ).filter(position__lte=config['LIST_LENGTH']).order_by('circle_id', *ORDERING).values_list(
+            'circle_id', 'created_at', 'id'
+        )
+        rebuilt = {circle_id: [] for circle_id in missing}
+        # the lists are cached, so they're read from the primary rather than a replica that may lag
+        with primary_reads():
+            for circle_id, created_at, post_id in rows:
+                rebuilt[circle_id].append((created_at, post_id))
+        if shared:
+            cache.set_many({circle_key(circle_id): entries for circle_id, entries in rebuilt.items()}, config['TTL'])
+        lists.update(rebuilt)
+    return lists
+
+
+def merge_page(lists, after, per_page, list_length):
+    """
+    Up to ``per_page + 1`` entries from the merged lists that sort after ``after``.
+
+    Returns None if the answer depends on posts that are older than the end of
+    some full (trimmed) list and so aren't in the cache.
+    """
+    # the merge is only complete down to the newest point where a trimmed list runs out
+    horizon = max((entries[-1] for entries in lists.values() if len(entries) >= list_length), default=None)
+    streams = [
+        dropwhile(lambda entry: entry >= after, entries) if after else entries
+        for entries in lists.values()
+    ]
+    merged = list(islice(heapq.merge(*streams, reverse=True), per_page + 1))
+    if horizon is not None and (len(merged) <= per_page or merged[-1] < horizon):
+        return None
+    return merged
+
+
+def followed_feed(user, cursor=None, per_page=20):
+    """A KeysetPage of posts from the circles ``user`` follows, newest first."""
+    circle_ids = followed_circle_ids(user)
+    if not circle_ids:
+        return KeysetPage([], None)
+    values = decode_cursor(cursor, Post, ORDERING)
+    after = tuple(values) if values else None
+
+    entries = merge_page(recent_lists(circle_ids), after, per_page, get_config()['LIST_LENGTH'])
+    if entries is None:
+        # deep page, past what the cached lists hold
+        posts = Post.objects.filter(circle_id__in=circle_ids).order_by(*ORDERING)
+        if after:
+            posts = posts.filter(keyset_filter(ORDERING, after))
+        entries = list(posts.values_list('created_at', 'id')[:per_page + 1])
+
+    next_cursor = None
+    if len(entries) > per_page:
+        entries = entries[:per_page]
+        next_cursor = encode_cursor(list(entries[-1]))
+    posts = Post.objects.select_related('user', 'circle').in_bulk([post_id for _, post_id in entries])
+    return KeysetPage([posts[post_id] for _, post_id in entries if post_id in posts], next_cursor)
@@ -0,0 +1,344 @@
+"""
+Streaming export and import of forum data.
+
+Unlike ``dumpdata``/``loaddata`` nothing here holds a whole table in memory:
+export reads each model with a chunked ``iterator()`` and writes one file per
+model (``forum.post.jsonl`` or ``forum.post.csv``), and import reads those
+files line by line and inserts them with ``bulk_create`` in batches.
+
+By default primary keys are kept, which is what you want when moving data
+into an empty database. With ``remap=True`` rows get fresh keys and foreign
+keys are rewritten through an old -> new id map, so an export can be merged
+into a database that already has data; users and circles that already exist
+(same username / name) are reused rather than duplicated. The id map lives in
+a temporary table, not in memory.
+
+Each batch is committed on its own, so a failed import keeps the batches
+before it: restore the target database (or clear what was imported) before
+running it again.
+
+Counters, the search index, trending scores and statistics are all derived
+data that bulk inserts skip, so ``rebuild_derived`` recomputes them.
+"""
+import csv
+import io
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import ForeignKey, JSONField
+
+from .feed import invalidate_home_snapshot
+from .models import GUser, TopicCircle, Post, Comment, Report, Announcement, UserCircleFollow
+from .pagination import CursorEncoder
+from .timeline import invalidate_circle
+from .versions import bump
+
+# dependency order: everything a model points at comes before it
+MODELS = [GUser, TopicCircle, Announcement, Post, Comment, Report, UserCircleFollow]
+FORMATS = ('jsonl', 'csv')
+CSV_NULL = r'\N'  # text that starts with a backslash gets another one in front, see csv_value
+
+# only these are pointed at by other exported models, so only they need an id map
+REFERENCED_MODELS = [GUser, TopicCircle, Post]
+
+# rows that already exist in the target are matched on these when remapping
+NATURAL_KEYS = {
+    GUser: 'username',
+    TopicCircle: 'name',
+}
+
+
+def file_name(model, fmt):
+    return f'{model._meta.label_lower}.{fmt}'
+
+
+def export_fields(model):
+    return list(model._meta.concrete_fields)
+
+
+class Progress:
+    """Writes "<Model>: <n> rows (<rate>/s)" at most every ``interval`` seconds."""
+
+    def __init__(self, model, write, interval=2.0):
+        self.label = model.__name__
+        self.write = write
+        self.interval = interval
+        self.count = 0
+        self.started = self.last = time.monotonic()
+
+    def add(self, n):
+        self.count += n
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.report()
+            self.last = now
+
+    def report(self, suffix=''):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.write(f"{self.label}: {self.count} rows ({self.count / elapsed:.0f}/s){suffix}")
+
+
+def export_model(model, out, fmt='jsonl', chunk_size=2000, log=None):
+    fields = export_fields(model)
+    columns = [field.attname for field in fields]
+    rows = model.objects.order_by('pk').values_list(*columns).iterator(chunk_size=chunk_size)
+    progress = Progress(model, log or (lambda message: None))
+
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([csv_value(field, value) for field, value in zip(fields, row)])
+            progress.add(1)
+    else:
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row)), cls=CursorEncoder, ensure_ascii=False))
+            out.write('\n')
+            progress.add(1)
+    progress.report(', done')
+    return progress.count
+
+
+def csv_value(field, value):
+    if value is None:
+        return CSV_NULL
+    if isinstance(field, JSONField):
+        value = json.dumps(value, ensure_ascii=False)
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    if isinstance(value, str) and value.startswith('\\'):
+        # so text that reads \N (or starts with a backslash) isn't taken for NULL
+        value = '\\' + value
+    return value
+
+
+def csv_text(value):
+    """Undo ``csv_value``'s escaping: None for the NULL marker, one leading backslash dropped."""
+    if value == CSV_NULL:
+        return None
+    return value[1:] if value.startswith('\\') else value
+
+
+def export_forum(directory, fmt='jsonl', models=MODELS, chunk_size=2000, log=None):
+    os.makedirs(directory, exist_ok=True)
+    totals = {}
+    for model in models:
+        with open(os.path.join(directory, file_name(model, fmt)), 'w', newline='', encoding='utf-8') as out:
+            totals[model.__name__] = export_model(model, out, fmt, chunk_size, log)
+    return totals
+
+
+def read_rows(path, model):
+    """Yield ``{attname: python value}`` for each row of an exported file."""
+    fields = {field.attname: field for field in export_fields(model)}
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            for raw in csv.DictReader(f):
+                values = {name: csv_text(value) for name, value in raw.items() if name in fields}
+                yield {
+                    name: None if value is None else
+                    json.loads(value) if isinstance(fields[name], JSONField) else fields[name].to_python(value)
+                    for name, value in values.items()
+                }
+        else:
+            for line in f:
+                if line.strip():
+                    raw = json.loads(line)
+                    yield {
+                        name: value if isinstance(fields[name], JSONField) or value is None
+                        else fields[name].to_python(value)
+                        for name, value in raw.items() if name in fields
+                    }
+
+
+@contextmanager
+def explicit_timestamps(models):
+    """Keep exported created_at values: bulk_create would otherwise apply auto_now_add."""
+    switched = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now_add', False) or getattr(field, 'auto_now', False):
+                switched.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in switched:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class IdMap:
+    """
+    Old -> new primary keys for ``remap``, kept in a temporary table.
+
+    Only the keys a batch points at are read back, so memory stays flat however
+    many rows the export has.
+    """
+    table = 'forum_import_idmap'
+    lookup_chunk = 500
+
+    def __init__(self, connection=connection):
+        self.connection = connection
+
+    def create(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {self.table} ("
+                f"model varchar(100) NOT NULL, old_id bigint NOT NULL, new_id bigint NOT NULL, "
+                f"PRIMARY KEY (model, old_id))"
+            )
+
+    def drop(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def add(self, model, pairs):
+        if pairs:
+            with self.connection.cursor() as cursor:
+                cursor.executemany(f"INSERT INTO {self.table}(model, old_id, new_id) VALUES (%s, %s, %s)",
+                                   [(model._meta.label_lower, old_id, new_id) for old_id, new_id in pairs])
+
+    def lookup(self, model, old_ids):
+        old_ids = list(old_ids)
+        found = {}
+        with self.connection.cursor() as cursor:
+            for start in range(0, len(old_ids), self.lookup_chunk):
+                chunk = old_ids[start:start + self.lookup_chunk]
+                cursor.execute(
+                    f"SELECT old_id, new_id FROM {self.table} "
+                    f"WHERE model = %s AND old_id IN ({', '.join(['%s'] * len(chunk))})",
+                    [model._meta.label_lower, *chunk]
+                )
+                found.update(cursor.fetchall())
+        return found
+
+
+class Importer:
+    def __init__(self, remap=False, batch_size=1000, log=None):
+        self.remap = remap
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.id_map = IdMap() if remap else None
+        self.skipped = {}
+        self.circle_ids = set()  # circles that got new posts, for cache invalidation
+
+    def map_foreign_keys(self, model, rows):
+        """Rewrite a batch's FK values to the target's ids, dropping rows whose required target is missing."""
+        fields = [field for field in model._meta.concrete_fields
+                  if isinstance(field, ForeignKey) and field.related_model in REFERENCED_MODELS]
+        new_ids = {
+            field: self.id_map.lookup(field.related_model,
+                                      {row[field.attname] for row in rows if row.get(field.attname) is not None})
+            for field in fields
+        }
+        kept = []
+        for row in rows:
+            for field in fields:
+                if row.get(field.attname) is None:
+                    continue
+                row[field.attname] = new_ids[field].get(row[field.attname])
+                if row[field.attname] is None and not field.null:
+                    self.skipped[model.__name__] = self.skipped.get(model.__name__, 0) + 1
+                    break
+            else:
+                kept.append(row)
+        return kept
+
+    def import_model(self, model, rows):
+        progress = Progress(model, self.log)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                progress.add(self.import_batch(model, batch))
+                batch = []
+        if batch:
+            progress.add(self.import_batch(model, batch))
+        progress.report(', done')
+        return progress.count
+
+    def import_batch(self, model, rows):
+        # each batch commits on its own, so no transaction grows with the export
+        with transaction.atomic():
+            if self.remap:
+                rows = self.map_foreign_keys(model, rows)
+            return self.insert(model, rows)
+
+    def insert(self, model, rows):
+        pk_name = model._meta.pk.attname
+        if model is Post:
+            self.circle_ids.update(row['circle_id'] for row in rows)
+        if not self.remap:
+            model.objects.bulk_create([model(**row) for row in rows], ignore_conflicts=model is UserCircleFollow)
+            return len(rows)
+
+        old_ids = [row.pop(pk_name) for row in rows]
+        pairs = []
+        natural_key = NATURAL_KEYS.get(model)
+        if natural_key:
+            existing = dict(model.objects.filter(
+                **{f'{natural_key}__in': [row[natural_key] for row in rows]}
+            ).values_list(natural_key, 'pk'))
+            fresh = []
+            for old_id, row in zip(old_ids, rows):
+                if row[natural_key] in existing:
+                    pairs.append((old_id, existing[row[natural_key]]))
+                else:
+                    fresh.append((old_id, row))
+        else:
+            fresh = list(zip(old_ids, rows))
+
+        # a user may already follow the circle
+        created = model.objects.bulk_create([model(**row) for _, row in fresh],
+                                            ignore_conflicts=model is UserCircleFollow)
+        if model in REFERENCED_MODELS:
+            pairs += [(old_id, instance.pk) for (old_id, _), instance in zip(fresh, created)]
+            self.id_map.add(model, pairs)
+        return len(rows)
+
+
+def reset_sequences(models):
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def rebuild_derived(circle_ids=()):
+    """Recompute what signals would have maintained and drop cached copies of it."""
+    for command in ('reconcile_counts', 'rebuild_search_index', 'rebuild_trending', 'rebuild_stats'):
+        call_command(command, stdout=io.StringIO())
+    invalidate_home_snapshot()
+    for circle_id in circle_ids:
+        invalidate_circle(circle_id)
+    bump('announcements', 'circles', 'posts', *(f'circle:{circle_id}' for circle_id in circle_ids))
+
+
+def import_forum(directory, remap=False, batch_size=1000, rebuild=True, log=None):
+    importer = Importer(remap, batch_size, log)
+    totals = {}
+    if remap:
+        importer.id_map.create()
+    try:
+        with explicit_timestamps(MODELS):
+            for model in MODELS:
+                for fmt in FORMATS:
+                    path = os.path.join(directory, file_name(model, fmt))
+                    if os.path.exists(path):
+                        totals[model.__name__] = importer.import_model(model, read_rows(path, model))
+                        break
+    finally:
+        if remap:
+            importer.id_map.drop()
+    if not remap:
+        reset_sequences(MODELS)
+    if rebuild:
+        rebuild_derived(importer.circle_ids)
+    return totals, importer.skipped
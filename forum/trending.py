@@ -0,0 +1,72 @@
+"""
+Trending score for posts.
+
+``score = sign(s) * log10(max(|s|, 1)) + age / DECAY_SECONDS`` where ``s`` is
+likes - dislikes + COMMENT_WEIGHT * comments and ``age`` is seconds since
+EPOCH. Newer posts get a higher baseline instead of older ones being decayed,
+so a score never has to be recomputed just because time passed: each vote or
+comment moves it once, in the same UPDATE as the counter, and the top K posts
+are the first K rows of an index on ``trending_score``. Every DECAY_SECONDS of
+age is worth a factor of ten in votes.
+"""
+import datetime
+import math
+
+from django.apps import apps as global_apps
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Greatest, Log, Sign
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+DECAY_SECONDS = 45000  # 12.5 hours
+COMMENT_WEIGHT = 2
+
+
+def hot_score(likes, dislikes, comment_count, created_at):
+    s = likes - dislikes + COMMENT_WEIGHT * comment_count
+    sign = (s > 0) - (s < 0)
+    return sign * math.log10(max(abs(s), 1)) + (created_at - EPOCH).total_seconds() / DECAY_SECONDS
+
+
+def vote_term(likes, dislikes, comment_count):
+    s = likes - dislikes + COMMENT_WEIGHT * comment_count
+    return Sign(s) * Log(Value(10.0), Greatest(Abs(s), Value(1.0)), output_field=FloatField())
+
+
+def score_update(deltas):
+    """
+    ``trending_score`` expression for an UPDATE that also applies ``deltas`` to the counters.
+
+    SET expressions all see the row as it was before the UPDATE, so swapping
+    the old vote term for the new one keeps the age term without reading it.
+    """
+    old = [F(field) for field in ('likes', 'dislikes', 'comment_count')]
+    new = [F(field) + deltas.get(field, 0) for field in ('likes', 'dislikes', 'comment_count')]
+    return F('trending_score') - vote_term(*old) + vote_term(*new)
+
+
+def top_posts(k, circle=None):
+    """The ``k`` highest-scoring posts, overall or in one circle."""
+    from .models import Post
+
+    posts = Post.objects.select_related('user', 'circle')
+    if circle is not None:
+        posts = posts.filter(circle=circle)
+    return list(posts.order_by('-trending_score', '-id')[:k])
+
+
+def rebuild(apps=global_apps, using='default', batch_size=1000):
+    """Recompute every post's score from its counters, e.g. after bulk imports."""
+    Post = apps.get_model('forum', 'Post')
+    updated = 0
+    batch = []
+    for post in Post.objects.using(using).only('likes', 'dislikes', 'comment_count', 'created_at').iterator(batch_size):
+        post.trending_score = hot_score(post.likes, post.dislikes, post.comment_count, post.created_at)
+        batch.append(post)
+        if len(batch) >= batch_size:
+            Post.objects.using(using).bulk_update(batch, ['trending_score'])
+            updated += len(batch)
+            batch = []
+    if batch:
+        Post.objects.using(using).bulk_update(batch, ['trending_score'])
+        updated += len(batch)
+    return updated
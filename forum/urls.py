@@ -25,8 +25,10 @@ urlpatterns = [
     path('circle/<int:circle_id>/follow/', views.follow_circle, name='follow_circle'),
     path('circle/<int:circle_id>/unfollow/', views.unfollow_circle, name='unfollow_circle'),
     path('all-circles/', views.all_circles, name='all_circles'),
+    path('feed/', views.followed_feed, name='followed_feed'),
     path('profile/', views.profile, name='profile'),
     path('admin/dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin/stats/series/', views.stats_series, name='stats_series'),
     path('admin/circle/create/', views.circle_create, name='circle_create'),
     path('admin/circle/<int:circle_id>/edit/', views.circle_edit, name='circle_edit'),
     path('admin/circle/<int:circle_id>/delete/', views.circle_delete, name='circle_delete'),
@@ -37,5 +39,6 @@ urlpatterns = [
     path('admin/announcement/<int:announcement_id>/manage/', views.announcement_manage, name='announcement_manage'),
     path('search/', views.search, name='search'),
     path('weather/', views.get_weather, name='get_weather'),
-    path('geocode/', views.geocode, name='geocode')
+    path('geocode/', views.geocode, name='geocode'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Version stamps for cached template fragments.
+
+Each scope has a stamp in the cache holding the time it last changed:
+``announcements``, ``announcement:<id>`` (one announcement's page),
+``circles`` (the circle lists), ``posts`` (the home page post lists),
+``circle:<id>`` (one circle's post list) and ``post:<id>`` (one post and its
+comments), plus ``user:<id>`` for what differs per viewer (follows,
+nicknames). Fragments and ETags (forum/conditional.py) put their scope's
+stamp in the cache key, so bumping a stamp makes every fragment built before
+it unreachable and nothing ever has to be deleted. A stamp that was evicted
+comes back as "now", which is newer than anything cached under the old one.
+
+forum/signals.py bumps the scopes of every saved or deleted row; counter-only
+UPDATEs (votes) bump ``counter_scopes`` from forum/counters.py.
+
+A bump only reaches other processes through a cache they share (Redis, see
+``REDIS_URL``). That includes ``manage.py run_worker``: jobs such as circle
+deletion and queued reports change rows, and bump stamps, in the worker's
+process. With the per-process LocMemCache and more than one process writing
+(``WEB_CONCURRENCY`` web workers plus ``TASK_WORKERS`` unless
+``TASKS['EAGER']``), ``stamps_shared()`` is False and everything keyed on
+stamps is switched off rather than served stale from the processes that
+didn't see the write.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .models import GUser, TopicCircle, Post, Comment, Announcement, UserCircleFollow
+from .routers import primary_if_changed
+from .tasks import get_config as tasks_config
+
+
+def stamps_shared():
+    """Whether every process that serves requests or runs jobs sees the same stamps."""
+    processes = settings.WEB_CONCURRENCY + (0 if tasks_config()['EAGER'] else settings.TASK_WORKERS)
+    return processes <= 1 or not isinstance(caches['default'], LocMemCache)
+
+
+def fragment_ttl(seconds):
+    """Timeout for a ``{% cache %}`` fragment keyed on stamps; 0 (don't store) if stamps aren't shared."""
+    return seconds if stamps_shared() else 0
+
+
+def version_key(scope):
+    return f'forum:version:{scope}'
+
+
+def get_versions(*scopes):
+    keys = [version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in found:
+            # first use or evicted; keep the stamp someone else just set, if any
+            if not cache.add(key, now, None):
+                found[key] = cache.get(key, now)
+            else:
+                found[key] = now
+    stamps = [found[key] for key in keys]
+    # whatever gets cached under these stamps must not come from a replica that hasn't seen the change
+    primary_if_changed(stamps)
+    return stamps
+
+
+def get_version(scope):
+    return get_versions(scope)[0]
+
+
+def bump(*scopes):
+    def stamp():
+        cache.set_many({version_key(scope): time.time() for scope in scopes}, None)
+
+    stamp()
+    # and again after commit, so a reader that cached the old rows under the
+    # first new stamp (before the change was visible) is superseded
+    transaction.on_commit(stamp)
+
+
+def comment_circle_id(comment):
+    if Comment.post.is_cached(comment):
+        return comment.post.circle_id
+    return Post.objects.filter(pk=comment.post_id).values_list('circle_id', flat=True).first()
+
+
+def scopes_for(instance):
+    """Scopes whose fragments show ``instance``."""
+    if isinstance(instance, Announcement):
+        return ['announcements', f'announcement:{instance.pk}']
+    if isinstance(instance, TopicCircle):
+        return ['circles', f'circle:{instance.pk}']
+    if isinstance(instance, Post):
+        # post_count in the circle lists, the card in its circle
+        return ['posts', 'circles', f'circle:{instance.circle_id}', f'post:{instance.pk}']
+    if isinstance(instance, GUser):
+        return [f'user:{instance.pk}']
+    if isinstance(instance, UserCircleFollow):
+        return [f'user:{instance.user_id}']
+    if isinstance(instance, Comment):
+        # comment_count on the post's card
+        scopes = ['posts', f'post:{instance.post_id}']
+        circle_id = comment_circle_id(instance)
+        if circle_id is not None:
+            scopes.append(f'circle:{circle_id}')
+        return scopes
+    return []
+
+
+def counter_scopes(instance):
+    # like/dislike counts show on the post page and the circle's cards; the home
+    # page lists refresh with the snapshot instead, see forum/feed.py
+    if isinstance(instance, Post):
+        return [f'post:{instance.pk}', f'circle:{instance.circle_id}']
+    return [f'post:{instance.post_id}']
+
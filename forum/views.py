@@ -1,56 +1,67 @@
 from django.utils import timezone
 from functools import wraps
 from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth import login, authenticate
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from .models import TopicCircle, Post, Comment, Report, Announcement, GUser, UserCircleFollow
 from .forms import GUserCreationForm, NicknameForm, TopicCircleForm, AnnouncementForm
-import requests
+from .feed import get_home_snapshot, get_followed_circles
+from .pagination import keyset_paginate
+from .timeline import followed_feed as followed_feed_page
+from .search import search_forum
+from .counters import cast_vote, LIKE, DISLIKE
+from .geocoding import get_geocoder, parse_coordinates, create_with_location
+from .weather import get_weather_provider, WeatherUnavailable
+from .stats import day_range, totals as rollup_totals, series as rollup_series
+from .profiling import metrics as profiling_metrics, get_config as profiling_config
+from .versions import get_version, get_versions, fragment_ttl
+from .conditional import versioned_page
+from .tasks import enqueue, reason_key, stalled_jobs, circles_being_deleted
+from .routers import replica_reads
+from .pagecache import anonymous_page_cache
+from .ratelimit import rate_limit
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 from django.contrib import messages
-from django.db.models import Count, Q
-from geopy.geocoders import Nominatim
-
-
+from django.db.models import Q
+
+POSTS_PER_PAGE = 20
+COMMENTS_PER_PAGE = 20
+STAT_LABELS = {
+    'posts': 'Num of Posts',
+    'comments': 'Num of Comments',
+    'users': 'Num of Users',
+    'reports': 'Num of Reports',
+    'votes': 'Num of Votes',
+}
+MAX_SERIES_DAYS = 366
+REPORT_DEDUPE_WINDOW = 60  # seconds a repeated identical report counts as a double submit
+
+
+@anonymous_page_cache('announcements', 'circles', 'posts', ttl=settings.HOME_FEED_TTL)
+@replica_reads
 def home(request):
-    circles = TopicCircle.objects.filter(is_active=True).annotate(
-        post_count=Count('post')
-    ).order_by('-post_count')[:5]
-    popular_posts = Post.objects.annotate(
-        comment_count=Count('comment')
-    ).order_by('-likes', '-comment_count')[:5]
-    announcements = Announcement.objects.all()
-    recommended_posts = Post.objects.filter(is_recommended=True).order_by('-created_at')[:5]
-
-    followed_circles = []
-    if request.user.is_authenticated:
-        followed_circles = TopicCircle.objects.filter(
-            usercirclefollow__user=request.user,
-            is_active=True
-        ).annotate(post_count=Count('post'))
+    # only loaded if one of the cached fragments below misses
+    snapshot = SimpleLazyObject(get_home_snapshot)
+    followed_circles = get_followed_circles(request.user)
+    announcements_version, circles_version, posts_version = get_versions('announcements', 'circles', 'posts')
 
+    # only echoed back into the search box; the search view runs the query
     search_query = request.GET.get('search', '')
-    search_results = None
-    if search_query:
-        search_results = {
-            'circles': TopicCircle.objects.filter(
-                Q(name__icontains=search_query) | Q(description__icontains=search_query),
-                is_active=True
-            ).annotate(post_count=Count('post')),
-            'posts': Post.objects.filter(
-                Q(content__icontains=search_query)
-            ).annotate(comment_count=Count('comment'))
-        }
 
     return render(request, 'forum/home.html', {
-        'circles': circles,
-        'popular_posts': popular_posts,
-        'announcements': announcements,
-        'recommended_posts': recommended_posts,
+        'circles': SimpleLazyObject(lambda: snapshot['circles']),
+        'popular_posts': SimpleLazyObject(lambda: snapshot['popular_posts']),
+        'announcements': SimpleLazyObject(lambda: snapshot['announcements']),
+        'recommended_posts': SimpleLazyObject(lambda: snapshot['recommended_posts']),
+        'versions': {'announcements': announcements_version, 'circles': circles_version, 'posts': posts_version},
+        # vote counts in these lists come from the snapshot, so expire together with it
+        'fragment_ttl': fragment_ttl(settings.HOME_FEED_TTL),
         'followed_circles': followed_circles,
         'search_query': search_query,
-        'search_results': search_results
     })
 
 
@@ -67,18 +78,11 @@ def admin_required(view_func):
 
 
 @login_required
+@replica_reads
 def search(request):
     search_query = request.GET.get('q', '')
     if search_query:
-        search_results = {
-            'circles': TopicCircle.objects.filter(
-                Q(name__icontains=search_query) | Q(description__icontains=search_query),
-                is_active=True
-            ).annotate(post_count=Count('post')),
-            'posts': Post.objects.filter(
-                Q(content__icontains=search_query)
-            ).annotate(comment_count=Count('comment'))
-        }
+        search_results = search_forum(search_query, request.GET.get('page'))
     else:
         search_results = {'circles': [], 'posts': []}
     return render(request, 'forum/search_results.html',
@@ -119,7 +123,31 @@ def custom_login(request):
 
 
 
+def queue_report(user, post_id, reason):
+    # a double-submitted form queues the same job rather than a second report; the key
+    # only lasts a window so the same report made again later (say after it was resolved) still counts
+    window = int(timezone.now().timestamp() // REPORT_DEDUPE_WINDOW)
+    enqueue('forum.create_report', key=f'report:{user.pk}:{post_id}:{reason_key(reason)}:{window}',
+            user_id=user.pk, post_id=post_id, reason=reason)
+
+
+def post_summary(post):
+    return {
+        'id': post.id,
+        'content': post.content,
+        'author': (post.nickname or 'Anonymous User') if post.is_anonymous else post.user.username,
+        'created_at': post.created_at.strftime('%Y-%m-%d %H:%M'),
+        'location': post.location,
+        'is_pinned': post.is_pinned,
+        'likes': post.likes,
+        'dislikes': post.dislikes,
+        'comment_count': post.comment_count
+    }
+
+
 @login_required
+@versioned_page('circle:{circle_id}')
+@replica_reads
 def circle_detail(request, circle_id):
     circle = get_object_or_404(TopicCircle, id=circle_id, is_active=True)
     sort_by = request.GET.get('sort', 'created_at_desc')
@@ -132,10 +160,19 @@ def circle_detail(request, circle_id):
         'comments_asc': 'comment_count',
     }
     sort_field = sort_options.get(sort_by, '-created_at')
+    # pinned posts first, then the chosen sort, id breaks ties so the cursor is exact
+    ordering = ['-is_pinned', sort_field, '-id' if sort_field.startswith('-') else 'id']
+
+    posts = Post.objects.filter(circle=circle).select_related('user')
+    page = keyset_paginate(posts, ordering, request.GET.get('cursor'), POSTS_PER_PAGE)
 
-    posts = Post.objects.filter(circle=circle).annotate(
-        comment_count=Count('comment')
-    ).order_by('-is_pinned', sort_field)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'posts': [post_summary(post) for post in page.object_list],
+            'has_next': page.has_next(),
+            'next_cursor': page.next_cursor,
+            'sort_by': sort_by
+        })
 
     # check whether user has followed the circle
     is_followed = request.user.is_authenticated and UserCircleFollow.objects.filter(user=request.user,
@@ -143,13 +180,33 @@ def circle_detail(request, circle_id):
 
     return render(request, 'forum/circle_detail.html', {
         'circle': circle,
-        'posts': posts,
+        'posts': page,
+        'posts_version': get_version(f'circle:{circle.id}'),
+        'cursor': request.GET.get('cursor', ''),
+        'fragment_ttl': fragment_ttl(settings.FRAGMENT_CACHE_TTL),
         'sort_by': sort_by,
         'is_followed': is_followed
     })
 
 
+# posts from every followed circle, newest first
 @login_required
+def followed_feed(request):
+    page = followed_feed_page(request.user, request.GET.get('cursor'), POSTS_PER_PAGE)
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'posts': [{**post_summary(post), 'circle': post.circle.name, 'circle_id': post.circle_id}
+                      for post in page.object_list],
+            'has_next': page.has_next(),
+            'next_cursor': page.next_cursor,
+        })
+
+    return render(request, 'forum/followed_feed.html', {'posts': page})
+
+
+@login_required
+@rate_limit('post', methods=('POST',))
 def create_post(request, circle_id):
     circle = get_object_or_404(TopicCircle, id=circle_id, is_active=True)
     if request.method == 'POST':
@@ -157,21 +214,15 @@ def create_post(request, circle_id):
         is_anonymous = request.POST.get('is_anonymous') == 'on'
         nickname = request.POST.get('nickname') if is_anonymous else None
         use_location = request.POST.get('use_location') == 'on'
-        location = None
-
-        if use_location and 'lat' in request.POST and 'lon' in request.POST:
-            lat = request.POST.get('lat')
-            lon = request.POST.get('lon')
-            geolocator = Nominatim(user_agent="our_circle_app")
-            location = geolocator.reverse((lat, lon), language='zh-CN').address if lat and lon else None
-            location = location or f"Lat: {lat}, Lon: {lon}"
+        lat = request.POST.get('lat') if use_location else None
+        lon = request.POST.get('lon') if use_location else None
 
         if is_anonymous and nickname and nickname not in request.user.anonymous_nicknames:
             messages.error(request, "Please uss a created nickname")
             return redirect('circle_detail', circle_id=circle.id)
         if content:
-            Post.objects.create(user=request.user, circle=circle, content=content, is_anonymous=is_anonymous,
-                                nickname=nickname, location=location)
+            create_with_location(Post, lat, lon, user=request.user, circle=circle, content=content,
+                                 is_anonymous=is_anonymous, nickname=nickname)
             messages.success(request, 'Post Successfully')
         else:
             messages.error(request, 'Content cannot be empty')
@@ -180,72 +231,8 @@ def create_post(request, circle_id):
 
 
 @login_required
-def like_post(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    post.likes += 1
-    post.save()
-    messages.success(request, 'Likes Successfully')
-    return redirect('circle_detail', circle_id=post.circle.id)
-
-
-@login_required
-def dislike_post(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    post.dislikes += 1
-    post.save()
-    messages.success(request, 'Unlikes Successfully')
-    return redirect('circle_detail', circle_id=post.circle.id)
-
-
-@login_required
-def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    if request.method == 'POST':
-        content = request.POST.get('content')
-        is_anonymous = request.POST.get('is_anonymous') == 'on'
-        nickname = request.POST.get('nickname') if is_anonymous else None
-        use_location = request.POST.get('use_location') == 'on'
-        location = None
-
-        if use_location and 'lat' in request.POST and 'lon' in request.POST:
-            lat = request.POST.get('lat')
-            lon = request.POST.get('lon')
-            geolocator = Nominatim(user_agent="our_circle_app")
-            location = geolocator.reverse((lat, lon), language='zh-CN').address if lat and lon else None
-            location = location or f"Lat: {lat}, Lon: {lon}"
-
-        if is_anonymous and nickname and nickname not in request.user.anonymous_nicknames:
-            messages.error(request, "Please uss a created nickname")
-            return redirect('post_detail', post_id=post.id)
-        if content:
-            Comment.objects.create(user=request.user, post=post, content=content, is_anonymous=is_anonymous,
-                                   nickname=nickname, location=location)
-            messages.success(request, 'Comment Successfully')
-        else:
-            messages.error(request, 'Comment cannot be empty')
-        return redirect('post_detail', post_id=post.id)
-    return render(request, 'forum/add_comment.html', {'post': post})
-
-
-@login_required
-def report_post(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    if request.method == 'POST':
-        reason = request.POST.get('reason')
-        if reason:
-            Report.objects.create(
-                user=request.user,
-                post=post,
-                reason=reason
-            )
-            messages.success(request, 'Report Successfully')
-        else:
-            messages.error(request, 'Please enter a reason')
-        return redirect('circle_detail', circle_id=post.circle.id)
-    return render(request, 'forum/report_post.html', {'post': post})
-
-
-@login_required
+@versioned_page('circles')
+@replica_reads
 def all_circles(request):
     sort_by = request.GET.get('sort', 'name')
     sort_options = {
@@ -258,9 +245,7 @@ def all_circles(request):
 
     search_query = request.GET.get('search', '')
 
-    circles = TopicCircle.objects.filter(is_active=True).annotate(
-        post_count=Count('post')
-    )
+    circles = TopicCircle.objects.filter(is_active=True)
 
     if search_query:
         circles = circles.filter(
@@ -299,6 +284,7 @@ def all_circles(request):
 
 
 @login_required
+@replica_reads
 def profile(request):
     sort_by = request.GET.get('sort', 'created_at_desc')
     sort_options = {
@@ -313,7 +299,7 @@ def profile(request):
     followed_circles = TopicCircle.objects.filter(
         usercirclefollow__user=request.user,
         is_active=True
-    ).annotate(post_count=Count('post'))
+    )
 
     if request.method == 'POST' and 'nickname' in request.POST:
         form = NicknameForm(request.POST)
@@ -346,28 +332,24 @@ def profile(request):
 # admin dashboard
 @admin_required
 def admin_dashboard(request):
-    reports = Report.objects.filter(is_resolved=False).order_by('-created_at')
-    circles = TopicCircle.objects.all().order_by('-created_at')
+    reports = Report.objects.filter(is_resolved=False).select_related('user', 'post').order_by('-created_at')
+    # circles pending deletion are already gone as far as anyone can tell; ones merely set inactive stay editable
+    circles = TopicCircle.objects.exclude(pk__in=circles_being_deleted()).order_by('-created_at')
     announcements = Announcement.objects.all()
 
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
-    stat_type = request.GET.get('stat_type')
+    stat_types = [stat_type for stat_type in request.GET.getlist('stat_type') if stat_type in STAT_LABELS]
     stats = None
 
-    if start_date and end_date and stat_type:
+    if start_date and end_date and stat_types:
         try:
-            start_date = timezone.datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0)
-            end_date = timezone.datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-            if start_date > end_date:
+            start, end = day_range(start_date, end_date)
+            if start >= end:
                 messages.error(request, "Start date cannot be greater than end date！")
             else:
-                if stat_type == 'posts':
-                    stats = Post.objects.filter(created_at__range=(start_date, end_date)).count()
-                elif stat_type == 'comments':
-                    stats = Comment.objects.filter(created_at__range=(start_date, end_date)).count()
-                elif stat_type == 'users':
-                    stats = GUser.objects.filter(date_joined__range=(start_date, end_date)).count()
+                counts = rollup_totals(stat_types, start, end)
+                stats = [(STAT_LABELS[stat_type], counts[stat_type]) for stat_type in stat_types]
         except ValueError:
             messages.error(request, "Illegal format，Please: YYYY-MM-DD！")
 
@@ -378,10 +360,31 @@ def admin_dashboard(request):
         'stats': stats,
         'start_date': start_date,
         'end_date': end_date,
-        'stat_type': stat_type
+        'stat_types': stat_types,
+        'stat_labels': STAT_LABELS,
+        'stalled_jobs': stalled_jobs(),
     })
 
 
+# time series for dashboard charts
+@admin_required
+def stats_series(request):
+    granularity = request.GET.get('granularity', 'day')
+    stat_types = [stat_type for stat_type in request.GET.getlist('stat_type') if stat_type in STAT_LABELS]
+    if granularity not in ('hour', 'day') or not stat_types:
+        return JsonResponse({'status': 'error', 'message': 'Unknown granularity or stat type'}, status=400)
+    try:
+        start, end = day_range(request.GET.get('start_date', ''), request.GET.get('end_date', ''))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Illegal format，Please: YYYY-MM-DD！'}, status=400)
+    if start >= end or (end - start).days > MAX_SERIES_DAYS:
+        return JsonResponse({'status': 'error', 'message': 'Illegal date range'}, status=400)
+    return JsonResponse({
+        'status': 'success',
+        'granularity': granularity,
+        'series': {stat_type: rollup_series(stat_type, granularity, start, end) for stat_type in stat_types}
+    })
+
 
 @admin_required
 def circle_create(request):
@@ -402,6 +405,9 @@ def circle_create(request):
 @admin_required
 def circle_edit(request, circle_id):
     circle = get_object_or_404(TopicCircle, id=circle_id)
+    if circle.pk in circles_being_deleted():
+        # reactivating it would race the background delete, which would then skip it half done
+        raise Http404("Circle is being deleted")
     if request.method == 'POST':
         form = TopicCircleForm(request.POST, instance=circle)
         if form.is_valid():
@@ -417,17 +423,21 @@ def circle_edit(request, circle_id):
 @admin_required
 def circle_delete(request, circle_id):
     circle = get_object_or_404(TopicCircle, id=circle_id)
+    if circle.pk in circles_being_deleted():
+        raise Http404("Circle is being deleted")
     if request.method == 'POST':
-        circle_name = circle.name
-        circle.delete()
-        messages.success(request, f"Circle '{circle_name}' deleted successfully")
+        # hidden everywhere at once; its posts, comments and votes go in the background
+        circle.is_active = False
+        circle.save(update_fields=['is_active'])
+        enqueue('forum.delete_circle', circle_id=circle.pk)
+        messages.success(request, f"Circle '{circle.name}' deleted successfully")
         return redirect('admin_dashboard')
     return render(request, 'forum/circle_delete.html', {'circle': circle})
 
 
 @admin_required
 def report_resolve(request, report_id):
-    report = get_object_or_404(Report, id=report_id)
+    report = get_object_or_404(Report.objects.select_related('user', 'post'), id=report_id)
     if request.method == 'POST':
         report.is_resolved = True
         report.save()
@@ -462,8 +472,10 @@ def announcement_create(request):
     return render(request, 'forum/announcement_create.html', {'form': form})
 
 
+@versioned_page('announcement:{announcement_id}')
+@anonymous_page_cache('announcement:{announcement_id}')
 def announcement_detail(request, announcement_id):
-    announcement = get_object_or_404(Announcement, id=announcement_id)
+    announcement = get_object_or_404(Announcement.objects.select_related('created_by'), id=announcement_id)
     if request.user.is_authenticated and request.user.is_admin:
         return redirect('announcement_manage', announcement_id=announcement.id)
     return render(request, 'forum/announcement_detail.html', {'announcement': announcement})
@@ -509,8 +521,10 @@ def user_post_delete(request, post_id):
 
 
 @login_required
+@versioned_page('post:{post_id}')
+@replica_reads
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.select_related('user', 'circle'), id=post_id)
     sort_by = request.GET.get('sort', 'created_at_desc')
     sort_options = {
         'created_at_desc': '-created_at',
@@ -519,46 +533,72 @@ def post_detail(request, post_id):
         'likes_asc': 'likes',
     }
     sort_field = sort_options.get(sort_by, '-created_at')
-    comments = Comment.objects.filter(post=post).order_by(sort_field)
+    ordering = [sort_field, '-id' if sort_field.startswith('-') else 'id']
+    comments = Comment.objects.filter(post=post).select_related('user')
+    page = keyset_paginate(comments, ordering, request.GET.get('cursor'), COMMENTS_PER_PAGE)
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        comment_data = [{
+            'id': comment.id,
+            'content': comment.content,
+            'author': (comment.nickname or 'Anonymous User') if comment.is_anonymous else comment.user.username,
+            'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M'),
+            'likes': comment.likes,
+            'dislikes': comment.dislikes
+        } for comment in page.object_list]
+        return JsonResponse({
+            'comments': comment_data,
+            'has_next': page.has_next(),
+            'next_cursor': page.next_cursor,
+            'sort_by': sort_by
+        })
+
     return render(request, 'forum/post_detail.html', {
         'post': post,
-        'comments': comments,
+        'comments': page,
+        'comments_version': get_version(f'post:{post.id}'),
+        'cursor': request.GET.get('cursor', ''),
+        'fragment_ttl': fragment_ttl(settings.FRAGMENT_CACHE_TTL),
         'sort_by': sort_by
     })
 
 
 #like post
 @login_required
+@rate_limit('vote')
 def like_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)
-    post.likes += 1
-    post.save()
+    cast_vote(request.user, post, LIKE)
     return redirect('post_detail', post_id=post.id)
 
 
 # unlike post
 @login_required
+@rate_limit('vote')
 def dislike_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)
-    post.dislikes += 1
-    post.save()
+    cast_vote(request.user, post, DISLIKE)
     return redirect('post_detail', post_id=post.id)
 
 
 # make comment
 @login_required
+@rate_limit('comment', methods=('POST',))
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if request.method == 'POST':
         content = request.POST.get('content')
         is_anonymous = request.POST.get('is_anonymous') == 'on'
         nickname = request.POST.get('nickname') if is_anonymous else None
+        use_location = request.POST.get('use_location') == 'on'
+        lat = request.POST.get('lat') if use_location else None
+        lon = request.POST.get('lon') if use_location else None
         if is_anonymous and nickname and nickname not in request.user.anonymous_nicknames:
             messages.error(request, "Please enter a valid nickname")
             return redirect('post_detail', post_id=post.id)
         if content:
-            Comment.objects.create(user=request.user, post=post, content=content, is_anonymous=is_anonymous,
-                                   nickname=nickname)
+            create_with_location(Comment, lat, lon, user=request.user, post=post, content=content,
+                                 is_anonymous=is_anonymous, nickname=nickname)
             messages.success(request, 'Comment has been added')
         else:
             messages.error(request, 'Comment cannot be empty')
@@ -567,12 +607,13 @@ def add_comment(request, post_id):
 
 # report post
 @login_required
+@rate_limit('report', methods=('POST',))
 def report_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if request.method == 'POST':
         reason = request.POST.get('reason')
         if reason:
-            Report.objects.create(user=request.user, post=post, reason=reason)
+            queue_report(request.user, post.id, reason)
             messages.success(request, 'Report has been added')
             return redirect('post_detail', post_id=post.id)
         else:
@@ -615,34 +656,35 @@ def pin_post(request, post_id):
 
 # like comment
 @login_required
+@rate_limit('vote')
 def like_comment(request, comment_id):
     comment = get_object_or_404(Comment, id=comment_id)
-    comment.likes += 1
-    comment.save()
-    return redirect('post_detail', post_id=comment.post.id)
+    cast_vote(request.user, comment, LIKE)
+    return redirect('post_detail', post_id=comment.post_id)
 
 
 # unlike comment
 @login_required
+@rate_limit('vote')
 def dislike_comment(request, comment_id):
     comment = get_object_or_404(Comment, id=comment_id)
-    comment.dislikes += 1
-    comment.save()
-    return redirect('post_detail', post_id=comment.post.id)
+    cast_vote(request.user, comment, DISLIKE)
+    return redirect('post_detail', post_id=comment.post_id)
 
 
 # report comment
 @login_required
+@rate_limit('report', methods=('POST',))
 def report_comment(request, comment_id):
     comment = get_object_or_404(Comment, id=comment_id)
     if request.method == 'POST':
         reason = request.POST.get('reason')
         if reason:
-            Report.objects.create(user=request.user, post=comment.post, reason=f"Report Comment: {reason}")
+            queue_report(request.user, comment.post_id, f"Report Comment: {reason}")
             messages.success(request, 'Report has been added')
         else:
             messages.error(request, 'Please enter a reason')
-    return redirect('post_detail', post_id=comment.post.id)
+    return redirect('post_detail', post_id=comment.post_id)
 
 
 
@@ -652,7 +694,7 @@ def admin_comment_delete(request, comment_id):
     if request.method == 'POST':
         comment.delete()
         messages.success(request, "Comment has been deleted")
-        return redirect('post_detail', post_id=comment.post.id)
+        return redirect('post_detail', post_id=comment.post_id)
     return render(request, 'forum/comment_delete.html', {'comment': comment})
 
 
@@ -688,51 +730,41 @@ def unfollow_circle(request, circle_id):
 
 
 
-def get_weather(request):
-    api_key = "f0ce8dd116d0a235d4a54eaa89c9591f"
-    lat = request.GET.get('lat')
-    lon = request.GET.get('lon')
-    weather_data = None
+async def get_weather(request):
+    coordinates = parse_coordinates(request.GET.get('lat'), request.GET.get('lon'))
 
-    if lat and lon:
-        url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric"
+    if coordinates:
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            weather_data = response.json()
             return JsonResponse({
                 'status': 'success',
-                'data': {
-                    'name': weather_data.get('name', 'Unknown Location'),
-                    'temp': weather_data['main']['temp'],
-                    'description': weather_data['weather'][0]['description'],
-                    'humidity': weather_data['main']['humidity'],
-                    'wind_speed': weather_data['wind']['speed'],
-                }
+                'data': await get_weather_provider().aget(*coordinates)
             })
-        except requests.RequestException as e:
+        except WeatherUnavailable:
             return JsonResponse({'status': 'error', 'message': 'Can not get the weather, please try later'}, status=500)
     return JsonResponse({'status': 'error', 'message': 'No Location Information'}, status=400)
 
 
 
-def geocode(request):
-    lat = request.GET.get('lat')
-    lon = request.GET.get('lon')
-    api_key = "f0ce8dd116d0a235d4a54eaa89c9591f"
+async def geocode(request):
+    coordinates = parse_coordinates(request.GET.get('lat'), request.GET.get('lon'))
 
-    if lat and lon:
-        url = f"https://api.openweathermap.org/geo/1.0/reverse?lat={lat}&lon={lon}&limit=1&appid={api_key}"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            if data and len(data) > 0:
-                return JsonResponse({
-                    'status': 'success',
-                    'location': data[0].get('name', 'Unknown Location')
-                })
-            return JsonResponse({'status': 'error', 'message': 'Can not resolve location'}, status=400)
-        except requests.RequestException as e:
-            return JsonResponse({'status': 'error', 'message': 'Can not get the weather, please try later'}, status=500)
+    if coordinates:
+        location = await get_geocoder().areverse(*coordinates)
+        if location:
+            return JsonResponse({
+                'status': 'success',
+                'location': location
+            })
+        return JsonResponse({'status': 'error', 'message': 'Can not resolve location'}, status=400)
     return JsonResponse({'status': 'error', 'message': 'No Location Information'}, status=400)
+
+
+# Prometheus scrape endpoint, bearer token or admin login
+def metrics(request):
+    token = profiling_config()['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    allowed = (token and constant_time_compare(authorization, f'Bearer {token}')) or \
+        (request.user.is_authenticated and request.user.is_admin)
+    if not allowed:
+        raise Http404
+    return HttpResponse(profiling_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,183 @@
+"""
+Current weather for the navbar widget.
+
+Readings are cached per rounded coordinate (2 decimal places, ~1km) so nearby
+users share them. A reading is fresh for ``FRESH_TTL`` seconds; after that and
+up to ``STALE_TTL`` it is still served immediately while one background
+refresh fetches a new one, so a slow upstream only ever delays the very first
+visitor for an area. Concurrent misses for the same key wait on a single
+upstream call instead of each making their own.
+
+``aget`` is the same for async views. Under ASGI a miss awaits the upstream
+call on the event loop instead of holding a worker thread. Under WSGI each
+request has its own short-lived loop, so ``aget`` runs ``get`` in a thread and
+joins the same process-wide ``in_flight`` table as sync callers.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .http import get_session, get_async_client, native_async, DEFAULT_TIMEOUT
+from .profiling import external_call
+
+logger = logging.getLogger(__name__)
+
+WEATHER_URL = 'https://api.openweathermap.org/data/2.5/weather'
+
+
+# network errors, HTTP errors and responses missing the fields we read
+FETCH_ERRORS = (requests.RequestException, httpx.HTTPError, KeyError, IndexError, ValueError)
+# longest a request waits on someone else's upstream call: connect + read timeouts, with room to spare
+WAIT_TIMEOUT = sum(DEFAULT_TIMEOUT) + 2
+
+
+class WeatherUnavailable(Exception):
+    pass
+
+
+def weather_params(lat, lon):
+    return {'lat': lat, 'lon': lon, 'appid': settings.OPENWEATHER_API_KEY, 'units': 'metric'}
+
+
+def fetch_weather(lat, lon):
+    with external_call('openweathermap'):
+        response = get_session().get(WEATHER_URL, params=weather_params(lat, lon), timeout=DEFAULT_TIMEOUT)
+        response.raise_for_status()
+    return parse_weather(response.json())
+
+
+async def afetch_weather(lat, lon):
+    with external_call('openweathermap'):
+        response = await get_async_client().get(WEATHER_URL, params=weather_params(lat, lon))
+        response.raise_for_status()
+    return parse_weather(response.json())
+
+
+def parse_weather(weather_data):
+    return {
+        'name': weather_data.get('name', 'Unknown Location'),
+        'temp': weather_data['main']['temp'],
+        'description': weather_data['weather'][0]['description'],
+        'humidity': weather_data['main']['humidity'],
+        'wind_speed': weather_data['wind']['speed'],
+    }
+
+
+class WeatherProvider:
+    def __init__(self, fetch=fetch_weather, fresh_ttl=600, stale_ttl=3600, precision=2, afetch=afetch_weather):
+        self.fetch = fetch
+        self.afetch = afetch
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.precision = precision
+        self.in_flight = {}
+        self.tasks = {}  # (event loop, key) -> Task, the async counterpart of in_flight
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='weather')
+
+    def key(self, lat, lon):
+        return f'forum:weather:{round(lat, self.precision)}:{round(lon, self.precision)}'
+
+    def get(self, lat, lon):
+        key = self.key(lat, lon)
+        entry = cache.get(key)
+        if entry is not None:
+            if time.time() - entry['fetched_at'] > self.fresh_ttl:
+                # stale: answer now, refresh behind the scenes
+                self.refresh(key, lat, lon, background=True)
+            return entry['data']
+        try:
+            return self.refresh(key, lat, lon).result(timeout=WAIT_TIMEOUT)
+        except FutureTimeout:
+            raise WeatherUnavailable(f"No answer for {key} within {WAIT_TIMEOUT}s")
+
+    def refresh(self, key, lat, lon, background=False):
+        """Start (or join) the upstream call for ``key`` and return its Future."""
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self.in_flight[key] = future
+        if background:
+            self.executor.submit(self._load, key, lat, lon, future)
+        else:
+            self._load(key, lat, lon, future)
+        return future
+
+    def _load(self, key, lat, lon, future):
+        try:
+            data = self.fetch(lat, lon)
+        except FETCH_ERRORS as e:
+            logger.warning("Weather lookup failed for %s: %s", key, e)
+            future.set_exception(WeatherUnavailable(str(e)))
+        except Exception as e:
+            # e.g. a response that isn't the JSON object we expect; the future must still
+            # be resolved or every request waiting on it hangs
+            logger.exception("Weather lookup failed for %s", key)
+            future.set_exception(WeatherUnavailable(str(e)))
+        else:
+            cache.set(key, {'data': data, 'fetched_at': time.time()}, self.stale_ttl)
+            future.set_result(data)
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    async def aget(self, lat, lon):
+        if not native_async():
+            return await sync_to_async(self.get, thread_sensitive=False)(lat, lon)
+        key = self.key(lat, lon)
+        entry = await cache.aget(key)
+        if entry is not None:
+            if time.time() - entry['fetched_at'] > self.fresh_ttl:
+                # the thread pool refresh outlives this request's event loop
+                self.refresh(key, lat, lon, background=True)
+            return entry['data']
+        return await self.arefresh(key, lat, lon)
+
+    def arefresh(self, key, lat, lon):
+        """Start (or join) the async upstream call for ``key`` on the running loop."""
+        loop = asyncio.get_running_loop()
+        task = self.tasks.get((loop, key))
+        if task is None:
+            task = loop.create_task(self._aload(key, lat, lon))
+            self.tasks[loop, key] = task
+            task.add_done_callback(lambda _: self.tasks.pop((loop, key), None))
+        return task
+
+    async def _aload(self, key, lat, lon):
+        try:
+            data = await self.afetch(lat, lon)
+        except FETCH_ERRORS as e:
+            logger.warning("Weather lookup failed for %s: %s", key, e)
+            raise WeatherUnavailable(str(e))
+        except Exception as e:
+            logger.exception("Weather lookup failed for %s", key)
+            raise WeatherUnavailable(str(e))
+        await cache.aset(key, {'data': data, 'fetched_at': time.time()}, self.stale_ttl)
+        return data
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_weather_provider():
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            config = getattr(settings, 'WEATHER_CACHE', {})
+            _provider = WeatherProvider(
+                fresh_ttl=config.get('FRESH_TTL', 600),
+                stale_ttl=config.get('STALE_TTL', 3600),
+                precision=config.get('PRECISION', 2),
+            )
+        return _provider
@@ -0,0 +1,17 @@
+"""
+Gunicorn settings, loaded automatically from the working directory.
+
+SERVER_MODE=asgi serves our_circle.asgi with uvicorn workers, so the async
+views (weather, geocode) wait on upstream APIs without tying up a worker;
+the default is the classic sync WSGI worker.
+"""
+import os
+
+if os.environ.get('SERVER_MODE') == 'asgi':
+    wsgi_app = 'our_circle.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'our_circle.wsgi:application'
+
+# our_circle/settings.py reads WEB_CONCURRENCY too: more than one worker needs REDIS_URL for its caches
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
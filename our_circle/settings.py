@@ -44,9 +44,23 @@ INSTALLED_APPS = [
 
 AUTH_USER_MODEL = 'forum.GUser'
 
+# request.user comes from a per-process cache checked against the user's version
+# stamp, see forum/auth.py; ModelBackend stays listed so sessions created before
+# the switch stay logged in (they are looked up uncached until the next login)
+AUTHENTICATION_BACKENDS = [
+    'forum.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE = {
+    'TTL': 60,
+    'MAX_ENTRIES': 1000,
+}
+
 MIDDLEWARE = [
+    'forum.middleware.ProfilingMiddleware',  # no-op unless PROFILING['ENABLED']
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'forum.middleware.AsyncWhiteNoiseMiddleware',
+    'forum.middleware.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,15 +100,168 @@ WSGI_APPLICATION = 'our_circle.wsgi.application'
 #         'NAME': BASE_DIR / 'db.sqlite3',
 #     }
 # }
+# Connections are kept open for DB_CONN_MAX_AGE seconds and health-checked
+# before reuse. DB_POOL_SIZE > 0 switches to a per-process pool of that many
+# connections instead (forum/dbpool.py), which also suits ASGI, where
+# per-thread persistent connections are never reused.
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2))  # gunicorn workers, same default as gunicorn.conf.py
+TASK_WORKERS = int(os.environ.get('TASK_WORKERS', 1))  # `manage.py run_worker` processes, see Procfile
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '0'))
+DB_CONN_MAX_AGE = 0 if DB_POOL_SIZE or SERVER_MODE == 'asgi' else int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+
+
+def database_config(config):
+    if config['ENGINE'] == 'django.db.backends.postgresql':
+        # the stock backend plus connect timing and the optional pool
+        config['ENGINE'] = 'forum.backends.postgresql'
+        if DB_POOL_SIZE:
+            config['POOL'] = {'MAX_SIZE': DB_POOL_SIZE, 'TIMEOUT': 10}
+    return config
+
+
 DATABASES = {
-    'default': dj_database_url.config(default='postgres://ub6vu61i9i2adp:pff8ec14934adfc5486817f841f38d8be25e3405acdb124d5ee75f48ee7d9ceef@c3gtj1dt5vh48j.cluster-czrs8kj4isg7.us-east-1.rds.amazonaws.com:5432/d4423op8jsd7ap')
+    'default': database_config(dj_database_url.config(conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True, default='postgres://ub6vu61i9i2adp:pff8ec14934adfc5486817f841f38d8be25e3405acdb124d5ee75f48ee7d9ceef@c3gtj1dt5vh48j.cluster-czrs8kj4isg7.us-east-1.rds.amazonaws.com:5432/d4423op8jsd7ap'))
 }
 # postgres://ub6vu61i9i2adp:pff8ec14934adfc5486817f841f38d8be25e3405acdb124d5ee75f48ee7d9ceef@c3gtj1dt5vh48j.cluster-czrs8kj4isg7.us-east-1.rds.amazonaws.com:5432/d4423op8jsd7ap
 if 'DATABASE_URL' not in os.environ:
     DATABASES['default'] = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / "db.sqlite3",
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    }
+
+# Read replicas for listing and search pages, see forum/routers.py
+# DATABASE_REPLICA_URLS is a comma-separated list of database URLs
+REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+for i, url in enumerate(REPLICA_URLS, 1):
+    DATABASES[f'replica{i}'] = database_config({
+        **dj_database_url.parse(url, conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True),
+        'TEST': {'MIRROR': 'default'},
+    })
+
+DATABASE_ROUTERS = ['forum.routers.ReplicaRouter']
+READ_REPLICAS = {
+    'DATABASES': [f'replica{i}' for i in range(1, len(REPLICA_URLS) + 1)],
+    'PIN_SECONDS': 5,  # clients read from the primary this long after they write
+    'RETRY_AFTER': 30,  # seconds before an unreachable replica is tried again
+}
+
+# Cache
+# Local memory by default; set REDIS_URL so every gunicorn worker and task
+# worker shares one cache and model-driven invalidation reaches all of them.
+# Without it and with more than one process writing (web workers, plus the
+# task workers unless TASKS['EAGER']), caches keyed on version stamps
+# (fragments, anonymous pages, ETags, the user cache) are switched off, see
+# forum/versions.py.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'our-circle',
     }
+}
+if 'REDIS_URL' in os.environ:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+
+def session_engine(cache_config, web_concurrency):
+    """
+    Sessions read from the cache and written through to the database, but only
+    with a cache every worker shares: a logout clears the session from one
+    worker's LocMemCache and the others would keep serving it until it expires.
+    """
+    if web_concurrency <= 1 or cache_config['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache':
+        return 'django.contrib.sessions.backends.cached_db'
+    return 'django.contrib.sessions.backends.db'
+
+
+SESSION_ENGINE = session_engine(CACHES['default'], WEB_CONCURRENCY)
+
+HOME_FEED_TTL = 300  # seconds, invalidated early by forum/signals.py
+
+# Template fragments are keyed on version stamps bumped by forum/signals.py,
+# so this only bounds how long unreachable old versions linger
+FRAGMENT_CACHE_TTL = 24 * 60 * 60
+
+# Write endpoints, see forum/ratelimit.py. IP limits are looser because a
+# campus network puts many students behind one address.
+RATE_LIMITS = {
+    'BACKEND': os.environ.get('RATE_LIMIT_BACKEND', 'cache'),
+    'PROXY_COUNT': int(os.environ.get('RATE_LIMIT_PROXY_COUNT', 0)),
+    'LIMITS': {
+        'vote': {'user': '30/m', 'ip': '300/m'},
+        'comment': {'user': '10/m', 'ip': '100/m'},
+        'post': {'user': '5/m', 'ip': '50/m'},
+        'report': {'user': '10/h', 'ip': '100/h'},
+    },
+}
+
+# Whole pages for logged-out visitors, keyed on the same version stamps,
+# see forum/pagecache.py
+PAGE_CACHE = {
+    'LOCK_TIMEOUT': 10,
+    'WAIT': 2.0,
+}
+
+# Followed-circles timeline: each circle's newest LIST_LENGTH posts are cached
+# and merged per user, see forum/timeline.py
+FOLLOWED_FEED = {
+    'LIST_LENGTH': 100,
+    'TTL': 60 * 60,
+}
+
+# Batch like/dislike counter writes per worker, e.g. {'MAX_PENDING': 500, 'MAX_AGE': 2.0}
+# None writes every vote straight away (still as an atomic increment)
+VOTE_BUFFER = None
+
+# External APIs
+
+OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY', 'f0ce8dd116d0a235d4a54eaa89c9591f')
+
+# Reverse geocoding for post/comment locations, see forum/geocoding.py
+# DEFERRED saves the row first and fills in the address from a job on the task queue
+GEOCODER = {
+    'BACKEND': 'forum.geocoding.NominatimBackend',
+    'OPTIONS': {'user_agent': 'our_circle_app', 'language': 'zh-CN'},
+    'PRECISION': 3,  # ~100m grid for the cache key
+    'MAX_ENTRIES': 10000,
+    'TTL': 24 * 60 * 60,
+    'DEFERRED': True,
+}
+
+# Weather readings per ~1km grid cell: fresh for FRESH_TTL, then served stale
+# while refreshing in the background until STALE_TTL
+WEATHER_CACHE = {
+    'FRESH_TTL': 600,
+    'STALE_TTL': 3600,
+    'PRECISION': 2,
+}
+
+# Database-backed job queue, see forum/tasks.py; jobs are run by `manage.py run_worker`
+# (the Procfile's worker process), which production must run or reports are never filed.
+# EAGER runs them inline instead, for tests or a dev server without a worker
+TASKS = {
+    'EAGER': os.environ.get('TASKS_EAGER') == '1',
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 10,  # seconds, doubled per retry
+    'MAX_BACKOFF': 60 * 60,
+    'POLL_INTERVAL': 1.0,
+}
+
+# Per-request timing and the /metrics/ endpoint, see forum/profiling.py
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED') == '1',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', '0.1')),
+    'SLOW_PROFILES': int(os.environ.get('PROFILING_SLOW_PROFILES', '0')),  # keep cProfile dumps of the N slowest
+    'PROFILE_DIR': os.path.join(BASE_DIR, 'profiles'),
+    'DUPLICATE_THRESHOLD': 3,
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -0,0 +1,17 @@
+"""
+Settings for ``manage.py test`` (picked by manage.py).
+
+The test runner is a single process, and runs queued jobs in it too
+(``Worker().run_pending()``), so the local-memory cache is shared by
+everything that runs and the version-stamped caches can be exercised.
+"""
+from .settings import *  # noqa: F401,F403
+
+WEB_CONCURRENCY = 1
+TASK_WORKERS = 0
+SESSION_ENGINE = session_engine(CACHES['default'], WEB_CONCURRENCY)
+
+if not REPLICA_URLS:
+    # nothing reads from it unless READ_REPLICAS is overridden; it lets the router
+    # tests run against the test database
+    DATABASES['replica1'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}